@@ -0,0 +1,166 @@
+"""
+Content analytics: which contents students view and download.
+
+record() appends events to a buffer of the process, the request that makes the
+buffer due (COURSES_ANALYTICS_BUFFER_SIZE events, or the oldest one
+COURSES_ANALYTICS_FLUSH_SECONDS old) writes it with one bulk insert. Rendering
+and media delivery only pay for appending to a list.
+
+The raw ContentEvent rows are append only. rollup() compacts them into one
+ContentDailyStat row per content, day and kind, prune() then deletes the raw
+rows older than COURSES_ANALYTICS_RETENTION_DAYS. Both run from the
+rollup_analytics command. report() reads the rollups only.
+"""
+
+import threading
+from datetime import datetime, time, timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Course, ContentEvent, ContentDailyStat
+
+
+VIEW = ContentEvent.VIEW
+DOWNLOAD = ContentEvent.DOWNLOAD
+
+
+class EventBuffer(object):
+    '''events waiting to be written
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = []
+        self._started = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, events):
+        '''buffers the events, returns whether the buffer should be written
+        '''
+
+        with self._lock:
+            self.events.extend(events)
+            if self._started is None:
+                self._started = monotonic()
+            return len(self.events) >= getattr(settings, 'COURSES_ANALYTICS_BUFFER_SIZE', 1000) or \
+                monotonic() - self._started >= getattr(settings, 'COURSES_ANALYTICS_FLUSH_SECONDS', 30)
+
+    def drain(self):
+        with self._lock:
+            events, self.events, self._started = self.events, [], None
+        return events
+
+
+buffer = EventBuffer()
+
+
+def record(kind, user, contents, created=None):
+    '''buffers an event of kind by user for each (content id, course id) in
+        contents, writes the buffer when due
+    '''
+
+    created = created or timezone.now()
+    if buffer.add([ContentEvent(content_id=content_id, course_id=course_id,
+                                user_id=user.pk, kind=kind, created=created)
+                   for content_id, course_id in contents]):
+        flush()
+
+
+def flush():
+    '''writes the buffered events, returns their number
+    '''
+
+    events = buffer.drain()
+    ContentEvent.objects.bulk_create(events, batch_size=500)
+    return len(events)
+
+
+def discard():
+    '''drops the buffered events, e.g. between tests
+    '''
+
+    return len(buffer.drain())
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+@transaction.atomic
+def rollup(since=None):
+    '''recomputes the daily stats from the day since on, by default from the
+        day before the last day rolled up, which may have missed late events.
+        days whose raw events were pruned are kept as they are
+
+    Returns:
+        [int] -- [number of daily stats written]
+    '''
+
+    first = ContentEvent.objects.aggregate(first=Min('created'))['first']
+    if first is None:
+        return 0
+    if since is None:
+        last = ContentDailyStat.objects.aggregate(last=Max('day'))['last']
+        since = last - timedelta(days=1) if last else timezone.localdate(first)
+    since = max(since, timezone.localdate(first))
+
+    rows = ContentEvent.objects.filter(created__gte=_start_of(since),
+                                       course_id__in=Course.objects.values('id')) \
+                               .annotate(day=TruncDate('created')) \
+                               .values('course_id', 'content_id', 'day', 'kind') \
+                               .annotate(events=Count('id'),
+                                         users=Count('user_id', distinct=True)) \
+                               .order_by()
+    ContentDailyStat.objects.filter(day__gte=since).delete()
+    stats = ContentDailyStat.objects.bulk_create(
+        [ContentDailyStat(**row) for row in rows], batch_size=500)
+    return len(stats)
+
+
+def prune(retention_days=None, batch_size=10000):
+    '''deletes the raw events of the days before the last retention_days, in
+        batches, leaving the days that aren't rolled up yet
+
+    Returns:
+        [int] -- [number of events deleted]
+    '''
+
+    if retention_days is None:
+        retention_days = getattr(settings, 'COURSES_ANALYTICS_RETENTION_DAYS', 30)
+    last = ContentDailyStat.objects.aggregate(last=Max('day'))['last']
+    if last is None:
+        return 0
+    cutoff = _start_of(min(timezone.localdate() - timedelta(days=retention_days), last))
+    deleted = 0
+    while True:
+        ids = list(ContentEvent.objects.filter(created__lt=cutoff)
+                                       .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ContentEvent.objects.filter(id__in=ids).delete()[0]
+
+
+def report(course, days=30):
+    '''the views and downloads of the contents of course over the last days,
+        from the daily stats
+
+    Returns:
+        [dict] -- [content id -> {'view': (events, student days), 'download': (events, student days)}]
+    '''
+
+    since = timezone.localdate() - timedelta(days=days - 1)
+    totals = {}
+    for row in ContentDailyStat.objects.filter(course=course, day__gte=since) \
+                                       .values('content_id', 'kind') \
+                                       .annotate(events=Sum('events'), users=Sum('users')) \
+                                       .order_by():
+        totals.setdefault(row['content_id'], {VIEW: (0, 0), DOWNLOAD: (0, 0)})[row['kind']] = \
+            (row['events'], row['users'])
+    return totals
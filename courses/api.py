@@ -0,0 +1,182 @@
+"""
+Read only JSON API of the courses.
+
+CourseTreeView returns a course with all its modules and typed content items,
+including the html each item renders to, in one response. Clients can ask for a
+subset of the fields with ?fields=title,modules.title,modules.contents.item.html
+and revalidate with If-None-Match or If-Modified-Since against the course's
+'updated' timestamp, which signals move forward on any change to the tree.
+"""
+
+import hashlib
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.contenttypes.models import ContentType
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.decorators.gzip import gzip_page
+from django.views.generic.base import View
+
+from students.enrollment import is_enrolled
+from .models import Course, Module, Content
+
+
+API_VERSION = 1
+
+
+def parse_fields(value):
+    '''turns 'title,modules.title' into {'title': {}, 'modules': {'title': {}}}.
+        an empty tree selects every field
+    '''
+
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def wants(tree, *path):
+    '''whether the field at path is selected by the tree
+    '''
+
+    for name in path:
+        if not tree:
+            return True
+        if name not in tree:
+            return False
+        tree = tree[name]
+    return True
+
+
+def select(data, tree):
+    '''keeps the fields of data selected by the tree
+    '''
+
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [select(value, tree) for value in data]
+    if isinstance(data, dict):
+        return {name: select(value, tree[name])
+                for name, value in data.items() if name in tree}
+    return data
+
+
+def serialize_item(request, item, html):
+    model_name = item._meta.model_name
+    data = {
+        'id': item.id,
+        'type': model_name,
+        'title': item.title,
+        'created': item.created,
+        'updated': item.updated,
+    }
+    if model_name == 'text':
+        data['content'] = item.content
+    elif model_name == 'video':
+        data['url'] = item.url
+        data['embed_backend'] = item.embed_backend
+        data['video_id'] = item.video_id
+        data['thumbnail_url'] = item.thumbnail_url
+    else:
+        # files are only served through the access checked view
+        data['url'] = request.build_absolute_uri(
+            reverse('content_media', args=[model_name, item.id]))
+        if model_name == 'image':
+            data['srcset'] = item.srcset
+            data['webp_srcset'] = item.webp_srcset
+    if html:
+        data['html'] = item.render()
+    return data
+
+
+@method_decorator(gzip_page, name='dispatch')
+class CourseTreeView(LoginRequiredMixin, View):
+    '''the whole tree of a course for its owner and enrolled students. the
+        modules, the contents and the items of each content type are loaded
+        with one query each
+    '''
+
+    raise_exception = True
+    # read only, its reads may go to a replica (educa/routers.py)
+    use_replica = True
+
+    def get_course(self, request, pk):
+        course = get_object_or_404(Course.objects.select_related('subject', 'owner'),
+                                   pk=pk)
+        if course.owner_id != request.user.id and \
+                not is_enrolled(request.user, course.id):
+            raise Http404('No course found')
+        return course
+
+    def get(self, request, pk):
+        course = self.get_course(request, pk)
+        # relative to the course, e.g. title,modules.contents.item.title
+        fields = request.GET.get('fields', '')
+        tree = parse_fields(fields)
+
+        # a new version of the tree or another selection is another representation
+        etag = '"v{}-{}-{}-{}"'.format(
+            API_VERSION, course.id, course.updated.timestamp(),
+            hashlib.md5(fields.encode()).hexdigest()[:8])
+        last_modified = http_date(course.updated.timestamp())
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=course.updated.timestamp())
+        if response is None:
+            response = JsonResponse({'version': API_VERSION,
+                                     'course': select(self.serialize(request, course, tree),
+                                                      tree)})
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        # private to the user, revalidated on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def serialize(self, request, course, tree):
+        data = {
+            'id': course.id,
+            'title': course.title,
+            'slug': course.slug,
+            'overview': course.overview,
+            'subject': {'id': course.subject.id,
+                        'title': course.subject.title,
+                        'slug': course.subject.slug},
+            'instructor': course.owner.get_full_name(),
+            'created': course.created,
+            'updated': course.updated,
+        }
+        if not wants(tree, 'modules'):
+            return data
+        modules = list(Module.objects.filter(course=course))
+        for module in modules:
+            module.content_list = []
+        with_items = wants(tree, 'modules', 'contents', 'item')
+        if wants(tree, 'modules', 'contents'):
+            by_id = {module.id: module for module in modules}
+            contents = Content.objects.filter(module__course=course)
+            if with_items:
+                contents = contents.with_items()
+            for content in contents:
+                by_id[content.module_id].content_list.append(content)
+        html = wants(tree, 'modules', 'contents', 'item', 'html')
+        data['modules'] = [{
+            'id': module.id,
+            'title': module.title,
+            'description': module.description,
+            'order': module.order,
+            'contents': [{
+                'id': content.id,
+                'order': content.order,
+                'type': ContentType.objects.get_for_id(content.content_type_id).model,
+                'item': serialize_item(request, content.item, html)
+                        if with_items and content.item is not None else None,
+            } for content in module.content_list],
+        } for module in modules]
+        return data
@@ -0,0 +1,400 @@
+"""
+Load benchmark of the courses, students and catalog pages.
+
+routes() builds the requests to make against a dataset from
+courses.synthetic, run() times them through the django test client and
+returns throughput, latency percentiles and SQL queries for every route.
+run_http() sends the GET routes from concurrent clients to the WSGI or ASGI
+deployment started by serve_wsgi() or serve_asgi(). The `benchmark` management command wraps them and saves the results
+as JSON.
+"""
+
+import functools
+import http.client
+import json
+import math
+import platform
+import re
+import socket
+import subprocess
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from courses import urls as courses_urls
+from students import urls as students_urls
+from educa.middleware import RequestTimings
+from .models import Content
+
+
+# user is None for anonymous requests
+Route = namedtuple('Route', 'name method url user data')
+
+# routes that change the data set for the following requests
+SKIPPED = {
+    'module_content_delete': 'deletes the content it is called with',
+}
+
+
+def routes(dataset):
+    '''the requests made by the benchmark, one or more per url name of
+        courses/urls.py and students/urls.py plus the catalog
+    '''
+
+    instructor = dataset.instructors[0]
+    course = next(c for c in dataset.courses if c.owner_id == instructor.id)
+    student = course.students.order_by('id').first()
+    if student is None:
+        student = dataset.students[0]
+        course.students.add(student)
+    modules = list(course.modules.all())
+    module = modules[0]
+    contents = list(Content.objects.filter(module__course=course)
+                                   .select_related('content_type'))
+    by_model = {}
+    for content in contents:
+        by_model.setdefault(content.content_type.model, content)
+
+    anonymous = [
+        Route('course_list', 'get', reverse('course_list'), None, None),
+        Route('course_list_subject', 'get',
+              reverse('course_list_subject', args=[course.subject.slug]),
+              None, None),
+        Route('course_detail', 'get', reverse('course_detail', args=[course.slug]),
+              None, None),
+        Route('course_search', 'get', reverse('course_search'), None,
+              {'q': 'python'}),
+        Route('student_registration', 'get', reverse('student_registration'),
+              None, None),
+    ]
+    instructor_routes = [
+        Route('manage_course_list', 'get', reverse('manage_course_list'),
+              instructor, None),
+        Route('course_create', 'get', reverse('course_create'), instructor, None),
+        Route('course_edit', 'get', reverse('course_edit', args=[course.id]),
+              instructor, None),
+        Route('course_delete', 'get', reverse('course_delete', args=[course.id]),
+              instructor, None),
+        Route('course_clone', 'get', reverse('course_clone', args=[course.id]),
+              instructor, None),
+        Route('course_module_update', 'get',
+              reverse('course_module_update', args=[course.id]), instructor, None),
+        Route('module_content_list', 'get',
+              reverse('module_content_list', args=[module.id]), instructor, None),
+        Route('module_content_create', 'get',
+              reverse('module_content_create', args=[module.id, 'text']),
+              instructor, None),
+        # the same order as stored, so repeated requests stay comparable
+        Route('module_order', 'post', reverse('module_order'), instructor,
+              {str(m.id): m.order for m in modules}),
+        Route('content_order', 'post', reverse('content_order'), instructor,
+              {str(c.id): c.order for c in contents if c.module_id == module.id}),
+        Route('student_bulk_enroll', 'get',
+              reverse('student_bulk_enroll', args=[course.id]), instructor, None),
+        Route('module_content_upload', 'get',
+              reverse('module_content_upload', args=[module.id]), instructor, None),
+        Route('course_analytics', 'get',
+              reverse('course_analytics', args=[course.id]), instructor, None),
+    ]
+    for model_name, content in sorted(by_model.items()):
+        instructor_routes.append(
+            Route('module_content_update', 'get',
+                  reverse('module_content_update',
+                          args=[content.module_id, model_name, content.object_id]),
+                  instructor, None))
+    student_routes = [
+        Route('student_course_list', 'get', reverse('student_course_list'),
+              student, None),
+        Route('student_course_detail', 'get',
+              reverse('student_course_detail', args=[course.id]), student, None),
+        Route('student_course_detail_module', 'get',
+              reverse('student_course_detail_module', args=[course.id, modules[-1].id]),
+              student, None),
+        Route('student_resume', 'get', reverse('student_resume'), student, None),
+        Route('student_enroll_course', 'post', reverse('student_enroll_course'),
+              student, {'course': course.id}),
+        Route('api_course_tree', 'get', reverse('api_course_tree', args=[course.id]),
+              student, None),
+    ]
+    for model_name in ('image', 'file'):
+        if model_name in by_model:
+            student_routes.append(
+                Route('content_media', 'get',
+                      reverse('content_media',
+                              args=[model_name, by_model[model_name].object_id]),
+                      student, None))
+    if 'image' in by_model:
+        student_routes.append(
+            Route('content_media_variant', 'get',
+                  reverse('content_media_variant',
+                          args=['image', by_model['image'].object_id, 'thumb']),
+                  student, None))
+    return anonymous + instructor_routes + student_routes
+
+
+def uncovered(benchmark_routes):
+    '''url names of courses/urls.py and students/urls.py that have no route
+        and are not skipped on purpose
+    '''
+
+    names = {pattern.name for pattern in courses_urls.urlpatterns +
+                                          students_urls.urlpatterns}
+    return sorted(names - {route.name for route in benchmark_routes} - set(SKIPPED))
+
+
+def percentile(values, percent):
+    '''nearest-rank percentile of a sorted list
+    '''
+
+    if not values:
+        return None
+    rank = max(int(math.ceil(percent / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def _client(user):
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    return client
+
+
+def _request(client, route):
+    if route.method == 'post' and route.name in ('module_order', 'content_order'):
+        return client.post(route.url, json.dumps(route.data),
+                           content_type='application/json')
+    return getattr(client, route.method)(route.url, route.data)
+
+
+def _statistics(route, durations, queries, statuses, total):
+    '''(label, statistics) of the timed requests of a route
+    '''
+
+    durations = sorted(durations)
+    label = '{} {} {}'.format(route.method.upper(), route.url,
+                              route.user.username if route.user else 'anonymous')
+    return label, {
+        'name': route.name,
+        'requests': len(durations),
+        'throughput': len(durations) / total if total else None,
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'queries_per_request': sum(queries) / float(len(queries)),
+        'max_queries': max(queries),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def run(dataset, requests=50, warmup=5, benchmark_routes=None):
+    '''makes every route requests times after warmup untimed requests, returns
+        {label: statistics} in the order of the routes
+    '''
+
+    clients = {}
+    results = {}
+    for route in benchmark_routes or routes(dataset):
+        user_id = route.user.id if route.user else None
+        if user_id not in clients:
+            clients[user_id] = _client(route.user)
+        client = clients[user_id]
+        for i in range(warmup):
+            _request(client, route)
+        durations = []
+        queries = []
+        statuses = {}
+        started = perf_counter()
+        for i in range(requests):
+            timings = RequestTimings()
+            start = perf_counter()
+            with connections['default'].execute_wrapper(timings):
+                response = _request(client, route)
+                if response.streaming:
+                    # the file is read while the response is consumed
+                    b''.join(response.streaming_content)
+                response.close()
+            durations.append(perf_counter() - start)
+            queries.append(timings.queries)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        total = perf_counter() - started
+        label, statistics = _statistics(route, durations, queries, statuses, total)
+        results[label] = statistics
+    return results
+
+
+# ===================================================================================
+# deployments, the same routes requested over HTTP from concurrent clients
+# ===================================================================================
+
+class _PoolWSGIServer(WSGIServer):
+    '''wsgiref server handling the connections in a fixed number of threads,
+        like the worker threads of a WSGI server such as gunicorn --threads
+    '''
+
+    def __init__(self, address, workers):
+        super(_PoolWSGIServer, self).__init__(address, _QuietHandler)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_wsgi(workers):
+    '''starts educa's WSGI application on a free local port, returns (port, stop)
+    '''
+
+    from educa.wsgi import application
+
+    server = _PoolWSGIServer(('127.0.0.1', 0), workers)
+    server.set_app(application)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.pool.shutdown()
+        server.server_close()
+    return server.server_address[1], stop
+
+
+def serve_asgi():
+    '''starts educa's ASGI application with uvicorn on a free local port.
+        returns (port, stop)
+    '''
+
+    import uvicorn
+
+    from educa.asgi import application
+
+    class Server(uvicorn.Server):
+        def install_signal_handlers(self):
+            # not the main thread
+            pass
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = Server(uvicorn.Config(application, lifespan='off', log_level='warning',
+                                   access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return sock.getsockname()[1], stop
+
+
+def _fetch(port, route, cookie):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        path = route.url
+        if route.data:
+            path += '?' + urlencode(route.data)
+        # the host the test settings allow
+        headers = {'Host': 'testserver'}
+        if cookie:
+            headers['Cookie'] = cookie
+        start = perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        duration = perf_counter() - start
+    finally:
+        connection.close()
+    # the query count reported by the PerformanceMiddleware
+    match = re.search(r'desc="(\d+) queries"', response.getheader('Server-Timing', ''))
+    return duration, int(match.group(1)) if match else 0, response.status
+
+
+def run_http(port, benchmark_routes, requests=50, warmup=5, concurrency=8):
+    '''requests the GET routes from concurrency client threads of a server
+        on port, returns {label: statistics} like run()
+    '''
+
+    cookies = {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for route in benchmark_routes:
+            if route.method != 'get':
+                continue
+            user_id = route.user.id if route.user else None
+            if user_id not in cookies:
+                cookies[user_id] = _session_cookie(route.user)
+            fetch = functools.partial(_fetch, port, route, cookies[user_id])
+            for i in range(warmup):
+                fetch()
+            started = perf_counter()
+            responses = list(pool.map(lambda i: fetch(), range(requests)))
+            total = perf_counter() - started
+            statuses = {}
+            for duration, queries, status in responses:
+                statuses[status] = statuses.get(status, 0) + 1
+            label, statistics = _statistics(route,
+                                            [duration for duration, q, s in responses],
+                                            [queries for d, queries, s in responses],
+                                            statuses, total)
+            results[label] = statistics
+    return results
+
+
+def _session_cookie(user):
+    if user is None:
+        return None
+    client = _client(user)
+    name = settings.SESSION_COOKIE_NAME
+    return '{}={}'.format(name, client.cookies[name].value)
+
+
+def environment():
+    '''what the results depend on besides the data set
+    '''
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connections['default'].vendor,
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, previous):
+    '''(label, field, before, after) for the routes of both runs
+    '''
+
+    for label, stats in results.items():
+        before = previous.get(label)
+        if before is None:
+            continue
+        for field in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+            if before.get(field) is not None and stats.get(field) is not None:
+                yield label, field, before[field], stats[field]
@@ -0,0 +1,40 @@
+from django.db import connections, router, transaction
+
+
+
+def bulk_create_with_ids(model, objs, batch_size=None):
+    '''bulk_create that sets the primary key of every object on all backends,
+        without sending signals either way.
+
+    postgresql returns the ids of a bulk insert. on sqlite the rows are inserted
+    in a transaction and the newest ids are read back: sqlite locks the whole
+    database for writing once the transaction has inserted, so they are ours
+    and were given in insertion order. other databases, e.g. MySQL, let other
+    transactions insert in between, there the objects are inserted one by one
+    '''
+
+    objs = list(objs)
+    if not objs:
+        return objs
+    using = router.db_for_write(model)
+    connection = connections[using]
+    manager = model._base_manager.using(using)
+    if getattr(connection.features, 'can_return_ids_from_bulk_insert', False) or \
+            getattr(connection.features, 'can_return_rows_from_bulk_insert', False):
+        return manager.bulk_create(objs, batch_size)
+    with transaction.atomic(using=using):
+        if connection.vendor == 'sqlite':
+            manager.bulk_create(objs, batch_size)
+            ids = list(reversed(manager.order_by('-pk')
+                                       .values_list('pk', flat=True)[:len(objs)]))
+        else:
+            # the insert of Model.save(), which returns the id of the row
+            fields = [field for field in model._meta.concrete_fields
+                      if field is not model._meta.auto_field]
+            ids = [manager._insert([obj], fields=fields, return_id=True, using=using)
+                   for obj in objs]
+    for obj, id in zip(objs, ids):
+        obj.pk = id
+        obj._state.adding = False
+        obj._state.db = using
+    return objs
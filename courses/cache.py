@@ -0,0 +1,234 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.safestring import mark_safe
+
+
+
+class RenderCache(object):
+    '''stores the html rendered for content items so repeated page views don't
+        run the content templates again.
+
+    entries are keyed on the item's model, primary key and 'updated' timestamp.
+    any django cache backend can be used through the COURSES_RENDER_CACHE alias,
+    the size is bounded by the backend's MAX_ENTRIES (locmem evicts the least
+    recently used entries first)
+    '''
+
+    key_prefix = 'render'
+
+    def __init__(self, alias=None):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # counters of the current thread, read by the metrics middleware
+        self._local = threading.local()
+
+    @property
+    def cache(self):
+        alias = self.alias or getattr(settings, 'COURSES_RENDER_CACHE', 'default')
+        return caches[alias]
+
+    def make_key(self, item):
+        '''build the cache key for an item from (model, pk, updated)
+        '''
+
+        return '{}:{}:{}:{}'.format(self.key_prefix,
+                                    item._meta.label_lower,
+                                    item.pk,
+                                    item.updated.timestamp())
+
+    def get_or_render(self, item, render):
+        '''return the cached html for item, calling render() to build and
+            store it on a miss
+        '''
+
+        if item.pk is None or item.updated is None:
+            # unsaved items have no stable key
+            return render()
+        key = self.make_key(item)
+        html = self.cache.get(key)
+        if html is None:
+            self._count(hit=False)
+            html = render()
+            self.cache.set(key, html)
+        else:
+            self._count(hit=True)
+        return mark_safe(html)
+
+    def invalidate(self, item):
+        '''drop the html stored for the current state of item
+        '''
+
+        if item.pk is not None and item.updated is not None:
+            self.cache.delete(self.make_key(item))
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        name = 'hits' if hit else 'misses'
+        setattr(self._local, name, getattr(self._local, name, 0) + 1)
+
+    def thread_stats(self):
+        '''(hits, misses) counted by the current thread so far
+        '''
+
+        return (getattr(self._local, 'hits', 0),
+                getattr(self._local, 'misses', 0))
+
+    def stats(self):
+        '''hit/miss counters of this process, useful to size the cache
+        '''
+
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / total if total else 0.0}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+render_cache = RenderCache()
+
+
+def get_version(cache, key):
+    '''the version number stored at key. a version lost to eviction restarts
+        from the current time in milliseconds, above any version handed out before
+    '''
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no version yet, the next get_version() starts a newer one
+        pass
+
+
+class FragmentVersions(object):
+    '''version numbers of the template fragments cached per course, e.g. the
+        module navigation.
+
+    templates put the version among the vary_on values of the {% cache %} tag,
+    bumping it makes every fragment of the course miss without looking the
+    keys up. versions live in the cache the tag uses, 'template_fragments'
+    when configured
+    '''
+
+    key_prefix = 'fragment-version'
+
+    @property
+    def cache(self):
+        return caches['template_fragments' if 'template_fragments' in settings.CACHES
+                      else 'default']
+
+    def make_key(self, course_id):
+        return '{}:{}'.format(self.key_prefix, course_id)
+
+    def get(self, course_id):
+        return get_version(self.cache, self.make_key(course_id))
+
+    def bump(self, course_ids):
+        '''moves the fragments of the courses in course_ids to a new version
+        '''
+
+        for course_id in set(course_ids):
+            bump_version(self.cache, self.make_key(course_id))
+
+
+fragment_versions = FragmentVersions()
+
+
+class PageCache(object):
+    '''whole pages served to anonymous visitors, e.g. the course catalog,
+        stored by educa.middleware.PageCacheMiddleware for the views with
+        cache_anonymous_pages = True.
+
+    keys hold the catalog version, bump() moves every page to a new version
+    with one cache operation instead of looking up the keys of the pages. an
+    entry is fresh for COURSES_PAGE_CACHE_SECONDS and kept
+    COURSES_PAGE_CACHE_STALE_SECONDS longer: the first request to find it
+    expired takes a lock and renders the page again, the others get the stale
+    copy meanwhile, or the copy of the previous version after a bump
+    '''
+
+    key_prefix = 'page'
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'COURSES_PAGE_CACHE', 'default')]
+
+    def version(self):
+        return get_version(self.cache, '{}-version'.format(self.key_prefix))
+
+    def bump(self):
+        '''makes every cached page miss
+        '''
+
+        bump_version(self.cache, '{}-version'.format(self.key_prefix))
+
+    def make_key(self, request, version):
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return '{}:{}:{}'.format(self.key_prefix, version, url)
+
+    def get(self, request):
+        '''the cached page for request, or None when the view has to render
+            it. request._page_cache_key is set when the page rendered is to be stored
+        '''
+
+        version = self.version()
+        key = self.make_key(request, version)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            return self._response(entry)
+        if self.cache.add('{}:lock'.format(key), 1,
+                          getattr(settings, 'COURSES_PAGE_CACHE_LOCK_SECONDS', 10)):
+            request._page_cache_key = key
+            return None
+        # another request is rendering the page
+        if entry is None:
+            entry = self.cache.get(self.make_key(request, version - 1))
+        return self._response(entry) if entry is not None else None
+
+    def set(self, request, response):
+        '''stores the page rendered for a request get() let through
+        '''
+
+        key = getattr(request, '_page_cache_key', None)
+        if key is None:
+            return
+        try:
+            if response.status_code == 200 and not response.streaming and \
+                    not response.cookies:
+                fresh = getattr(settings, 'COURSES_PAGE_CACHE_SECONDS', 300)
+                stale = getattr(settings, 'COURSES_PAGE_CACHE_STALE_SECONDS', 60)
+                self.cache.set(key, (time.time() + fresh, response.content,
+                                     response['Content-Type']), fresh + stale)
+        finally:
+            self.cache.delete('{}:lock'.format(key))
+
+    def _response(self, entry):
+        expires, content, content_type = entry
+        return HttpResponse(content, content_type=content_type)
+
+
+page_cache = PageCache()
@@ -0,0 +1,108 @@
+"""
+Deep copies of courses, e.g. to run a course again next term.
+
+clone_course() copies a course with its modules, contents and content items
+using a fixed number of bulk inserts per model, whatever the size of the
+course. The files of file and image items are shared by reference unless
+copies are asked for. Shared files stay in place while any item points to
+them, see courses/orphans.py.
+"""
+
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import FileField
+from django.utils.text import slugify
+
+from . import counters, search
+from .bulk import bulk_create_with_ids
+from .models import Course, Module, Content, Text
+
+
+def unique_slug(slug):
+    '''slug, or slug-2, slug-3... when it is taken
+    '''
+
+    slug = slug[:190]
+    taken = set(Course.objects.filter(slug__startswith=slug).values_list('slug', flat=True))
+    candidate, number = slug, 1
+    while candidate in taken:
+        number += 1
+        candidate = '{}-{}'.format(slug, number)
+    return candidate
+
+
+def copy_item(item, owner, share_media=True):
+    '''an unsaved copy of a content item owned by owner
+    '''
+
+    copy = type(item)(**{field.attname: getattr(item, field.attname)
+                         for field in item._meta.concrete_fields
+                         if not field.primary_key})
+    copy.owner_id = owner.id
+    if not share_media:
+        for field in item._meta.concrete_fields:
+            source = getattr(item, field.attname)
+            if isinstance(field, FileField) and source:
+                # stored under a new name next to the original
+                setattr(copy, field.attname, source.storage.save(source.name, source))
+                source.close()
+    return copy
+
+
+@transaction.atomic
+def clone_course(course, owner=None, title=None, share_media=True, batch_size=500):
+    '''copies course with its modules, contents and items. the copy belongs
+        to owner, the owner of course by default
+
+    Returns:
+        [Course] -- [the new course]
+    '''
+
+    owner = owner or course.owner
+    clone = Course.objects.create(owner=owner,
+                                  subject_id=course.subject_id,
+                                  title=title or course.title,
+                                  slug=unique_slug(slugify(title or '') or course.slug),
+                                  overview=course.overview)
+
+    modules = list(Module.objects.filter(course=course))
+    copies = bulk_create_with_ids(Module, [Module(course=clone, title=module.title,
+                                                  description=module.description,
+                                                  order=module.order)
+                                           for module in modules], batch_size)
+    module_ids = {module.id: copy.id for module, copy in zip(modules, copies)}
+
+    # one query and one insert per content type
+    contents = list(Content.objects.filter(module__course=course)
+                                   .order_by('module_id', 'order'))
+    object_ids = defaultdict(set)
+    for content in contents:
+        object_ids[content.content_type_id].add(content.object_id)
+    item_ids = {}
+    texts = []
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        items = list(model.objects.filter(id__in=ids).order_by('id'))
+        item_copies = bulk_create_with_ids(model, [copy_item(item, owner, share_media)
+                                                   for item in items], batch_size)
+        item_ids.update(((content_type_id, item.id), copy.id)
+                        for item, copy in zip(items, item_copies))
+        if model is Text:
+            texts = item_copies
+    Content.objects.bulk_create([
+        Content(module_id=module_ids[content.module_id],
+                content_type_id=content.content_type_id,
+                object_id=item_ids[(content.content_type_id, content.object_id)],
+                order=content.order)
+        # contents whose item is gone are left out
+        for content in contents
+        if (content.content_type_id, content.object_id) in item_ids], batch_size)
+
+    # bulk_create sends no post_save, do what the signal handlers do
+    counters.refresh(Course, 'total_modules', [clone.id])
+    clone.total_modules = len(copies)
+    search.index_new([search.module_entry(module) for module in copies])
+    search.index_new([search.text_entry(text, clone.id) for text in texts])
+    return clone
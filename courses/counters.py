@@ -0,0 +1,85 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Subject, Course, Module
+
+
+
+def _count_subquery(model, field):
+    '''correlated subquery counting the rows of model that point to the outer row through field
+    '''
+
+    return Coalesce(Subquery(model.objects.filter(**{field: OuterRef('pk')})
+                                          .order_by()
+                                          .values(field)
+                                          .annotate(total=Count('pk'))
+                                          .values('total')), 0)
+
+
+def _filter(qs, ids):
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    return qs
+
+
+# the counters stored on each model: (model, counter field, counted model, foreign key on the counted model)
+COUNTERS = [
+    (Subject, 'total_courses', Course, 'subject'),
+    (Course, 'total_modules', Module, 'course'),
+    (Course, 'total_students', Course.students.through, 'course'),
+]
+
+
+def increment(model, pk, field, amount):
+    '''adds amount to a counter in a single UPDATE so concurrent writers don't overwrite each other
+    '''
+
+    value = F(field) + amount
+    if amount < 0:
+        # a counter that was never filled in stays at 0, the fields are unsigned
+        value = Greatest(value, 0)
+    model.objects.filter(pk=pk).update(**{field: value})
+
+
+def refresh(model, field, ids=None):
+    '''recomputes a counter from the related table for the rows in ids, or all rows
+    '''
+
+    for counter_model, counter_field, counted, fk in COUNTERS:
+        if counter_model is model and counter_field == field:
+            return _filter(model.objects.all(), ids).update(
+                **{field: _count_subquery(counted, fk)})
+    raise ValueError('Unknown counter {}.{}'.format(model.__name__, field))
+
+
+def fill(using='default'):
+    '''computes the counters still at 0, e.g. of the rows created before the
+        counters existed. connected to post_migrate in CoursesConfig.ready()
+
+    Returns:
+        [int] -- [number of rows updated]
+    '''
+
+    return sum(model.objects.using(using)
+                            .filter(**{field: 0})
+                            .update(**{field: _count_subquery(counted, fk)})
+               for model, field, counted, fk in COUNTERS)
+
+
+def refresh_all():
+    '''recomputes every counter, returns the number of rows updated
+    '''
+
+    return sum(refresh(model, field)
+               for model, field, counted, fk in COUNTERS)
+
+
+def find_mismatches():
+    '''yields (object, counter field, stored value, actual value) for every counter that is out of date
+    '''
+
+    for model, field, counted, fk in COUNTERS:
+        qs = model.objects.annotate(actual=_count_subquery(counted, fk)) \
+                          .exclude(**{field: F('actual')})
+        for obj in qs.iterator():
+            yield obj, field, getattr(obj, field), obj.actual
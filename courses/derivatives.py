@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+
+
+# (name, width, format), a None format keeps the source family (JPEG, or PNG
+# for images with transparency)
+VARIANTS = [
+    ('thumb', 320, None),
+    ('medium', 960, None),
+    ('thumb_webp', 320, 'WEBP'),
+    ('medium_webp', 960, 'WEBP'),
+]
+# bump when the variants change so the content addresses change too
+VERSION = 1
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+QUALITY = 82
+
+logger = logging.getLogger(__name__)
+_executor = None
+_executor_lock = threading.Lock()
+# monotonic time of the last eviction run by this process
+_last_eviction = None
+
+
+def is_available():
+    return PILImage is not None
+
+
+def get_executor():
+    '''process pool shared by the whole process, created on first use
+    '''
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'COURSES_DERIVATIVES_WORKERS', 2))
+        return _executor
+
+
+# ===================================================================================
+# worker side, no django models or database access here
+# ===================================================================================
+
+def file_digest(path):
+    digest = hashlib.sha256('v{}'.format(VERSION).encode())
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generate(source_path, media_root, directory):
+    '''builds the resized variants of an image and returns
+        {variant: {'name': path relative to media_root, 'width': width}}.
+        files are stored under a name derived from the hash of the source, so an
+        image uploaded twice shares its variants and existing files are reused.
+        the size of the directory is left to evict()
+    '''
+
+    digest = file_digest(source_path)
+    folder = os.path.join(directory, digest[:2])
+    os.makedirs(os.path.join(media_root, folder), exist_ok=True)
+    variants = {}
+    with PILImage.open(source_path) as source:
+        source.load()
+        has_alpha = source.mode in ('RGBA', 'LA', 'PA') or \
+                    (source.mode == 'P' and 'transparency' in source.info)
+        for name, width, format in VARIANTS:
+            format = format or ('PNG' if has_alpha else 'JPEG')
+            relative = os.path.join(folder, '{}-{}.{}'.format(digest, name,
+                                                              EXTENSIONS[format]))
+            target = os.path.join(media_root, relative)
+            if os.path.exists(target):
+                # mark as recently used for the eviction
+                os.utime(target)
+                with PILImage.open(target) as existing:
+                    size = existing.size
+            else:
+                image = source.copy()
+                image.thumbnail((width, width * 4))
+                if format == 'JPEG' and image.mode != 'RGB':
+                    image = image.convert('RGB')
+                elif format != 'JPEG' and image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if has_alpha else 'RGB')
+                temporary = '{}.{}.tmp'.format(target, os.getpid())
+                image.save(temporary, format=format, quality=QUALITY, optimize=True)
+                os.replace(temporary, target)
+                size = image.size
+            variants[name] = {'name': relative, 'width': size[0]}
+    return variants
+
+
+def evict(root, max_bytes):
+    '''removes the least recently generated or reused files until the
+        directory fits in max_bytes
+    '''
+
+    if not max_bytes or not os.path.isdir(root):
+        return 0
+    files = []
+    total = 0
+    for folder in os.scandir(root):
+        if not folder.is_dir():
+            continue
+        for entry in os.scandir(folder.path):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    removed = 0
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+# ===================================================================================
+# django side
+# ===================================================================================
+
+def pending_key(image_id):
+    return 'derivative-pending:{}'.format(image_id)
+
+
+def schedule(image, once=False):
+    '''queues the generation of the variants of an image content, the work
+        runs in the process pool once the current transaction is committed.
+        with once, nothing is queued while a generation of the image is pending,
+        e.g. for every request of a variant that was evicted
+    '''
+
+    if not is_available() or not image.file:
+        return
+    try:
+        path = image.file.path
+    except NotImplementedError:
+        # only files stored on the local disk can be resized
+        return
+    if once and not cache.add(pending_key(image.pk), True,
+                              getattr(settings, 'COURSES_DERIVATIVES_PENDING_SECONDS', 300)):
+        return
+    transaction.on_commit(lambda: submit(image.pk, path))
+
+
+def submit(image_id, source_path):
+    caller = threading.current_thread()
+    future = get_executor().submit(
+        generate, source_path, settings.MEDIA_ROOT,
+        getattr(settings, 'COURSES_DERIVATIVES_DIR', 'derivatives'))
+    future.add_done_callback(lambda future: store(image_id, future, caller))
+    return future
+
+
+def schedule_eviction():
+    '''runs evict() in the process pool, at most once every
+        COURSES_DERIVATIVES_EVICT_SECONDS so the directory isn't listed after
+        every generation. returns the future, or None when it isn't time yet
+    '''
+
+    global _last_eviction
+    max_bytes = getattr(settings, 'COURSES_DERIVATIVES_MAX_BYTES', None)
+    if not max_bytes:
+        return None
+    now = time.monotonic()
+    with _executor_lock:
+        if _last_eviction is not None and \
+                now - _last_eviction < getattr(settings, 'COURSES_DERIVATIVES_EVICT_SECONDS', 300):
+            return None
+        _last_eviction = now
+    return get_executor().submit(
+        evict, os.path.join(settings.MEDIA_ROOT,
+                            getattr(settings, 'COURSES_DERIVATIVES_DIR', 'derivatives')),
+        max_bytes)
+
+
+def store(image_id, future, caller=None):
+    '''records the generated variants on the image, runs in a thread of the pool.
+        'updated' changes too so the cached html of the item is rendered again
+        and the courses showing it get a new version
+    '''
+
+    # imported here, the worker processes only load the functions above
+    from django.contrib.contenttypes.models import ContentType
+    from django.utils import timezone
+    from .models import Image
+    from .signals import touch_courses
+
+    cache.delete(pending_key(image_id))
+    if future.exception() is not None:
+        logger.error('Could not build the variants of image %s', image_id,
+                     exc_info=future.exception())
+        return
+    schedule_eviction()
+    try:
+        Image.objects.filter(pk=image_id).update(variants=json.dumps(future.result()),
+                                                 updated=timezone.now())
+        # the srcset is part of the course tree served by the api
+        touch_courses(modules__contents__content_type=ContentType.objects.get_for_model(Image),
+                      modules__contents__object_id=image_id)
+    finally:
+        if threading.current_thread() is not caller:
+            # the pool's thread is not managed by django
+            connections.close_all()
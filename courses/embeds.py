@@ -0,0 +1,60 @@
+import logging
+
+import requests
+from embed_video.backends import detect_backend, EmbedVideoException, \
+                                 UnknownBackendException
+from embed_video.templatetags.embed_video_tags import VideoNode
+
+
+
+# size of the embedded player, as passed to the {% video %} tag
+EMBED_SIZE = 'small'
+# backends that parse the video id and player url from the video url itself,
+# the others ask the provider's api
+OFFLINE_BACKENDS = ('YoutubeBackend', 'VimeoBackend')
+# thumbnails that can be built without asking the provider if they exist
+LOCAL_THUMBNAILS = {
+    'YoutubeBackend': '{protocol}://img.youtube.com/vi/{code}/hqdefault.jpg',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def resolve(url, online=True):
+    '''resolves the embed metadata of a video url the way the {% video %} tag
+        of django-embed-video does, once instead of on every render
+
+    Returns:
+        [tuple] -- [dict of embed_backend, video_id, embed_html and thumbnail_url,
+                    and whether it is complete. it isn't when online is off or the
+                    provider couldn't be reached, the missing parts are empty]
+    '''
+
+    data = {'embed_backend': '', 'video_id': '', 'embed_html': '', 'thumbnail_url': ''}
+    try:
+        backend = detect_backend(url)
+    except UnknownBackendException:
+        # nothing to embed, the template links the url
+        return data, True
+    data['embed_backend'] = backend.backend
+    if backend.backend not in OFFLINE_BACKENDS and not online:
+        return data, False
+    try:
+        data['video_id'] = backend.code or ''
+        data['embed_html'] = backend.get_embed_code(*VideoNode.get_size(EMBED_SIZE))
+        thumbnail = LOCAL_THUMBNAILS.get(backend.backend)
+        if thumbnail:
+            data['thumbnail_url'] = thumbnail.format(protocol=backend.protocol,
+                                                     code=backend.code)
+        elif online:
+            data['thumbnail_url'] = backend.thumbnail or ''
+        else:
+            return data, False
+    except requests.RequestException:
+        logger.warning('Could not reach the provider of video %s', url, exc_info=True)
+        return data, False
+    except EmbedVideoException:
+        # unknown id or removed video, retrying won't help
+        logger.warning('Could not resolve video %s', url, exc_info=True)
+        return dict(data, embed_html=''), True
+    return data, True
@@ -1,11 +1,17 @@
-from django.db import models
-from  django.core.exceptions import ObjectDoesNotExist
+import sqlite3
+
+from django.apps import apps
+from django.db import models, connections, router, transaction, IntegrityError
+from django.db.models import F, Max
 
 
 
 class OrderField(models.PositiveIntegerField):
     '''this is a custom field that inherits from PositiveIntegerField this will allow the app to define an ordr for objects
-    
+
+    new values are allocated atomically from a sequence kept per group of objects
+    (the values of 'for_fields'), so concurrent writers never get the same order
+
     Arguments:
         models {PositiveIntegerField} -- [easily specifies the order of objects]
     '''
@@ -20,30 +26,8 @@ class OrderField(models.PositiveIntegerField):
         # if the fields value is different than 'None' we calculate the
         # order it is given
         if getattr(model_instance, self.attname) is None:
-            # no current value
-            try:
-                # build a queryset to retrieve all objects for field's model
-                # we retrieve the model class the field belongs to with
-                # 'self.model
-                qs = self.model.objects.all()
-                # we filter the queryset by the field's current value 
-                # for the fields that are defined in 'for_fields' paramater
-                # of the field, if any
-                if self.for_fields:
-                    # filter by objects with same field values
-                    # for the fields in 'for_fields'
-                    query = {field: getattr(model_instance, field)\
-                    for field in self.for_fields}
-                    qs = qs.filter(**query)
-                # get the order of the last item
-                # retrieve the object with the highest order with 'last_item'
-                last_item = qs.latest(self.attname)
-                # if an object is found we assume this is the highest order
-                # found and add 1 to it
-                value = last_item.order + 1
-            except ObjectDoesNotExist:
-                # if no object is found we assume this is the first one and assign 0 to it
-                value = 0
+            # no current value, take the next one from the group's sequence
+            value = self.allocate(model_instance)
             # assign the calculated order to the field's value using setattr
             # and return it
             setattr(model_instance, self.attname, value)
@@ -54,4 +38,89 @@ class OrderField(models.PositiveIntegerField):
             return super(OrderField,
                          self) .pre_save(model_instance, add)
 
+    def group_attnames(self):
+        '''the column attributes ('course_id', 'module_id'...) of the fields in 'for_fields'
+        '''
+
+        return [self.model._meta.get_field(field).attname
+                for field in self.for_fields or []]
+
+    def group_filter(self, model_instance):
+        '''filter arguments that select the objects in the same group as model_instance
+        '''
+
+        return {attname: getattr(model_instance, attname)
+                for attname in self.group_attnames()}
+
+    def group_key(self, group):
+        '''name of the sequence for a group, e.g. 'courses.content:module_id=4'
+        '''
+
+        return '{}:{}'.format(self.model._meta.label_lower,
+                              ','.join('{}={}'.format(attname, group[attname])
+                                       for attname in sorted(group)))
+
+    def allocate(self, model_instance, count=1):
+        '''reserves 'count' contiguous order values for the group of model_instance
+            and returns the first one.
+            the sequence is incremented with a single UPDATE so two writers can't
+            get the same value, the first allocation of a group starts after the
+            highest order already stored
+        '''
+
+        Sequence = apps.get_model('courses', 'OrderSequence')
+        using = router.db_for_write(self.model, instance=model_instance)
+        group = self.group_filter(model_instance)
+        key = self.group_key(group)
+        value = self._increment(Sequence, key, count, using)
+        if value is not None:
+            return value
+        # first allocation for this group
+        start = self._next_free(group, using)
+        try:
+            with transaction.atomic(using=using):
+                Sequence.objects.using(using).create(key=key,
+                                                     next_value=start + count)
+            return start
+        except IntegrityError:
+            # another writer created the sequence first
+            return self._increment(Sequence, key, count, using)
+
+    def _next_free(self, group, using):
+        last = self.model._base_manager.using(using) \
+                                       .filter(**group) \
+                                       .aggregate(last=Max(self.attname))['last']
+        return 0 if last is None else last + 1
+
+    def _increment(self, Sequence, key, count, using):
+        '''adds count to the sequence and returns the first reserved value,
+            or None when the sequence doesn't exist yet
+        '''
+
+        connection = connections[using]
+        if self._can_update_returning(connection):
+            # a single statement that increments and reads the sequence
+            qn = connection.ops.quote_name
+            sql = 'UPDATE {table} SET {next} = {next} + %s WHERE {key} = %s RETURNING {next}'.format(
+                table=qn(Sequence._meta.db_table),
+                next=qn('next_value'),
+                key=qn('key'))
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [count, key])
+                row = cursor.fetchone()
+            return None if row is None else row[0] - count
+        with transaction.atomic(using=using):
+            # the UPDATE holds the row lock until the value is read back
+            sequence = Sequence.objects.using(using).filter(key=key)
+            if not sequence.update(next_value=F('next_value') + count):
+                return None
+            return sequence.values_list('next_value', flat=True).get() - count
+
+    @staticmethod
+    def _can_update_returning(connection):
+        if connection.vendor == 'postgresql':
+            return True
+        return connection.vendor == 'sqlite' and \
+            sqlite3.sqlite_version_info >= (3, 35)
+
 
@@ -1,4 +1,5 @@
 from django import forms
+from django.utils.text import slugify
 from django.forms.models import inlineformset_factory
 from .models import Course, Module
 
@@ -11,4 +12,29 @@ ModuleFormSet = inlineformset_factory(Course,
                                      extra=2,
                                     # boolean field rendered as checkbox for marking
                                     # objects you want to delete
-                                     can_delete=True)
\ No newline at end of file
+                                     can_delete=True)
+
+
+class BulkUploadForm(forms.Form):
+    '''form used by instructors to upload many files to a module at once
+    '''
+
+    files = forms.FileField(widget=forms.ClearableFileInput(attrs={'multiple': True}))
+
+
+class CourseCloneForm(forms.Form):
+    '''form used by instructors to copy one of their courses with its modules and contents
+    '''
+
+    title = forms.CharField(max_length=200)
+    # share the uploaded files of the course instead of copying them
+    share_media = forms.BooleanField(required=False, initial=True)
+
+    def clean_title(self):
+        '''the slug of the copy is made from the title, it needs letters or digits
+        '''
+
+        title = self.cleaned_data['title']
+        if not slugify(title):
+            raise forms.ValidationError('Use at least one latin letter or digit in the title.')
+        return title
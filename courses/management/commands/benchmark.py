@@ -0,0 +1,124 @@
+import json
+import shutil
+import tempfile
+from datetime import datetime
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment, \
+                              setup_databases, teardown_databases, override_settings
+
+from courses import benchmark, synthetic
+
+
+
+class Command(BaseCommand):
+    '''seeds a synthetic data set in a throwaway test database and times every
+        course, student and catalog page against it
+    '''
+
+    help = 'Run the load benchmark on a synthetic data set and save the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=4)
+        parser.add_argument('--courses', type=int, default=20)
+        parser.add_argument('--modules', type=int, default=10,
+                            help='modules per course')
+        parser.add_argument('--contents', type=int, default=10,
+                            help='contents per module')
+        parser.add_argument('--students', type=int, default=100)
+        parser.add_argument('--enrollments', type=int, default=3,
+                            help='courses each student is enrolled in')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=50,
+                            help='timed requests per route')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='untimed requests per route made first')
+        parser.add_argument('--server',
+                            choices=['client', 'wsgi', 'asgi'],
+                            default='client',
+                            help='test client requests one at a time, or concurrent '
+                                 'HTTP requests to a WSGI (wsgiref) or ASGI (uvicorn) '
+                                 'deployment, GET routes only')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='worker threads of the wsgi server')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='concurrent clients of the wsgi and asgi servers')
+        parser.add_argument('--output',
+                            help='file the JSON results are written to')
+        parser.add_argument('--compare',
+                            help='JSON results of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)['routes']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError('Could not read {}: {}'.format(options['compare'], e))
+        dataset_options = {name: options[name] for name in
+                           ('subjects', 'courses', 'modules', 'contents',
+                            'students', 'enrollments', 'seed')}
+
+        media_root = tempfile.mkdtemp(prefix='educa-benchmark-')
+        setup_test_environment(debug=False)
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for cache in caches.all():
+                    cache.clear()
+                dataset = synthetic.generate(**dataset_options)
+                routes = benchmark.routes(dataset)
+                for name in benchmark.uncovered(routes):
+                    self.stderr.write('No benchmark for the url {}'.format(name))
+                if options['server'] == 'client':
+                    results = benchmark.run(dataset, options['requests'],
+                                            options['warmup'], routes)
+                else:
+                    results = self.run_server(options, routes)
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        for label, stats in results.items():
+            self.stdout.write('{:<70} {:>8.1f} req/s  p50 {:>7.2f}  p95 {:>7.2f}  '
+                              'p99 {:>7.2f} ms  {:>5.1f} queries'.format(
+                                  label, stats['throughput'], stats['p50_ms'],
+                                  stats['p95_ms'], stats['p99_ms'],
+                                  stats['queries_per_request']))
+            if set(stats['statuses']) - {'200', '206', '302'}:
+                self.stderr.write('  unexpected responses {}'.format(stats['statuses']))
+        if previous is not None:
+            self.stdout.write('\nCompared with {}'.format(options['compare']))
+            for label, field, before, after in benchmark.compare(results, previous):
+                change = (after - before) / before * 100 if before else 0
+                self.stdout.write('{:<70} {:<20} {:>10.2f} -> {:>10.2f} ({:+.1f}%)'.format(
+                    label, field, before, after, change))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'created': datetime.utcnow().isoformat(),
+                           'environment': benchmark.environment(),
+                           'dataset': dataset_options,
+                           'server': options['server'],
+                           'workers': options['workers'],
+                           'concurrency': options['concurrency'],
+                           'requests': options['requests'],
+                           'warmup': options['warmup'],
+                           'routes': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS('Results saved to {}'.format(options['output'])))
+
+    def run_server(self, options, routes):
+        if options['server'] == 'asgi':
+            try:
+                port, stop = benchmark.serve_asgi()
+            except ImportError as e:
+                raise CommandError('The asgi benchmark needs uvicorn and asgiref: {}'.format(e))
+        else:
+            port, stop = benchmark.serve_wsgi(options['workers'])
+        try:
+            return benchmark.run_http(port, routes, options['requests'],
+                                      options['warmup'], options['concurrency'])
+        finally:
+            stop()
@@ -0,0 +1,60 @@
+import json
+import os
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from courses import derivatives
+from courses.models import Image
+from courses.signals import touch_courses
+
+
+
+class Command(BaseCommand):
+    '''builds the resized variants of the existing image contents with the process pool,
+        e.g. after changing the variants or clearing the derivatives folder
+    '''
+
+    help = 'Build the resized variants of all image contents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing',
+                            action='store_true',
+                            help='only images without variants')
+
+    def handle(self, *args, **options):
+        if not derivatives.is_available():
+            raise CommandError('Pillow is required to build image variants')
+        images = Image.objects.exclude(file='')
+        if options['missing']:
+            images = images.filter(variants='')
+        directory = getattr(settings, 'COURSES_DERIVATIVES_DIR', 'derivatives')
+        executor = derivatives.get_executor()
+        futures = {}
+        for image in images.only('id', 'file').iterator():
+            try:
+                path = image.file.path
+            except NotImplementedError:
+                self.stderr.write('Image {}: only files on the local disk can be resized'.format(
+                    image.id))
+                continue
+            futures[image.id] = executor.submit(
+                derivatives.generate, path, settings.MEDIA_ROOT, directory)
+        built = []
+        for id, future in futures.items():
+            try:
+                variants = future.result()
+            except Exception as e:
+                self.stderr.write('Image {}: {}'.format(id, e))
+                continue
+            Image.objects.filter(id=id).update(variants=json.dumps(variants),
+                                               updated=timezone.now())
+            built.append(id)
+        # the srcsets are part of the cached pages and the course tree api
+        touch_courses(modules__contents__content_type=ContentType.objects.get_for_model(Image),
+                      modules__contents__object_id__in=built)
+        derivatives.evict(os.path.join(settings.MEDIA_ROOT, directory),
+                          getattr(settings, 'COURSES_DERIVATIVES_MAX_BYTES', None))
+        self.stdout.write(self.style.SUCCESS('Built the variants of {} images'.format(len(built))))
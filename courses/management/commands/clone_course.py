@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from courses import cloning
+from courses.models import Course
+
+
+
+class Command(BaseCommand):
+    '''copies a course with its modules, contents and items, e.g. to run it again next term
+    '''
+
+    help = 'Clone a course with its modules and contents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', type=int)
+        parser.add_argument('--title',
+                            help='title of the copy, the slug is derived from it')
+        parser.add_argument('--owner',
+                            help='username of the owner of the copy, the owner of the course by default')
+        parser.add_argument('--copy-media',
+                            action='store_true',
+                            help='copy the uploaded files instead of sharing them')
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.get(id=options['course_id'])
+        except Course.DoesNotExist:
+            raise CommandError('Course {} does not exist'.format(options['course_id']))
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError('User {} does not exist'.format(options['owner']))
+        clone = cloning.clone_course(course, owner=owner, title=options['title'],
+                                     share_media=not options['copy_media'])
+        self.stdout.write(self.style.SUCCESS('Cloned "{}" as course {} ({})'.format(
+            course, clone.id, clone.slug)))
@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from courses import orphans
+
+
+
+class Command(BaseCommand):
+    '''deletes the content items no content points to any more and the uploaded
+        files no file or image content points to, one batch at a time. meant
+        to run nightly, with a checkpoint file a stopped run carries on where it was
+    '''
+
+    help = 'Find and delete orphaned content items and media files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='only report the orphans, the files of orphaned file and '
+                                 'image items are found once the items are deleted')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=1000,
+                            help='rows or files checked per query')
+        parser.add_argument('--grace-hours',
+                            type=float,
+                            default=24,
+                            help='leave items and files newer than this, uploads '
+                                 'may not be linked to their content yet')
+        parser.add_argument('--checkpoint',
+                            help='JSON file the position is saved to after each batch '
+                                 'and resumed from, removed when the run completes')
+        parser.add_argument('--skip-items', action='store_true')
+        parser.add_argument('--skip-media', action='store_true')
+
+    def handle(self, *args, **options):
+        # a dry run doesn't move the position of the next real run
+        self.checkpoint = None if options['dry_run'] else options['checkpoint']
+        self.position = {'items': {}, 'media': ''}
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            try:
+                with open(self.checkpoint) as f:
+                    self.position = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError('Could not read {}: {}'.format(self.checkpoint, e))
+            self.stdout.write('Resuming from {}'.format(self.checkpoint))
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        verb = 'found' if dry_run else 'deleted'
+
+        if not options['skip_items']:
+            for model in orphans.ITEM_MODELS:
+                label = model._meta.model_name
+                found = 0
+                for last_id, ids in orphans.orphan_items(
+                        model, self.position['items'].get(label, 0),
+                        options['batch_size'], cutoff):
+                    if ids:
+                        found += len(ids) if dry_run else orphans.delete_items(model, ids)
+                    self.position['items'][label] = last_id
+                    self.save()
+                self.stdout.write('{}: {} orphaned items {}'.format(label, found, verb))
+
+        if not options['skip_media']:
+            found = 0
+            for last_name, names in orphans.orphan_media(self.position['media'],
+                                                         options['batch_size'],
+                                                         cutoff.timestamp()):
+                if options['verbosity'] > 1:
+                    for name in names:
+                        self.stdout.write('  {}'.format(name))
+                if names:
+                    found += len(names) if dry_run else orphans.delete_media(names)
+                self.position['media'] = last_name
+                self.save()
+            self.stdout.write('media: {} orphaned files {}'.format(found, verb))
+
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        self.stdout.write(self.style.SUCCESS('Collected orphans'))
+
+    def save(self):
+        if self.checkpoint:
+            temporary = '{}.tmp'.format(self.checkpoint)
+            with open(temporary, 'w') as f:
+                json.dump(self.position, f)
+            os.replace(temporary, self.checkpoint)
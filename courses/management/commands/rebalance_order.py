@@ -0,0 +1,85 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from courses.fields import OrderField
+from courses.models import OrderSequence
+
+
+
+class Command(BaseCommand):
+    '''renumbers the objects ordered by an OrderField so each group uses the
+        contiguous orders 0..n-1 again, and resets the group sequences.
+        gaps appear over time when objects are deleted or an allocation is not used
+    '''
+
+    help = 'Renumber OrderField values without gaps and reset the order sequences'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models',
+                            nargs='*',
+                            help='models to rebalance as app_label.model, all by default')
+
+    def handle(self, *args, **options):
+        fields = self.get_order_fields(options['models'])
+        for field in fields:
+            groups, changed = self.rebalance(field)
+            self.stdout.write('{}.{}: {} groups, {} rows renumbered'.format(
+                field.model._meta.label, field.name, groups, changed))
+        self.stdout.write(self.style.SUCCESS('Rebalanced order'))
+
+    def get_order_fields(self, labels):
+        fields = [field for model in apps.get_models()
+                  for field in model._meta.fields
+                  if isinstance(field, OrderField)]
+        if labels:
+            labels = {label.lower() for label in labels}
+            unknown = labels - {field.model._meta.label_lower for field in fields}
+            if unknown:
+                raise CommandError('No OrderField on {}'.format(', '.join(sorted(unknown))))
+            fields = [field for field in fields
+                      if field.model._meta.label_lower in labels]
+        return fields
+
+    def rebalance(self, field):
+        model = field.model
+        attnames = field.group_attnames()
+        # the groups are read up front, no cursor stays open while rows are written
+        if attnames:
+            groups = list(model._base_manager.order_by(*attnames)
+                                             .values_list(*attnames)
+                                             .distinct())
+        else:
+            groups = [()] if model._base_manager.exists() else []
+        keys = set()
+        changed = 0
+        for values in groups:
+            group = dict(zip(attnames, values))
+            key = field.group_key(group)
+            changed += self.rebalance_group(field, group, key)
+            keys.add(key)
+        # drop the sequences of groups that no longer have objects
+        prefix = '{}:'.format(model._meta.label_lower)
+        stale = [key for key in OrderSequence.objects.filter(key__startswith=prefix)
+                                                     .values_list('key', flat=True)
+                 if key not in keys]
+        OrderSequence.objects.filter(key__in=stale).delete()
+        return len(groups), changed
+
+    def rebalance_group(self, field, group, key):
+        '''renumbers one group while its sequence row is locked, so no order
+            can be allocated in the group until the new next value is stored
+        '''
+
+        model = field.model
+        with transaction.atomic():
+            sequence, created = OrderSequence.objects.get_or_create(key=key)
+            sequence = OrderSequence.objects.select_for_update().get(pk=sequence.pk)
+            ids = list(model._base_manager.filter(**group)
+                                          .order_by(field.attname, 'pk')
+                                          .values_list('pk', flat=True))
+            count, rejected = model.objects.filter(**group).reorder(
+                {id: order for order, id in enumerate(ids)})
+            sequence.next_value = len(ids)
+            sequence.save(update_fields=['next_value'])
+        return count
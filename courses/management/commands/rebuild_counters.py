@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from courses import counters
+
+
+
+class Command(BaseCommand):
+    '''rebuilds the denormalized catalog counters (courses per subject, modules and students per course)
+    '''
+
+    help = 'Rebuild or verify the stored course, module and student counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify',
+                            action='store_true',
+                            help='only report counters that are out of date')
+
+    def handle(self, *args, **options):
+        mismatches = list(counters.find_mismatches())
+        for obj, field, stored, actual in mismatches:
+            self.stdout.write('{} "{}" {}: stored {}, actual {}'.format(
+                obj._meta.verbose_name, obj, field, stored, actual))
+        if options['verify']:
+            if mismatches:
+                raise CommandError('{} counters are out of date'.format(len(mismatches)))
+            self.stdout.write(self.style.SUCCESS('All counters are up to date'))
+            return
+        counters.refresh_all()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt counters, {} were out of date'.format(len(mismatches))))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from courses.models import Video
+
+
+
+class Command(BaseCommand):
+    '''resolves the embedded player and thumbnail of the video contents again, e.g.
+        after changing the player size or when the provider was unreachable on save
+    '''
+
+    help = 'Resolve the embed metadata of video contents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incomplete',
+                            action='store_true',
+                            help='only videos saved while their provider could not be reached')
+        parser.add_argument('--offline',
+                            action='store_true',
+                            help='only resolve what the urls tell, without the providers\' apis')
+
+    def handle(self, *args, **options):
+        videos = Video.objects.all()
+        if options['incomplete']:
+            videos = videos.filter(embed_resolved__isnull=True)
+        refreshed = incomplete = 0
+        for video in videos.iterator():
+            video.resolve_embed(online=not options['offline'])
+            # saving moves 'updated' forward, so the cached html is rendered again
+            video.save(update_fields=Video.embed_fields + ['updated'])
+            refreshed += 1
+            if video.embed_resolved is None:
+                incomplete += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Refreshed {} videos, {} still incomplete'.format(refreshed, incomplete)))
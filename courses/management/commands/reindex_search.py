@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from courses import search
+
+
+
+class Command(BaseCommand):
+    '''rebuilds the full text index of the course search from scratch
+    '''
+
+    help = 'Rebuild the course search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=500,
+                            help='number of objects indexed per batch')
+
+    def handle(self, *args, **options):
+        total = search.reindex(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed {} entries'.format(total)))
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses import analytics
+
+
+
+class Command(BaseCommand):
+    '''compacts the raw content events into daily stats and deletes the raw
+        events past their retention, meant to run nightly
+    '''
+
+    help = 'Roll up the content views and downloads into daily stats and prune the raw events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since',
+                            help='recompute the days from this one on (YYYY-MM-DD), '
+                                 'by default from the day before the last rolled up day')
+        parser.add_argument('--retention-days',
+                            type=int,
+                            help='days of raw events to keep, COURSES_ANALYTICS_RETENTION_DAYS by default')
+        parser.add_argument('--no-prune',
+                            action='store_true',
+                            help='keep all the raw events')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--since must be a date like 2020-01-31')
+        stats = analytics.rollup(since)
+        self.stdout.write(self.style.SUCCESS('Wrote {} daily stats'.format(stats)))
+        if not options['no_prune']:
+            deleted = analytics.prune(options['retention_days'])
+            self.stdout.write(self.style.SUCCESS('Deleted {} raw events'.format(deleted)))
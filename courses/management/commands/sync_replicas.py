@@ -0,0 +1,40 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from educa.routers import PRIMARY
+
+
+
+class Command(BaseCommand):
+    '''copies the sqlite primary database over the sqlite replicas, standing in
+        for the replication of a database server when testing locally
+    '''
+
+    help = 'Copy the SQLite primary database to the SQLite replicas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('replicas', nargs='*',
+                            help='aliases of the replicas, all the other sqlite databases by default')
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases are copied, '
+                               'the database server replicates the others')
+        aliases = options['replicas'] or [alias for alias in connections
+                                          if alias != PRIMARY and
+                                          connections[alias].vendor == 'sqlite']
+        primary.ensure_connection()
+        for alias in aliases:
+            if alias not in connections or connections[alias].vendor != 'sqlite':
+                raise CommandError('{} is not a SQLite database'.format(alias))
+            connections[alias].close()
+            # the backup api copies a consistent snapshot, even while it's written to
+            target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS('Copied {} to {}'.format(PRIMARY, alias)))
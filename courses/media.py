@@ -0,0 +1,174 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse, \
+                        HttpResponseRedirect, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+# compressed files are sent as they are stored, never decoded by the browser
+ENCODED_TYPES = {
+    'bzip2': 'application/x-bzip',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+
+
+def file_etag(stat):
+    return '"{:x}-{:x}"'.format(int(stat.st_mtime * 1000000), stat.st_size)
+
+
+def content_disposition(filename):
+    '''attachment header for filename, quoted and escaped when it is plain
+        ascii, percent-encoded (RFC 6266 filename*) otherwise
+    '''
+
+    if not all(' ' <= char <= '~' for char in filename):
+        return "attachment; filename*=utf-8''{}".format(quote(filename))
+    return 'attachment; filename="{}"'.format(
+        filename.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def parse_range(header, size):
+    '''parses a single 'bytes=start-end' range.
+
+    Returns:
+        [tuple] -- [(start, end) inclusive, None to send the whole file or False if the range can't be satisfied]
+    '''
+
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        # no range, several ranges or a syntax we don't support
+        return None
+    start, end = match.groups()
+    if start == '':
+        # suffix range, the last 'end' bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def read_range(file, start, length):
+    '''yields the bytes of file from start in chunks, closing it at the end
+    '''
+
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def range_matches(request, etag, mtime):
+    '''checks the If-Range header, a range only applies to the same version of the file
+    '''
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) == since
+
+
+def serve_file(request, field_file, as_attachment=False):
+    '''streams a file stored by a FileField with support for conditional GETs
+        (ETag, Last-Modified, 304) and single byte ranges (206).
+
+    the COURSES_MEDIA_OFFLOAD setting can hand the transfer to the web server:
+        'x-sendfile' -- sends the X-Sendfile header with the url-quoted file path
+                        (apache, lighttpd)
+        'x-accel-redirect' -- sends X-Accel-Redirect with COURSES_MEDIA_ACCEL_PREFIX
+                              followed by the url-quoted file name (nginx internal
+                              location)
+    '''
+
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        # remote storage, let it serve the file
+        return HttpResponseRedirect(field_file.url)
+    return serve_path(request, path, field_file.name, as_attachment)
+
+
+def serve_path(request, path, name, as_attachment=False):
+    '''same as serve_file for a file at path, name is the path relative to MEDIA_ROOT
+    '''
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404('No media found')
+    etag = file_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+    content_type, encoding = mimetypes.guess_type(path)
+    if encoding:
+        content_type = ENCODED_TYPES.get(encoding, 'application/octet-stream')
+    content_type = content_type or 'application/octet-stream'
+
+    response = get_conditional_response(request,
+                                        etag=etag,
+                                        last_modified=int(stat.st_mtime))
+    if response is None:
+        offload = getattr(settings, 'COURSES_MEDIA_OFFLOAD', None)
+        if offload == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            # percent-encoded, a raw ? or # or a non latin-1 name would not
+            # reach the server as the same path
+            response['X-Sendfile'] = quote(path)
+        elif offload == 'x-accel-redirect':
+            prefix = getattr(settings, 'COURSES_MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+        else:
+            response = _stream(request, path, stat, etag, content_type)
+        if as_attachment:
+            response['Content-Disposition'] = content_disposition(os.path.basename(path))
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Accept-Ranges'] = 'bytes'
+    # access is checked per user, shared caches must not keep the file
+    response['Cache-Control'] = 'private'
+    return response
+
+
+def _stream(request, path, stat, etag, content_type):
+    size = stat.st_size
+    byte_range = None
+    if range_matches(request, etag, stat.st_mtime):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+        return response
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(read_range(open(path, 'rb'), start, length),
+                                     status=206,
+                                     content_type=content_type)
+    response['Content-Length'] = length
+    response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+    return response
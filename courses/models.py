@@ -1,19 +1,154 @@
-from django.db import models
+import json
+
+from django.db import connections, models, transaction
+from django.dispatch import Signal
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 
+from . import embeds
+from .cache import render_cache
 from .fields import OrderField
 
 
 
-class Subject(models.Model):
+# sent by OrderQuerySet.reorder() with the 'ids' of the objects it moved and
+# the database alias 'using', queryset updates don't send post_save
+reordered = Signal()
+
+
+def is_whole_number(value):
+    '''true for non negative ints and strings of digits, e.g. the keys and
+        values of a JSON request. bools and floats are refused
+    '''
+
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return value >= 0
+    return isinstance(value, str) and value != '' and \
+        all('0' <= char <= '9' for char in value)
+
+
+class OrderQuerySet(models.QuerySet):
+    '''queryset for models ordered with an OrderField
+    '''
+
+    def reorder(self, orders):
+        '''applies a {id: order} mapping to the objects of this queryset.
+            ownership of the whole id set is validated with one query and the new
+            orders are written with a single UPDATE ... CASE inside a transaction.
+            ids that are invalid or not part of the queryset are rejected
+
+        Returns:
+            [tuple] -- [number of rows changed, list of rejected ids]
+        '''
+
+        wanted = {}
+        rejected = []
+        for id, order in orders.items():
+            if is_whole_number(id) and is_whole_number(order):
+                wanted[int(id)] = int(order)
+            else:
+                rejected.append(id)
+
+        field = self.model._meta.get_field('order')
+        attnames = field.group_attnames()
+        with transaction.atomic(using=self.db):
+            # only lock the rows of this model, not the ones joined by the filters
+            of = ('self',) if connections[self.db].features.has_select_for_update_of else ()
+            rows = list(self.select_for_update(of=of)
+                            .filter(id__in=wanted)
+                            .values_list('id', 'order', *attnames))
+            current = {row[0]: row[1] for row in rows}
+            rejected.extend(id for id in wanted if id not in current)
+            # only write the rows whose order actually changes
+            changes = {id: order for id, order in wanted.items()
+                       if id in current and current[id] != order}
+            if not changes:
+                return 0, rejected
+            new_order = models.Case(
+                *[models.When(id=id, then=models.Value(order))
+                  for id, order in changes.items()],
+                output_field=models.PositiveIntegerField())
+            changed = self.model._base_manager.using(self.db) \
+                                             .filter(id__in=changes) \
+                                             .update(order=new_order)
+            # keep the sequences of the groups ahead of the orders just written
+            last = {}
+            for row in rows:
+                if row[0] in changes:
+                    group = dict(zip(attnames, row[2:]))
+                    key = field.group_key(group)
+                    last[key] = max(last.get(key, 0), changes[row[0]])
+            for key, order in last.items():
+                OrderSequence.objects.using(self.db) \
+                                     .filter(key=key, next_value__lte=order) \
+                                     .update(next_value=order + 1)
+            reordered.send(sender=self.model, ids=list(changes), using=self.db)
+        return changed, rejected
+
+
+class OrderSequence(models.Model):
+    '''next free order value of each group of objects ordered by an OrderField,
+        e.g. the contents of one module
+    '''
+
+    key = models.CharField(max_length=255, unique=True)
+    next_value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '{} -> {}'.format(self.key, self.next_value)
+
+
+class CounterFieldsMixin(object):
+    '''keeps save() from writing the counter fields back, they are only
+        changed with F() updates so a stale instance can't overwrite them
+    '''
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        # a copy made with pk = None is inserted with its counters as they are
+        if not self._state.adding and self.pk is not None \
+                and not kwargs.get('force_insert') \
+                and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+                and field.attname not in deferred]
+        super(CounterFieldsMixin, self).save(*args, **kwargs)
+
+
+class ParentTrackingMixin(object):
+    '''remembers the parent id an instance was loaded with, so the counter
+        signals can tell it moved to another parent without a query
+    '''
+
+    parent_field = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ParentTrackingMixin, cls).from_db(db, field_names, values)
+        # None when the field was deferred
+        instance._loaded_parent_id = instance.__dict__.get(cls.parent_field)
+        return instance
+
+
+class Subject(CounterFieldsMixin, models.Model):
     '''the blueprints for an e-learning subject
     '''
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
+    # number of courses in the subject, kept up to date by signals
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_courses',)
 
     class Meta:
         ordering = ['title']
@@ -21,7 +156,7 @@ class Subject(models.Model):
     def __str__(self):
         return self.title
 
-class Course(models.Model):
+class Course(ParentTrackingMixin, CounterFieldsMixin, models.Model):
     '''the blueprints for an e-learning course
     '''
 
@@ -40,10 +175,19 @@ class Course(models.Model):
     overview = models.TextField()
     # date and time when course was created
     created = models.DateTimeField(auto_now_add=True)
+    # latest change to the course, its modules, contents or content items.
+    # signals keep it up to date, the course tree API uses it as its version
+    updated = models.DateTimeField(auto_now=True)
     # users that are enrolled in a course
     students = models.ManyToManyField(User,
                                     related_name='course_joined',
                                     blank=True)
+    # number of modules and enrolled students, kept up to date by signals
+    total_modules = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_modules', 'total_students')
+    parent_field = 'subject_id'
 
     class Meta:
         ordering = ['created']
@@ -51,7 +195,7 @@ class Course(models.Model):
     def __str__(self):
         return self.title
 
-class Module(models.Model):
+class Module(ParentTrackingMixin, models.Model):
     '''the blueprints for an e-learning module
     '''
     course = models.ForeignKey(Course,
@@ -65,6 +209,10 @@ class Module(models.Model):
     # of the last module of the same course
     order = OrderField(blank=True, for_fields=['course'])
 
+    objects = OrderQuerySet.as_manager()
+
+    parent_field = 'course_id'
+
     class Meta:
         ordering = ['order']
 
@@ -72,6 +220,19 @@ class Module(models.Model):
         return '{}. {}'.format(self.order, self.title)
 
 
+class ContentQuerySet(OrderQuerySet):
+    '''queryset for module contents that knows how to load the generic items in batches
+    '''
+
+    def with_items(self):
+        '''groups the contents by content_type and fetches the items of each
+            model (text, video, image, file) in a single query, instead of
+            one query per content when accessing content.item
+        '''
+
+        return self.prefetch_related('item')
+
+
 class Content(models.Model):
     '''represents the modules' contents and defines a generic relation to associate any kind of content
     '''
@@ -93,8 +254,13 @@ class Content(models.Model):
     # order is calculated with respect to the module field
     order = OrderField(blank=True, for_fields=['module'])
 
+    objects = ContentQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
+        # finds the contents of an item, for the media access check and the
+        # orphan collector
+        index_together = [('content_type', 'object_id')]
 
 
 
@@ -116,8 +282,13 @@ class ItemBase(models.Model):
         return self.title
 
     def render(self):
-        return render_to_string('courses/content/{}.html'.format(
-            self._meta.model_name), {'item': self})
+        '''renders the item's content template, reusing the html cached
+            for the item's current version when available
+        '''
+
+        return render_cache.get_or_render(self, lambda: render_to_string(
+            'courses/content/{}.html'.format(self._meta.model_name),
+            {'item': self}))
 
 class Text(ItemBase):
     '''stores text content
@@ -130,18 +301,137 @@ class File(ItemBase):
     '''stores files like PDFs
     '''
 
-    file = models.FileField(upload_to='files')
+    # indexed for the orphaned media files lookup of courses/orphans.py
+    file = models.FileField(upload_to='files', db_index=True)
 
 class Image(ItemBase):
     '''stores image files
     '''
 
-    file = models.FileField(upload_to='images')
+    file = models.FileField(upload_to='images', db_index=True)
+    # resized copies built in the background, a json object of
+    # {variant: {'name': ..., 'width': ...}}, see courses/derivatives.py
+    variants = models.TextField(blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Image, cls).from_db(db, field_names, values)
+        # the variants are only built again when another file is saved
+        loaded = instance.__dict__.get('file')
+        instance._loaded_file = getattr(loaded, 'name', loaded)
+        return instance
+
+    def get_variants(self):
+        return json.loads(self.variants) if self.variants else {}
+
+    def get_srcset(self, webp=False):
+        '''srcset attribute listing the jpeg/png or webp variants by width
+        '''
+
+        variants = sorted((variant['width'], name)
+                          for name, variant in self.get_variants().items()
+                          if name.endswith('_webp') == webp)
+        return ', '.join('{} {}w'.format(reverse('content_media_variant',
+                                                 args=['image', self.id, name]),
+                                         width)
+                         for width, name in variants)
+
+    @property
+    def srcset(self):
+        return self.get_srcset()
+
+    @property
+    def webp_srcset(self):
+        return self.get_srcset(webp=True)
 
 class Video(ItemBase):
     '''stores videos, we'll use urls to embed videos
     '''
 
     url = models.URLField()
+    # resolved from the url when the video is saved, see courses/embeds.py
+    embed_backend = models.CharField(max_length=50, blank=True, editable=False)
+    video_id = models.CharField(max_length=100, blank=True, editable=False)
+    embed_html = models.TextField(blank=True, editable=False)
+    thumbnail_url = models.URLField(max_length=500, blank=True, editable=False)
+    # when the provider was last reached, None while the parts that need it are missing
+    embed_resolved = models.DateTimeField(null=True, editable=False)
+
+    embed_fields = ['embed_backend', 'video_id', 'embed_html', 'thumbnail_url',
+                    'embed_resolved']
+
+    def resolve_embed(self, online=True):
+        '''stores the embed metadata of the url on the video, without saving it
+        '''
+
+        data, complete = embeds.resolve(self.url, online)
+        for name, value in data.items():
+            setattr(self, name, value)
+        self.embed_resolved = timezone.now() if complete else None
+
+
+class SearchEntry(models.Model):
+    '''a course, module or text content indexed by the public course search.
+        the full text index itself lives in a backend specific table, see courses/search.py
+    '''
+
+    KIND_CHOICES = (
+        ('course', 'Course'),
+        ('module', 'Module'),
+        ('text', 'Text'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    # course the result links to
+    course = models.ForeignKey(Course,
+                               related_name='search_entries',
+                               on_delete=models.CASCADE)
+    title = models.CharField(max_length=250)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return self.title
+
+
+class ContentEvent(models.Model):
+    '''a student viewing or downloading a content. append only, written in
+        batches by courses/analytics.py and compacted into ContentDailyStat
+    '''
+
+    VIEW = 'view'
+    DOWNLOAD = 'download'
+    KIND_CHOICES = (
+        (VIEW, 'View'),
+        (DOWNLOAD, 'Download'),
+    )
 
+    # plain ids instead of foreign keys: inserts don't check them, and deleting
+    # a course doesn't go through its events
+    content_id = models.PositiveIntegerField()
+    course_id = models.PositiveIntegerField()
+    user_id = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created = models.DateTimeField(db_index=True)
 
+
+class ContentDailyStat(models.Model):
+    '''the events of a content of one kind on one day, rolled up from ContentEvent
+    '''
+
+    course = models.ForeignKey(Course,
+                               related_name='daily_stats',
+                               on_delete=models.CASCADE)
+    content_id = models.PositiveIntegerField()
+    day = models.DateField()
+    kind = models.CharField(max_length=10, choices=ContentEvent.KIND_CHOICES)
+    events = models.PositiveIntegerField()
+    # distinct students that day
+    users = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('content_id', 'day', 'kind')
+        index_together = [('course', 'day')]
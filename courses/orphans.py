@@ -0,0 +1,111 @@
+"""
+Garbage collection of the content items and media files nothing points to.
+
+Content.item is a generic relation: deleting a course or a module removes its
+Content rows but leaves their items behind, and no item removes its uploaded
+file. orphan_items() walks an item table in id order, checking a batch of rows
+against the contents with one query, and orphan_media() walks the upload
+folders in name order, checking a batch of names against the indexed file
+columns. Both skip what is newer than a grace period, an upload may not be
+linked to its content yet, and both start after a given position, so a run
+over millions of rows can be stopped and resumed. The resized variants of
+images are left to the eviction of courses/derivatives.py.
+"""
+
+import os
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef
+
+from students.enrollment import batched
+from .models import Content, Text, File, Image, Video
+
+
+ITEM_MODELS = [Text, File, Image, Video]
+MEDIA_MODELS = [File, Image]
+
+
+def _in_use(model):
+    return Exists(Content.objects.filter(content_type=ContentType.objects.get_for_model(model),
+                                         object_id=OuterRef('pk')))
+
+
+def orphan_items(model, after=0, batch_size=1000, created_before=None):
+    '''yields (last id, ids of the orphaned items) for each batch of rows of
+        model, starting after the id after
+    '''
+
+    rows = model.objects.annotate(in_use=_in_use(model)).order_by('id')
+    while True:
+        batch = list(rows.filter(id__gt=after)
+                         .values_list('id', 'in_use', 'created')[:batch_size])
+        if not batch:
+            return
+        after = batch[-1][0]
+        yield after, [id for id, in_use, created in batch
+                      if not in_use and (created_before is None or created < created_before)]
+
+
+def delete_items(model, ids):
+    '''deletes the items in ids that are still orphaned, their files are
+        collected by the next media pass
+
+    Returns:
+        [int] -- [number of items deleted]
+    '''
+
+    return model.objects.filter(id__in=ids) \
+                        .annotate(in_use=_in_use(model)) \
+                        .filter(in_use=False) \
+                        .delete()[0]
+
+
+def _storage():
+    return MEDIA_MODELS[0]._meta.get_field('file').storage
+
+
+def _walk(folder, after):
+    '''(name, modified) of the files under folder of the media storage, in
+        the order of their path components, after the name after
+    '''
+
+    try:
+        entries = sorted(os.scandir(_storage().path(folder)), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        name = '{}/{}'.format(folder, entry.name)
+        parts = name.split('/')
+        if entry.is_dir(follow_symlinks=False):
+            # the whole folder comes before after
+            if after and after[:len(parts)] > parts:
+                continue
+            yield from _walk(name, after)
+        elif not after or parts > after:
+            yield name, entry.stat().st_mtime
+
+
+def orphan_media(after='', batch_size=1000, modified_before=None):
+    '''yields (last name, names of the orphaned files) for each batch of
+        files of the upload folders of the file and image contents, starting
+        after the name after. modified_before is a timestamp
+    '''
+
+    after = after.split('/') if after else []
+    folders = sorted({model._meta.get_field('file').upload_to for model in MEDIA_MODELS})
+    files = (file for folder in folders for file in _walk(folder, after))
+    for batch in batched(files, batch_size):
+        names = [name for name, modified in batch]
+        used = set()
+        for model in MEDIA_MODELS:
+            used.update(model.objects.filter(file__in=names).values_list('file', flat=True))
+        yield names[-1], [name for name, modified in batch
+                          if name not in used and
+                          (modified_before is None or modified < modified_before)]
+
+
+def delete_media(names):
+    storage = _storage()
+    for name in names:
+        storage.delete(name)
+    return len(names)
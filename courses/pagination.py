@@ -0,0 +1,154 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404
+
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    '''opaque, url safe representation of a list of json serializable values
+    '''
+
+    data = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode())
+    except Exception:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+class KeysetPage(object):
+    '''one page of results with the cursors to the neighbouring pages
+    '''
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator(object):
+    '''paginates a queryset with cursors on a unique sort key, (created, id) by default.
+        each page is fetched with a WHERE on the key of the last row seen instead of an
+        OFFSET, so deep pages cost the same as the first one
+    '''
+
+    def __init__(self, queryset, per_page, keys=('created', 'id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = keys
+
+    def encode_cursor(self, obj, direction):
+        values = [self.queryset.model._meta.get_field(key).value_to_string(obj)
+                  for key in self.keys]
+        return encode_cursor([direction] + values)
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, *values = decode_cursor(cursor)
+            if direction not in ('next', 'previous') or len(values) != len(self.keys):
+                raise ValueError
+            fields = [self.queryset.model._meta.get_field(key) for key in self.keys]
+            return direction, [field.to_python(value)
+                               for field, value in zip(fields, values)]
+        except Exception:
+            raise InvalidCursor(cursor)
+
+    def _after(self, values, descending=False):
+        '''Q object selecting the rows after values in the key order,
+            e.g. created > c OR (created = c AND id > i)
+        '''
+
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            equal = {k: v for k, v in zip(self.keys[:i], values[:i])}
+            condition |= Q(**equal) & Q(**{'{}__{}'.format(key, lookup): values[i]})
+        return condition
+
+    def page(self, cursor=None):
+        '''returns the page after (or before) the position encoded in cursor,
+            or the first page when there is no cursor
+        '''
+
+        direction, values = ('next', None)
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+        backwards = direction == 'previous'
+        ordering = ['-' + key if backwards else key for key in self.keys]
+        qs = self.queryset.order_by(*ordering)
+        if values is not None:
+            qs = qs.filter(self._after(values, descending=backwards))
+        # fetch one extra row to know if there are more pages
+        rows = list(qs[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        has_next = (more and not backwards) or (backwards and values is not None)
+        has_previous = (more and backwards) or (not backwards and values is not None)
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], 'next') if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], 'previous') if rows and has_previous else None)
+
+
+class KeysetPaginationMixin(object):
+    '''paginates the object list of a view with cursors read from the query string.
+        the page size is taken from the COURSES_PAGE_SIZE setting
+    '''
+
+    page_size = None
+    cursor_param = 'cursor'
+
+    def get_page_size(self):
+        return self.page_size or getattr(settings, 'COURSES_PAGE_SIZE', 20)
+
+    def paginate_keyset(self, queryset):
+        paginator = KeysetPaginator(queryset, self.get_page_size())
+        try:
+            return paginator.page(self.request.GET.get(self.cursor_param))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor')
+
+    def get_context_data(self, **kwargs):
+        '''used by list views, replaces the object list with the current page
+        '''
+
+        page = self.paginate_keyset(kwargs.pop('object_list', self.object_list))
+        context = super(KeysetPaginationMixin,
+                        self).get_context_data(object_list=page.object_list,
+                                               **kwargs)
+        context['page'] = page
+        return context
@@ -0,0 +1,328 @@
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import SearchEntry, Course, Module, Content, Text
+
+
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SqliteBackend(object):
+    '''full text index kept in an SQLite FTS5 table whose rowid is the SearchEntry id.
+        results are ranked with bm25, titles weigh more than bodies
+    '''
+
+    table = 'courses_search_fts'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS {} '
+                           'USING fts5(title, body)'.format(self.table))
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+
+    def update(self, entries):
+        rows = [(entry.id, entry.title, entry.body) for entry in entries]
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.table),
+                               [row[:1] for row in rows])
+            cursor.executemany('INSERT INTO {}(rowid, title, body) '
+                               'VALUES (%s, %s, %s)'.format(self.table), rows)
+
+    def remove(self, entry_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.table),
+                               [(id,) for id in entry_ids])
+
+    def search(self, words, after, limit):
+        # every word must match, as a prefix so 'prog' finds 'programming'
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        score = 'bm25({}, 10.0, 1.0)'.format(self.table)
+        sql = 'SELECT rowid, {score} FROM {table} WHERE {table} MATCH %s'.format(
+            score=score, table=self.table)
+        params = [match]
+        if after:
+            sql += ' AND ({score} > %s OR ({score} = %s AND rowid > %s))'.format(score=score)
+            params += [after[0], after[0], after[1]]
+        sql += ' ORDER BY 2, 1 LIMIT %s'
+        params.append(limit)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class PostgresBackend(object):
+    '''full text search on the SearchEntry table through a GIN indexed tsvector expression
+    '''
+
+    document = "to_tsvector('english', title || ' ' || body)"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE INDEX IF NOT EXISTS courses_searchentry_document '
+                           'ON {} USING GIN (({}))'.format(SearchEntry._meta.db_table,
+                                                          self.document))
+
+    def clear(self):
+        pass
+
+    def update(self, entries):
+        # the expression index is maintained by postgres itself
+        pass
+
+    def remove(self, entry_ids):
+        pass
+
+    def search(self, words, after, limit):
+        query = ' & '.join('{}:*'.format(word) for word in words)
+        # negate the rank so both backends sort ascending. float8, a float4 rank
+        # doesn't compare equal to the cursor value and ties would be skipped
+        score = '(-ts_rank({}, query))::float8'.format(self.document)
+        sql = ("SELECT id, {score} FROM {table}, to_tsquery('english', %s) query "
+               "WHERE {document} @@ query").format(score=score,
+                                                   table=SearchEntry._meta.db_table,
+                                                   document=self.document)
+        params = [query]
+        if after:
+            sql += ' AND ({score} > %s OR ({score} = %s AND id > %s))'.format(score=score)
+            params += [after[0], after[0], after[1]]
+        sql += ' ORDER BY 2, 1 LIMIT %s'
+        params.append(limit)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class LikeBackend(object):
+    '''fallback for the other databases, e.g. MySQL: no index to maintain,
+        every word has to be found in the title or the body and the results
+        come in id order, all with the same score
+    '''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def update(self, entries):
+        pass
+
+    def remove(self, entry_ids):
+        pass
+
+    def search(self, words, after, limit):
+        entries = SearchEntry.objects.using(self.connection.alias)
+        for word in words:
+            entries = entries.filter(Q(title__icontains=word) | Q(body__icontains=word))
+        if after:
+            entries = entries.filter(id__gt=after[1])
+        return [(id, 0.0) for id in entries.order_by('id')
+                                            .values_list('id', flat=True)[:limit]]
+
+
+BACKENDS = {
+    'sqlite': SqliteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend(using=None):
+    '''full text backend for the database that stores the search entries
+    '''
+
+    using = using or router.db_for_write(SearchEntry)
+    connection = connections[using]
+    return BACKENDS.get(connection.vendor, LikeBackend)(connection)
+
+
+# ===================================================================================
+# indexing
+# ===================================================================================
+
+def course_entry(course):
+    return SearchEntry(kind='course', object_id=course.id, course_id=course.id,
+                       title=course.title, body=course.overview)
+
+
+def module_entry(module):
+    return SearchEntry(kind='module', object_id=module.id, course_id=module.course_id,
+                       title=module.title, body=module.description)
+
+
+def text_entry(text, course_id):
+    return SearchEntry(kind='text', object_id=text.id, course_id=course_id,
+                       title=text.title, body=text.content)
+
+
+def text_course_id(text):
+    '''the course a text content belongs to, None until it is added to a module
+    '''
+
+    return Content.objects.filter(content_type=ContentType.objects.get_for_model(Text),
+                                  object_id=text.id) \
+                          .values_list('module__course_id', flat=True) \
+                          .first()
+
+
+def index(entry):
+    '''adds or replaces the entry for one object
+    '''
+
+    saved, created = SearchEntry.objects.update_or_create(
+        kind=entry.kind,
+        object_id=entry.object_id,
+        defaults={'course_id': entry.course_id,
+                  'title': entry.title,
+                  'body': entry.body})
+    get_backend().update([saved])
+    return saved
+
+
+def unindex(kind, object_id):
+    # removing the full text row is done by the SearchEntry post_delete handler
+    SearchEntry.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def unindex_content(content):
+    '''removes the text of a deleted content, unless another content still
+        holds it
+    '''
+
+    text_type = ContentType.objects.get_for_model(Text)
+    if content.content_type_id == text_type.id and \
+            not Content.objects.filter(content_type=text_type,
+                                       object_id=content.object_id).exists():
+        unindex('text', content.object_id)
+
+
+def unindex_texts(text_ids):
+    '''removes the texts of the contents of a deleted module that no other
+        content holds, with a fixed number of queries
+    '''
+
+    text_type = ContentType.objects.get_for_model(Text)
+    held = Content.objects.filter(content_type=text_type, object_id__in=text_ids) \
+                          .values_list('object_id', flat=True)
+    entries = SearchEntry.objects.filter(kind='text',
+                                         object_id__in=set(text_ids) - set(held))
+    entry_ids = list(entries.values_list('id', flat=True))
+    if entry_ids:
+        get_backend().remove(entry_ids)
+        # without the per entry post_delete, the full text rows are removed above
+        entries = SearchEntry.objects.filter(id__in=entry_ids)
+        entries._raw_delete(entries.db)
+
+
+def index_text(text):
+    course_id = text_course_id(text)
+    if course_id is not None:
+        index(text_entry(text, course_id))
+
+
+def index_new(entries, batch_size=500):
+    '''adds the entries of objects that were not indexed yet, e.g. created
+        with bulk_create, in batches. the entries have to be of the same kind
+    '''
+
+    backend = get_backend()
+    return sum(_index_batch(backend, entries[start:start + batch_size])
+               for start in range(0, len(entries), batch_size))
+
+
+def reindex(batch_size=500):
+    '''rebuilds the whole index, returns the number of entries
+    '''
+
+    backend = get_backend()
+    backend.create_index()
+    backend.clear()
+    with backend.connection.cursor() as cursor:
+        # no need for the per entry delete signals, the full text table is cleared already
+        cursor.execute('DELETE FROM {}'.format(SearchEntry._meta.db_table))
+    text_type = ContentType.objects.get_for_model(Text)
+    text_courses = dict(Content.objects.filter(content_type=text_type)
+                                       .values_list('object_id', 'module__course_id'))
+    sources = [
+        (Course.objects.all(), course_entry),
+        (Module.objects.all(), module_entry),
+        # texts that are not part of a module yet are skipped
+        (Text.objects.all(),
+         lambda text: text_entry(text, text_courses[text.id])
+                      if text.id in text_courses else None),
+    ]
+    total = 0
+    for queryset, make_entry in sources:
+        batch = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            entry = make_entry(obj)
+            if entry is None:
+                continue
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                total += _index_batch(backend, batch)
+                batch = []
+        total += _index_batch(backend, batch)
+    return total
+
+
+def _index_batch(backend, entries):
+    if not entries:
+        return 0
+    SearchEntry.objects.bulk_create(entries)
+    # bulk_create doesn't set the ids on every backend, read them back
+    ids = dict(((kind, object_id), id) for id, kind, object_id in
+               SearchEntry.objects.filter(kind=entries[0].kind,
+                                          object_id__in=[e.object_id for e in entries])
+                                  .values_list('id', 'kind', 'object_id'))
+    for entry in entries:
+        entry.id = ids[(entry.kind, entry.object_id)]
+    backend.update(entries)
+    return len(entries)
+
+
+# ===================================================================================
+# searching
+# ===================================================================================
+
+def search(query, after=None, limit=20):
+    '''ranked search over courses, modules and text contents.
+        'after' is the (score, id) of the last result of the previous page
+
+    Returns:
+        [tuple] -- [list of SearchEntry with a 'score' attribute, (score, id) to continue from or None]
+    '''
+
+    words = WORD_RE.findall(query.lower())
+    if not words:
+        return [], None
+    # the full text query and the entries come from the same database, a
+    # replica when the view reads from one
+    using = router.db_for_read(SearchEntry)
+    rows = get_backend(using).search(words, after, limit + 1)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    entries = SearchEntry.objects.using(using).select_related('course') \
+                                 .in_bulk([id for id, score in rows])
+    results = []
+    for id, score in rows:
+        if id in entries:
+            entry = entries[id]
+            entry.score = score
+            results.append(entry)
+    return results, (tuple(rows[-1][::-1]) if more else None)
@@ -0,0 +1,340 @@
+import threading
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, \
+                                     m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import counters, derivatives, search
+from .cache import fragment_versions, page_cache, render_cache
+from .models import ItemBase, Subject, Course, Module, Content, Text, \
+                    Image, Video, SearchEntry, reordered
+
+
+
+@receiver(pre_save)
+@receiver(post_delete)
+def invalidate_rendered_item(sender, instance, **kwargs):
+    '''drops the cached html of a content item when it is saved or deleted.
+        on pre_save the instance still holds the previous 'updated' value
+    '''
+
+    if isinstance(instance, ItemBase):
+        render_cache.invalidate(instance)
+
+@receiver(post_save, sender=Image)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    '''resizes the image in the process pool after the upload is committed,
+        saves that keep the file of the image don't resize it again
+    '''
+
+    name = instance.file.name if instance.file else ''
+    if raw or name == getattr(instance, '_loaded_file', None):
+        return
+    instance._loaded_file = name
+    derivatives.schedule(instance)
+
+@receiver(pre_save, sender=Video)
+def resolve_video_embed(sender, instance, raw=False, update_fields=None, **kwargs):
+    '''resolves the player and thumbnail of a video when its url is saved,
+        so rendering it is a local lookup
+    '''
+
+    if not raw and (update_fields is None or 'url' in update_fields):
+        instance.resolve_embed(online=getattr(settings, 'COURSES_VIDEO_EMBED_ONLINE', True))
+
+# ===================================================================================
+# catalog counters
+# ===================================================================================
+
+def _remember_parent(sender, instance, field):
+    '''stores the parent id saved in the database before the instance is saved,
+        so post_save can tell when an object moved to another parent. it is the
+        id the instance was loaded or last saved with, read from the database
+        only for instances built by hand with an existing pk
+    '''
+
+    instance._previous_parent_id = getattr(instance, '_loaded_parent_id', None)
+    if instance._previous_parent_id is None and instance.pk is not None:
+        instance._previous_parent_id = sender.objects.filter(
+            pk=instance.pk).values_list(field, flat=True).first()
+
+
+def _update_parent_counter(instance, created, parent_model, field, counter):
+    parent_id = getattr(instance, field)
+    previous_id = getattr(instance, '_previous_parent_id', None)
+    instance._loaded_parent_id = parent_id
+    if created or previous_id is None:
+        counters.increment(parent_model, parent_id, counter, 1)
+    elif previous_id != parent_id:
+        # the object moved to another parent
+        counters.increment(parent_model, previous_id, counter, -1)
+        counters.increment(parent_model, parent_id, counter, 1)
+
+
+# (model, pk) of the subjects, courses and modules being deleted by this
+# thread, their children deleted in the same cascade leave their counters,
+# timestamps and search entries to the handlers of the parent
+_deleting = threading.local()
+
+
+def _being_deleted(model, pk):
+    return (model, pk) in getattr(_deleting, 'objects', set())
+
+
+@receiver(pre_delete, sender=Subject)
+@receiver(pre_delete, sender=Course)
+@receiver(pre_delete, sender=Module)
+def start_cascade(sender, instance, **kwargs):
+    if not hasattr(_deleting, 'objects'):
+        _deleting.objects = set()
+    _deleting.objects.add((sender, instance.pk))
+
+
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+def end_cascade(sender, instance, **kwargs):
+    # the children are deleted before their parent
+    getattr(_deleting, 'objects', set()).discard((sender, instance.pk))
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_subject(sender, instance, **kwargs):
+    _remember_parent(sender, instance, 'subject_id')
+
+
+@receiver(post_save, sender=Course)
+def count_course(sender, instance, created, **kwargs):
+    _update_parent_counter(instance, created, Subject, 'subject_id', 'total_courses')
+
+
+@receiver(post_delete, sender=Course)
+def uncount_course(sender, instance, **kwargs):
+    if not _being_deleted(Subject, instance.subject_id):
+        counters.increment(Subject, instance.subject_id, 'total_courses', -1)
+
+
+@receiver(pre_save, sender=Module)
+def remember_module_course(sender, instance, **kwargs):
+    _remember_parent(sender, instance, 'course_id')
+
+
+@receiver(post_save, sender=Module)
+def count_module(sender, instance, created, **kwargs):
+    _update_parent_counter(instance, created, Course, 'course_id', 'total_modules')
+
+
+@receiver(post_delete, sender=Module)
+def uncount_module(sender, instance, **kwargs):
+    if not _being_deleted(Course, instance.course_id):
+        counters.increment(Course, instance.course_id, 'total_modules', -1)
+
+
+def fill_counters(using, **kwargs):
+    '''fills in the counters of the rows saved before they existed,
+        connected to post_migrate in CoursesConfig.ready()
+    '''
+
+    counters.fill(using)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def count_students(sender, instance, action, reverse, pk_set, **kwargs):
+    '''recounts the enrolled students of the courses affected by an enrollment change.
+        when the change is made from the user side (user.course_joined) pk_set holds course ids
+    '''
+
+    if not reverse:
+        course_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # remember the user's courses before they are cleared
+        instance._cleared_course_ids = list(
+            instance.course_joined.values_list('id', flat=True))
+        return
+    elif action == 'post_clear':
+        course_ids = getattr(instance, '_cleared_course_ids', [])
+    else:
+        course_ids = pk_set
+    if action in ('post_add', 'post_remove', 'post_clear') and course_ids:
+        counters.refresh(Course, 'total_students', course_ids)
+
+# ===================================================================================
+# search index
+# ===================================================================================
+
+def create_search_index(using, **kwargs):
+    '''creates the full text table once the database tables exist,
+        connected to post_migrate in CoursesConfig.ready()
+    '''
+
+    search.get_backend(using).create_index()
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index(search.course_entry(instance))
+
+
+@receiver(post_save, sender=Module)
+def index_module(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index(search.module_entry(instance))
+
+
+@receiver(post_save, sender=Text)
+def index_text(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_text(instance)
+
+
+@receiver(post_save, sender=Content)
+def index_content(sender, instance, created, raw=False, **kwargs):
+    '''texts can only be indexed once they belong to a module
+    '''
+
+    text_type = ContentType.objects.get_for_model(Text)
+    if created and not raw and instance.content_type_id == text_type.id:
+        search.index_text(instance.item)
+
+
+@receiver(post_delete, sender=Module)
+def unindex_module(sender, instance, **kwargs):
+    '''removes the module and the texts of its contents, once for the whole
+        module. the entries of a deleted course go with it
+    '''
+
+    text_ids = getattr(_deleting, 'texts', {}).pop(instance.pk, None)
+    if _being_deleted(Course, instance.course_id):
+        return
+    search.unindex('module', instance.id)
+    if text_ids:
+        search.unindex_texts(text_ids)
+
+
+@receiver(post_delete, sender=Text)
+def unindex_text(sender, instance, **kwargs):
+    search.unindex('text', instance.id)
+
+
+@receiver(post_delete, sender=Content)
+def unindex_content(sender, instance, **kwargs):
+    '''a text is only found while it belongs to a module, deleting a module
+        deletes its contents but leaves their items. the contents of a module
+        being deleted are unindexed together by unindex_module
+    '''
+
+    if _being_deleted(Module, instance.module_id):
+        if not hasattr(_deleting, 'texts'):
+            _deleting.texts = {}
+        if instance.content_type_id == ContentType.objects.get_for_model(Text).id:
+            _deleting.texts.setdefault(instance.module_id, set()).add(instance.object_id)
+        return
+    search.unindex_content(instance)
+
+
+@receiver(post_delete, sender=SearchEntry)
+def remove_search_entry(sender, instance, **kwargs):
+    # deleting a course cascades to its entries, they are removed together
+    # by remove_course_entries
+    if _being_deleted(Course, instance.course_id):
+        if not hasattr(_deleting, 'entries'):
+            _deleting.entries = {}
+        _deleting.entries.setdefault(instance.course_id, []).append(instance.id)
+        return
+    search.get_backend().remove([instance.id])
+
+
+@receiver(post_delete, sender=Course)
+def remove_course_entries(sender, instance, **kwargs):
+    entry_ids = getattr(_deleting, 'entries', {}).pop(instance.pk, None)
+    if entry_ids:
+        search.get_backend().remove(entry_ids)
+
+# ===================================================================================
+# course tree version
+# ===================================================================================
+
+def touch_courses(**lookups):
+    '''sets the 'updated' timestamp of the matching courses to now
+    '''
+
+    Course.objects.filter(**lookups).update(updated=timezone.now())
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def touch_module_course(sender, instance, raw=False, **kwargs):
+    if raw or _being_deleted(Course, instance.course_id):
+        return
+    course_ids = {instance.course_id, getattr(instance, '_previous_parent_id', None)}
+    touch_courses(id__in=[id for id in course_ids if id is not None])
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def touch_content_course(sender, instance, raw=False, **kwargs):
+    # a module being deleted touches its course once, see touch_module_course
+    if not raw and not _being_deleted(Module, instance.module_id):
+        touch_courses(modules__id=instance.module_id)
+
+
+@receiver(post_save)
+def touch_item_courses(sender, instance, raw=False, **kwargs):
+    if not raw and isinstance(instance, ItemBase):
+        touch_courses(modules__contents__content_type=ContentType.objects.get_for_model(sender),
+                      modules__contents__object_id=instance.pk)
+
+
+@receiver(reordered, sender=Module)
+def touch_reordered_modules(sender, ids, **kwargs):
+    touch_courses(modules__id__in=ids)
+
+
+@receiver(reordered, sender=Content)
+def touch_reordered_contents(sender, ids, **kwargs):
+    touch_courses(modules__contents__id__in=ids)
+
+# ===================================================================================
+# cached fragments
+# ===================================================================================
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def bump_module_fragments(sender, instance, raw=False, **kwargs):
+    '''the module navigation lists the titles and orders of the modules
+    '''
+
+    if raw:
+        return
+    course_ids = {instance.course_id, getattr(instance, '_previous_parent_id', None)}
+    fragment_versions.bump([id for id in course_ids if id is not None])
+
+
+@receiver(reordered, sender=Module)
+def bump_reordered_module_fragments(sender, ids, using=None, **kwargs):
+    fragment_versions.bump(Module.objects.using(using)
+                                         .filter(id__in=ids)
+                                         .values_list('course_id', flat=True))
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@receiver(reordered, sender=Module)
+def bump_catalog_pages(sender, raw=False, **kwargs):
+    '''the cached catalog pages show subjects, courses and their modules
+    '''
+
+    if raw:
+        return
+    page_cache.bump()
+    # again once committed, a page rendered meanwhile read the rows before the change
+    transaction.on_commit(page_cache.bump)
@@ -0,0 +1,160 @@
+"""
+Synthetic dataset for benchmarks and query budget tests.
+
+generate() loads the subjects fixture and adds subjects, instructors, courses,
+modules, mixed text/video/image/file contents and enrolled students. The same
+seed always gives the same dataset.
+"""
+
+import json
+import random
+import struct
+import zlib
+from collections import namedtuple
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters, derivatives, embeds, search
+from .bulk import bulk_create_with_ids
+from .models import Subject, Course, Module, Content, Text, Video, Image, File
+
+
+def _png(width, height):
+    '''a plain grey png, written once and shared by all the image contents
+    '''
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+               struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    rows = b''.join(b'\x00' + b'\x80\x80\x80' * width for i in range(height))
+    return b''.join([b'\x89PNG\r\n\x1a\n',
+                     chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(rows)),
+                     chunk(b'IEND', b'')])
+
+
+PDF = b'%PDF-1.1\n1 0 obj << /Type /Catalog >> endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n'
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+         'tempor incididunt ut labore et dolore magna aliqua algebra rhythm '
+         'quantum python physics harmony calculus velocity syntax').split()
+
+PASSWORD = 'benchmark'
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+Dataset = namedtuple('Dataset', 'instructors students subjects courses')
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for i in range(words))
+
+
+@transaction.atomic
+def generate(subjects=4, courses=10, modules=5, contents=10, students=20,
+             instructors=2, enrollments=3, seed=0):
+    '''creates the dataset and returns the created objects.
+
+    Arguments:
+        courses -- total number of courses
+        modules, contents -- per course and per module
+        enrollments -- number of courses each student is enrolled in
+    '''
+
+    rng = random.Random(seed)
+    call_command('loaddata', 'subjects', verbosity=0)
+    for number in range(Subject.objects.count(), subjects):
+        Subject.objects.create(title='Subject {}'.format(number),
+                               slug='subject-{}'.format(number))
+    subject_list = list(Subject.objects.all()[:subjects])
+
+    permissions = Permission.objects.filter(codename__in=['add_course',
+                                                          'change_course',
+                                                          'delete_course'])
+    instructor_list = []
+    for number in range(instructors):
+        user = User.objects.create_user('instructor{}'.format(number),
+                                        'instructor{}@example.com'.format(number),
+                                        PASSWORD,
+                                        first_name='Instructor',
+                                        last_name=str(number))
+        user.user_permissions.set(permissions)
+        instructor_list.append(user)
+    password = make_password(PASSWORD)
+    student_list = bulk_create_with_ids(User, [
+        User(username='student{}'.format(number),
+             email='student{}@example.com'.format(number),
+             password=password)
+        for number in range(students)])
+
+    course_list = bulk_create_with_ids(Course, [
+        Course(owner=instructor_list[number % instructors],
+               subject=subject_list[number % len(subject_list)],
+               title='Course {} {}'.format(number, _sentence(rng, 2)),
+               slug='course-{}'.format(number),
+               overview=_sentence(rng, 40))
+        for number in range(courses)])
+    module_list = bulk_create_with_ids(Module, [
+        Module(course=course, order=order,
+               title='Module {} {}'.format(order, _sentence(rng, 3)),
+               description=_sentence(rng, 20))
+        for course in course_list for order in range(modules)])
+
+    # the bulk inserts skip the signal that resolves the embed
+    video_embed, complete = embeds.resolve(VIDEO_URL, online=False)
+    video_embed['embed_resolved'] = timezone.now() if complete else None
+    image_name = default_storage.save('images/synthetic.png', ContentFile(_png(1280, 720)))
+    file_name = default_storage.save('files/synthetic.pdf', ContentFile(PDF))
+    kinds = [
+        (Text, lambda owner, title: Text(owner=owner, title=title,
+                                         content=_sentence(rng, 120))),
+        (Video, lambda owner, title: Video(owner=owner, title=title, url=VIDEO_URL,
+                                           **video_embed)),
+        (Image, lambda owner, title: Image(owner=owner, title=title, file=image_name)),
+        (File, lambda owner, title: File(owner=owner, title=title, file=file_name)),
+    ]
+    courses_by_id = {course.id: course for course in course_list}
+    items = {model: [] for model, make in kinds}
+    placements = []
+    for number, module in enumerate(module_list):
+        owner = courses_by_id[module.course_id].owner
+        for order in range(contents):
+            # rotate the kinds, every module with 4 contents or more has them all
+            model, make = kinds[(number + order) % len(kinds)]
+            items[model].append(make(owner, _sentence(rng, 4)))
+            placements.append((module, order, model, len(items[model]) - 1))
+    for model in items:
+        bulk_create_with_ids(model, items[model], batch_size=500)
+    Content.objects.bulk_create([
+        Content(module=module,
+                order=order,
+                content_type=ContentType.objects.get_for_model(model),
+                object_id=items[model][index].id)
+        for module, order, model, index in placements], batch_size=500)
+
+    Enrollment = Course.students.through
+    Enrollment.objects.bulk_create([
+        Enrollment(course_id=course.id, user_id=student.id)
+        for student in student_list
+        for course in rng.sample(course_list, min(enrollments, len(course_list)))],
+        batch_size=500)
+
+    # the bulk inserts skip the signals, bring the derived data up to date
+    counters.refresh_all()
+    search.reindex()
+    if derivatives.is_available():
+        # built inline, all the images share one source file
+        variants = derivatives.generate(
+            default_storage.path(image_name), settings.MEDIA_ROOT,
+            getattr(settings, 'COURSES_DERIVATIVES_DIR', 'derivatives'))
+        Image.objects.update(variants=json.dumps(variants))
+    return Dataset(instructor_list, student_list, subject_list, course_list)
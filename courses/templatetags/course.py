@@ -1,5 +1,7 @@
 from django import template
 
+from ..cache import fragment_versions
+
 register = template.Library()
 
 @register.filter
@@ -10,4 +12,20 @@ def model_name(obj):
     try:
         return obj._meta.model_name
     except AttributeError:
-        return None
\ No newline at end of file
+        return None
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    '''cursor_url template tag.  Builds the query string of the page at cursor keeping the other parameters of the current request
+    '''
+
+    query = context['request'].GET.copy()
+    query['cursor'] = cursor
+    return '?' + query.urlencode()
+
+@register.simple_tag
+def fragment_version(course):
+    '''fragment_version template tag.  The version of the cached fragments of a course, to vary the {% cache %} tag on
+    '''
+
+    return fragment_versions.get(getattr(course, 'pk', course))
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+Query budget harness for the view tests.
+
+QueryBudgetTestCase.assertQueryBudget() requests a page against a small and a
+larger synthetic data set and fails when the page makes more queries than its
+budget, or more queries as the data set grows. The failure message lists the
+SQL grouped by the template line or project code that ran it.
+
+create_course() and add_text() make the small course most other tests start
+from.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+
+from students import progress
+from . import analytics, synthetic
+from .models import Subject, Course, Content, Text
+
+
+
+class QueryLog(object):
+    '''connection.execute_wrapper hook that keeps every query with the place it came from
+    '''
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, call_site(sys._getframe(1))))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def by_call_site(self):
+        '''{call site: [sql, ...]} with the call sites that ran most queries first
+        '''
+
+        grouped = OrderedDict()
+        for sql, site in self.queries:
+            grouped.setdefault(site, []).append(sql)
+        return OrderedDict(sorted(grouped.items(), key=lambda item: -len(item[1])))
+
+    def format(self, limit=3):
+        lines = []
+        for site, queries in self.by_call_site().items():
+            lines.append('  {} queries from {}'.format(len(queries), site))
+            for sql in list(OrderedDict.fromkeys(queries))[:limit]:
+                lines.append('      {}'.format(sql))
+        return '\n'.join(lines)
+
+
+def call_site(frame):
+    '''the innermost template line and project source line on the stack
+    '''
+
+    template = source = None
+    while frame is not None and source is None:
+        code = frame.f_code
+        if template is None and code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = '{}:{}'.format(origin.template_name, token.lineno)
+        filename = code.co_filename
+        if filename.startswith(settings.BASE_DIR) and 'site-packages' not in filename \
+                and os.path.abspath(filename) != os.path.abspath(__file__):
+            source = '{}:{} in {}'.format(os.path.relpath(filename, settings.BASE_DIR),
+                                          frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return ' via '.join(site for site in (template, source) if site) or '<unknown>'
+
+
+class QueryBudgetTestCase(TestCase):
+    '''base class of the query budget tests. each data set is created in a
+        savepoint that is rolled back once the page has been requested
+    '''
+
+    # keyword arguments of synthetic.generate(), the second is the larger one
+    sizes = (
+        {'courses': 2, 'modules': 2, 'contents': 4, 'students': 2, 'enrollments': 1},
+        {'courses': 6, 'modules': 5, 'contents': 12, 'students': 8, 'enrollments': 3},
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super(QueryBudgetTestCase, cls).setUpClass()
+        cls._media_root = tempfile.mkdtemp(prefix='educa-tests-')
+        cls._media_settings = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._media_settings.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+        super(QueryBudgetTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.clear_caches()
+
+    def clear_caches(self):
+        for cache in caches.all():
+            cache.clear()
+        # buffers due to be written would add their queries to the page
+        progress.discard()
+        analytics.discard()
+
+    def count_queries(self, size, url, user):
+        with transaction.atomic():
+            dataset = synthetic.generate(**size)
+            path = url(dataset)
+            self.client.logout()
+            if user is not None:
+                self.client.force_login(user(dataset))
+            self.clear_caches()
+            log = QueryLog()
+            with connection.execute_wrapper(log):
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            transaction.set_rollback(True)
+        return log
+
+    def assertQueryBudget(self, budget, url, user=None):
+        '''requests the page at url(dataset), logged in as user(dataset) if
+            given. the page must stay within budget queries on every data set
+            size, counting the session and user lookups
+        '''
+
+        logs = [self.count_queries(size, url, user) for size in self.sizes]
+        counts = [len(log) for log in logs]
+        worst = logs[-1]
+        if max(counts) > budget:
+            self.fail('{} queries over a budget of {}:\n{}'.format(
+                max(counts), budget, worst.format()))
+        if any(larger > smaller for smaller, larger in zip(counts, counts[1:])):
+            self.fail('the number of queries grows with the data set, {}:\n{}'.format(
+                ' -> '.join(str(count) for count in counts), worst.format()))
+
+
+def create_course(owner=None, subject=None, title='Harmony', slug='harmony',
+                  overview='Chords'):
+    '''the Harmony course of the Music subject. the owner, a user named owner,
+        and the subject are created unless given
+    '''
+
+    if owner is None:
+        owner = User.objects.create_user('owner')
+    if subject is None:
+        subject = Subject.objects.create(title='Music', slug='music')
+    return Course.objects.create(owner=owner, subject=subject, title=title, slug=slug,
+                                 overview=overview)
+
+
+def add_text(module, title='Thirds', content='Major and minor'):
+    '''a text of the course owner added to the end of module, returns the text
+    '''
+
+    text = Text.objects.create(owner=module.course.owner, title=title, content=content)
+    Content.objects.create(module=module, item=text)
+    return text
@@ -1,3 +1,1364 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, RequestFactory, \
+                        override_settings
+from django.template import engines
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from educa.metrics import COUNT_BUCKETS, Histogram, registry
+from educa.warmup import warm_templates
+from . import analytics, cloning, counters, derivatives, embeds, models, orphans, \
+              search, synthetic
+from .bulk import bulk_create_with_ids
+from .cache import page_cache, render_cache
+from .media import serve_path
+from .models import Subject, Course, Module, Content, Text, File, Image, Video, \
+                    ContentEvent, ContentDailyStat, OrderSequence, SearchEntry
+from .pagination import KeysetPaginator, InvalidCursor, decode_cursor, encode_cursor
+from .testing import QueryBudgetTestCase, add_text, create_course
 
 # Create your tests here.
+
+
+def owner(dataset):
+    return dataset.courses[0].owner
+
+
+class CourseQueryBudgetTests(QueryBudgetTestCase):
+    '''the catalog and the instructor pages make a fixed number of queries
+    '''
+
+    def test_course_list(self):
+        self.assertQueryBudget(2, lambda dataset: reverse('course_list'))
+
+    def test_course_list_subject(self):
+        self.assertQueryBudget(3, lambda dataset:
+                               reverse('course_list_subject',
+                                       args=[dataset.courses[0].subject.slug]))
+
+    def test_course_detail(self):
+        self.assertQueryBudget(1, lambda dataset:
+                               reverse('course_detail', args=[dataset.courses[0].slug]))
+
+    def test_manage_course_list(self):
+        self.assertQueryBudget(3, lambda dataset: reverse('manage_course_list'),
+                               user=owner)
+
+    def test_module_content_list(self):
+        self.assertQueryBudget(9, lambda dataset:
+                               reverse('module_content_list',
+                                       args=[dataset.courses[0].modules.first().id]),
+                               user=owner)
+
+    def test_course_analytics(self):
+        self.assertQueryBudget(10, lambda dataset:
+                               reverse('course_analytics', args=[dataset.courses[0].id]),
+                               user=owner)
+
+    def test_api_course_tree(self):
+        self.assertQueryBudget(9, lambda dataset:
+                               reverse('api_course_tree', args=[dataset.courses[0].id]),
+                               user=owner)
+
+
+class CourseTreeApiTests(TestCase):
+    '''the course tree api selects fields and revalidates against the tree version
+    '''
+
+    def setUp(self):
+        self.course = create_course()
+        self.owner = self.course.owner
+        self.module = Module.objects.create(course=self.course, title='Intervals')
+        self.text = add_text(self.module)
+        self.url = reverse('api_course_tree', args=[self.course.id])
+        self.client.force_login(self.owner)
+
+    def test_tree(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['version'], 1)
+        module = data['course']['modules'][0]
+        self.assertEqual(module['title'], 'Intervals')
+        item = module['contents'][0]['item']
+        self.assertEqual((item['type'], item['content']), ('text', 'Major and minor'))
+        self.assertIn('Major and minor', item['html'])
+
+    def test_sparse_fields(self):
+        data = self.client.get(self.url, {'fields': 'title,modules.contents.item.title'}).json()
+        self.assertEqual(data['course'], {
+            'title': 'Harmony',
+            'modules': [{'contents': [{'item': {'title': 'Thirds'}}]}]})
+
+    def test_not_enrolled(self):
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # any change in the tree makes a new version
+        for change in (lambda: self.text.save(),
+                       lambda: Module.objects.create(course=self.course, title='Scales'),
+                       lambda: Module.objects.filter(course=self.course)
+                                             .reorder({self.module.id: 5})):
+            change()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    '''the read only views read from the replica unless the user just wrote.
+        in tests the replica is another connection to the default database,
+        which only sees committed data
+    '''
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.student = User.objects.create_user('student')
+        self.course = create_course()
+
+    def aliases(self, method, url, data=None):
+        '''the aliases queried while requesting url
+        '''
+
+        used = set()
+        def record(alias):
+            def wrapper(execute, sql, params, many, context):
+                used.add(alias)
+                return execute(sql, params, many, context)
+            return wrapper
+        with connections['default'].execute_wrapper(record('default')), \
+                connections['replica'].execute_wrapper(record('replica')):
+            getattr(self.client, method)(url, data)
+        return used
+
+    def test_catalog_reads_from_replica(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.aliases('get', reverse('course_list')), {'replica'})
+        self.assertEqual(self.aliases('get', reverse('course_detail', args=['harmony'])),
+                         {'replica'})
+
+    def test_cached_pages_read_from_primary(self):
+        # the page is stored for anonymous visitors under the current catalog version
+        self.assertEqual(self.aliases('get', reverse('course_list')), {'default'})
+        self.assertEqual(self.aliases('get', reverse('course_list')), set())
+
+    def test_search_reads_from_replica(self):
+        self.assertEqual(self.aliases('get', reverse('course_search'), {'q': 'harmony'}),
+                         {'replica'})
+
+    def test_other_views_read_from_primary(self):
+        self.client.force_login(self.course.owner)
+        self.assertEqual(self.aliases('get', reverse('manage_course_list')), {'default'})
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.client.force_login(self.student)
+        url = reverse('student_course_detail', args=[self.course.id])
+        self.assertNotIn('default', self.aliases('get', reverse('student_course_list')))
+        self.assertEqual(self.aliases('post', reverse('student_enroll_course'),
+                                      {'course': self.course.id}), {'default'})
+        self.assertIn('educa_primary', self.client.cookies)
+        self.assertEqual(self.aliases('get', url), {'default'})
+        # once the cookie expires the reads go back to the replica
+        del self.client.cookies['educa_primary']
+        self.assertNotIn('default', self.aliases('get', reverse('student_course_list')))
+
+
+@override_settings(COURSES_VIDEO_EMBED_ONLINE=False)
+class VideoEmbedTests(TestCase):
+    '''videos are resolved when saved and rendered from the stored metadata
+    '''
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+
+    def test_resolved_on_save(self):
+        video = Video.objects.create(owner=self.owner, title='Intro',
+                                     url='https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+        self.assertEqual((video.embed_backend, video.video_id),
+                         ('YoutubeBackend', 'dQw4w9WgXcQ'))
+        self.assertIn('hqdefault.jpg', video.thumbnail_url)
+        self.assertIsNotNone(video.embed_resolved)
+        self.assertIn('<iframe', video.render())
+
+    def test_offline_fallback(self):
+        # the thumbnail of vimeo videos needs their api
+        data, complete = embeds.resolve('https://vimeo.com/76979871', online=False)
+        self.assertFalse(complete)
+        self.assertIn('player.vimeo.com/video/76979871', data['embed_html'])
+        self.assertEqual(data['thumbnail_url'], '')
+        data, complete = embeds.resolve('https://soundcloud.com/band/song', online=False)
+        self.assertEqual((data['embed_html'], complete), ('', False))
+
+    def test_unknown_provider(self):
+        video = Video.objects.create(owner=self.owner, title='Lecture',
+                                     url='https://example.com/lecture.mp4')
+        self.assertEqual(video.embed_html, '')
+        self.assertIn('href="https://example.com/lecture.mp4"', video.render())
+
+
+class ContentAnalyticsTests(TestCase):
+    '''content events are buffered, rolled up per day and pruned
+    '''
+
+    def setUp(self):
+        analytics.discard()
+        self.student = User.objects.create_user('student')
+        self.course = create_course()
+        self.owner = self.course.owner
+        self.course.students.add(self.student)
+        module = Module.objects.create(course=self.course, title='Intervals')
+        add_text(module)
+        self.content = Content.objects.get(module=module)
+        self.url = reverse('student_course_detail_module', args=[self.course.id, module.id])
+
+    def test_views_are_buffered(self):
+        self.client.force_login(self.student)
+        self.client.get(self.url)
+        self.assertEqual(len(analytics.buffer), 1)
+        self.assertFalse(ContentEvent.objects.exists())
+        with override_settings(COURSES_ANALYTICS_BUFFER_SIZE=2):
+            self.client.get(self.url)
+        self.assertEqual(ContentEvent.objects.filter(kind=ContentEvent.VIEW).count(), 2)
+
+    def test_rollup_and_prune(self):
+        now = timezone.now()
+        other = User.objects.create_user('other')
+        contents = [(self.content.id, self.course.id)]
+        for days_ago, user in ((40, self.student), (1, self.student),
+                               (1, self.student), (1, other), (0, other)):
+            analytics.record(analytics.VIEW, user, contents, now - timedelta(days=days_ago))
+        analytics.record(analytics.DOWNLOAD, other, contents, now)
+        analytics.flush()
+
+        self.assertEqual(analytics.rollup(), 4)
+        stats = ContentDailyStat.objects.get(day=(now - timedelta(days=1)).date())
+        self.assertEqual((stats.events, stats.users), (3, 2))
+        self.assertEqual(analytics.prune(), 1)
+        # rolling up again keeps the days whose raw events are gone
+        self.assertEqual(analytics.rollup(since=(now - timedelta(days=50)).date()), 3)
+        self.assertEqual(ContentDailyStat.objects.count(), 4)
+        self.assertEqual(analytics.report(self.course)[self.content.id],
+                         {analytics.VIEW: (4, 3), analytics.DOWNLOAD: (1, 1)})
+
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('course_analytics', args=[self.course.id]))
+        self.assertContains(response, 'Thirds')
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('course_analytics', args=[self.course.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class OrphanCollectorTests(TestCase):
+    '''items whose contents are gone and files no item points to are collected
+    '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.course = create_course()
+        owner = self.course.owner
+        module = Module.objects.create(course=self.course, title='Intervals')
+        self.kept = add_text(module, 'Kept', 'Kept')
+        self.file = File.objects.create(owner=owner, title='Score',
+                                        file=SimpleUploadedFile('score.pdf', b'%PDF'))
+        Content.objects.create(module=module, item=self.file)
+        self.texts = [Text.objects.create(owner=owner, title='Orphan', content='Orphan')
+                      for number in range(3)]
+        os.makedirs(os.path.join(self.media_root, 'files', 'old'))
+        with open(os.path.join(self.media_root, 'files', 'old', 'stray.pdf'), 'wb') as f:
+            f.write(b'%PDF')
+
+    def collect(self, *args):
+        out = io.StringIO()
+        call_command('collect_orphans', '--grace-hours=0', '--batch-size=2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        output = self.collect('--dry-run')
+        self.assertIn('text: 3 orphaned items found', output)
+        self.assertIn('media: 1 orphaned files found', output)
+        self.assertEqual(Text.objects.count(), 4)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'files/old/stray.pdf')))
+
+    def test_collect(self):
+        self.course.delete()
+        output = self.collect()
+        self.assertIn('text: 4 orphaned items deleted', output)
+        self.assertIn('file: 1 orphaned items deleted', output)
+        self.assertIn('media: 2 orphaned files deleted', output)
+        self.assertFalse(Text.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'files', 'old')), [])
+
+    def test_resume(self):
+        checkpoint = os.path.join(self.media_root, 'checkpoint.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'items': {'text': self.texts[0].id}, 'media': 'files/old/stray.pdf'}, f)
+        output = self.collect('--checkpoint', checkpoint)
+        self.assertIn('text: 2 orphaned items deleted', output)
+        self.assertIn('media: 0 orphaned files deleted', output)
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(list(orphans.orphan_media(batch_size=1)),
+                         [('files/old/stray.pdf', ['files/old/stray.pdf']),
+                          (self.file.file.name, [])])
+        self.assertEqual(list(orphans.orphan_media(after='files/old/stray.pdf')),
+                         [(self.file.file.name, [])])
+
+
+class ModuleContentUploadTests(TestCase):
+    '''many files become image and file contents with contiguous orders
+    '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_user('owner')
+        self.module = Module.objects.create(course=create_course(self.owner),
+                                            title='Intervals')
+        add_text(self.module, 'First', 'First')
+        self.url = reverse('module_content_upload', args=[self.module.id])
+        self.client.force_login(self.owner)
+
+    def upload(self, count):
+        files = [SimpleUploadedFile('slide{}.png'.format(number), synthetic._png(4, 4))
+                 for number in range(count)]
+        files.append(SimpleUploadedFile('notes.pdf', synthetic.PDF))
+        return self.client.post(self.url, {'files': files})
+
+    def test_upload(self):
+        response = self.upload(2)
+        self.assertRedirects(response, reverse('module_content_list', args=[self.module.id]))
+        contents = list(self.module.contents.with_items())
+        self.assertEqual([content.order for content in contents], [0, 1, 2, 3])
+        self.assertEqual([(type(content.item).__name__, content.item.title)
+                          for content in contents[1:]],
+                         [('Image', 'slide0'), ('Image', 'slide1'), ('File', 'notes')])
+        self.assertTrue(os.path.exists(contents[3].item.file.path))
+
+    def test_queries_per_upload(self):
+        '''the inserts don't grow with the number of files
+        '''
+
+        counts = []
+        for count in (1, 5):
+            with CaptureQueriesContext(connection) as queries:
+                self.upload(count)
+            counts.append(sum(1 for query in queries if 'INSERT' in query['sql']))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_limit(self):
+        with override_settings(COURSES_BULK_UPLOAD_MAX_FILES=2):
+            response = self.upload(2)
+        self.assertContains(response, 'Upload at most 2 files at once.')
+        self.assertEqual(self.module.contents.count(), 1)
+
+
+class CourseCloneTests(TestCase):
+    '''a clone copies the whole tree with bulk inserts
+    '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media_root,
+                                     COURSES_VIDEO_EMBED_ONLINE=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_user('owner')
+        self.owner.user_permissions.add(Permission.objects.get(codename='add_course'))
+        self.course = create_course(self.owner)
+
+    def add_modules(self, course, count):
+        for number in range(count):
+            module = Module.objects.create(course=course, title='Module {}'.format(number))
+            Content.objects.create(module=module, item=Text.objects.create(
+                owner=self.owner, title='Text', content='Counterpoint'))
+            Content.objects.create(module=module, item=File.objects.create(
+                owner=self.owner, title='Score',
+                file=SimpleUploadedFile('score.pdf', synthetic.PDF)))
+            Content.objects.create(module=module, item=Video.objects.create(
+                owner=self.owner, title='Video', url=synthetic.VIDEO_URL))
+
+    def test_clone(self):
+        self.add_modules(self.course, 2)
+        clone = cloning.clone_course(self.course, title='Harmony 2')
+        self.assertEqual((clone.slug, clone.total_modules), ('harmony-2', 2))
+        source = Content.objects.filter(module__course=self.course)
+        copies = Content.objects.filter(module__course=clone).order_by('module__order', 'order')
+        self.assertEqual(copies.count(), 6)
+        self.assertTrue(set(copies.values_list('object_id', flat=True))
+                        .isdisjoint(source.values_list('object_id', flat=True)))
+        items = [content.item for content in copies.with_items()]
+        self.assertEqual([type(item).__name__ for item in items[:3]], ['Text', 'File', 'Video'])
+        # the file is shared, the video keeps its resolved player
+        self.assertEqual(items[1].file.name, File.objects.order_by('id').first().file.name)
+        self.assertTrue(items[2].embed_html)
+        self.assertEqual(SearchEntry.objects.filter(course=clone, kind='text').count(), 2)
+        self.assertEqual(cloning.unique_slug('harmony'), 'harmony-3')
+
+    def test_copy_media(self):
+        self.add_modules(self.course, 1)
+        clone = cloning.clone_course(self.course, share_media=False)
+        copy = File.objects.get(id=Content.objects.get(module__course=clone,
+                                                       content_type__model='file').object_id)
+        self.assertNotEqual(copy.file.name, File.objects.order_by('id').first().file.name)
+        self.assertTrue(os.path.exists(copy.file.path))
+
+    def test_queries_per_clone(self):
+        '''the number of queries doesn't grow with the course
+        '''
+
+        counts = []
+        for count in (1, 4):
+            course = create_course(self.owner, self.course.subject, 'Course',
+                                   'course-{}'.format(count), 'Course')
+            self.add_modules(course, count)
+            with CaptureQueriesContext(connection) as queries:
+                cloning.clone_course(course)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_owner_action(self):
+        self.add_modules(self.course, 1)
+        self.client.force_login(self.owner)
+        url = reverse('course_clone', args=[self.course.id])
+        self.assertContains(self.client.get(url), 'Copy of Harmony')
+        response = self.client.post(url, {'title': 'Harmony, spring term',
+                                          'share_media': 'on'})
+        clone = Course.objects.get(slug='harmony-spring-term')
+        self.assertRedirects(response, reverse('course_edit', args=[clone.id]),
+                             fetch_redirect_response=False)
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_title_without_slug(self):
+        # nothing to slugify, the copy takes the slug of the source
+        for title in ('\u041a\u0443\u0440\u0441', '!!!'):
+            clone = cloning.clone_course(self.course, title=title)
+            self.assertTrue(clone.slug.startswith('harmony-'))
+        self.assertEqual(self.client.get(reverse('course_list')).status_code, 200)
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse('course_clone', args=[self.course.id]),
+                                    {'title': '\u041a\u0443\u0440\u0441'})
+        self.assertFormError(response, 'form', 'title',
+                             'Use at least one latin letter or digit in the title.')
+        self.assertEqual(Course.objects.count(), 3)
+
+
+class ModuleNavCacheTests(TestCase):
+    '''the module navigation is cached per course until its modules change
+    '''
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.owner = User.objects.create_user('owner')
+        self.client.force_login(self.owner)
+        self.course = create_course(self.owner)
+        self.modules = [Module.objects.create(course=self.course, title=title)
+                        for title in ('Scales', 'Chords')]
+        self.url = reverse('module_content_list', args=[self.modules[0].id])
+
+    def test_cached_until_modules_change(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            self.assertContains(self.client.get(self.url), 'Chords')
+        self.assertEqual(len(second), len(first) - 1)
+
+        self.modules[1].title = 'Cadences'
+        self.modules[1].save()
+        self.assertContains(self.client.get(self.url), 'Cadences')
+
+        self.client.post(reverse('module_order'),
+                         json.dumps({self.modules[0].id: 1, self.modules[1].id: 0}),
+                         content_type='application/json')
+        nav = self.client.get(self.url).content.split(b'id="modules"')[1]
+        self.assertLess(nav.index(b'Cadences'), nav.index(b'Scales'))
+
+    def test_selected_module(self):
+        self.client.get(self.url)
+        response = self.client.get(reverse('module_content_list', args=[self.modules[1].id]))
+        self.assertContains(response, 'data-id="{}" class="selected"'.format(self.modules[1].id))
+
+    def test_warm_templates(self):
+        options = dict(settings.TEMPLATES[0]['OPTIONS'],
+                       loaders=[('django.template.loaders.cached.Loader',
+                                 settings.TEMPLATES[0]['OPTIONS']['loaders'])])
+        with override_settings(TEMPLATES=[dict(settings.TEMPLATES[0], OPTIONS=options)]):
+            self.assertGreater(warm_templates(), 0)
+            loader = engines['django'].engine.template_loaders[0]
+            self.assertIn('courses/manage/module/content_list.html', loader.get_template_cache)
+
+
+class PageCacheTests(TestCase):
+    '''anonymous visitors get the catalog pages from the cache until the
+        catalog version changes
+    '''
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.course = create_course()
+        self.owner = self.course.owner
+        self.url = reverse('course_detail', args=['harmony'])
+
+    def get(self, url):
+        '''(response, number of queries)
+        '''
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries)
+
+    def hold_lock(self, version):
+        request = RequestFactory().get(self.url)
+        page_cache.cache.add('{}:lock'.format(page_cache.make_key(request, version)), 1)
+
+    def test_anonymous_pages(self):
+        first, count = self.get(self.url)
+        self.assertGreater(count, 0)
+        second, count = self.get(self.url)
+        self.assertEqual((second.content, count), (first.content, 0))
+        self.assertGreater(self.get(reverse('course_list'))[1], 0)
+        # signed in visitors get the page rendered for them
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(self.url), 'Enroll now')
+
+    def test_version_bumped_by_changes(self):
+        self.get(self.url)
+        self.course.title = 'Counterpoint'
+        self.course.save()
+        self.assertContains(self.get(self.url)[0], 'Counterpoint')
+        self.get(self.url)
+        Module.objects.create(course=self.course, title='Scales')
+        self.assertContains(self.get(self.url)[0], '1 modules')
+
+    @override_settings(COURSES_PAGE_CACHE_SECONDS=0)
+    def test_stale_page_while_rendered(self):
+        self.get(self.url)
+        # another request is rendering the expired page
+        self.hold_lock(page_cache.version())
+        response, count = self.get(self.url)
+        self.assertEqual(count, 0)
+        self.assertContains(response, 'Harmony')
+
+    def test_previous_version_while_rendered(self):
+        self.get(self.url)
+        page_cache.bump()
+        self.hold_lock(page_cache.version())
+        self.assertEqual(self.get(self.url)[1], 0)
+        page_cache.bump()
+        self.hold_lock(page_cache.version())
+        # nothing to serve, renders without waiting
+        self.assertGreater(self.get(self.url)[1], 0)
+
+
+class CounterTests(TestCase):
+    '''the catalog counters follow the saves and deletes of courses and modules
+    '''
+
+    def setUp(self):
+        self.courses = [create_course(title='harmony')]
+        self.owner, self.subject = self.courses[0].owner, self.courses[0].subject
+        self.courses.append(create_course(self.owner, self.subject, 'rhythm', 'rhythm'))
+
+    def totals(self):
+        return (Subject.objects.get(id=self.subject.id).total_courses,
+                list(Course.objects.order_by('id').values_list('total_modules', flat=True)))
+
+    def test_counts(self):
+        module = Module.objects.create(course=self.courses[0], title='Scales')
+        Module.objects.create(course=self.courses[0], title='Chords')
+        self.assertEqual(self.totals(), (2, [2, 0]))
+        module = Module.objects.get(id=module.id)
+        module.course = self.courses[1]
+        with CaptureQueriesContext(connection) as queries:
+            module.save()
+        # the course it was loaded with is known, no query reads it back
+        self.assertFalse([query for query in queries
+                          if query['sql'].startswith('SELECT "courses_module"."course_id"')])
+        self.assertEqual(self.totals(), (2, [1, 1]))
+        module.delete()
+        self.assertEqual(self.totals(), (2, [1, 0]))
+
+    def test_save(self):
+        stale = Course.objects.get(id=self.courses[0].id)
+        Module.objects.create(course=self.courses[0], title='Scales')
+        stale.title = 'Harmony'
+        stale.save()
+        # the counter kept by the signals isn't written back
+        self.assertEqual(self.totals(), (2, [1, 0]))
+        # a copy is inserted
+        stale.pk = None
+        stale.slug = 'harmony-2'
+        stale.save()
+        self.assertEqual(Course.objects.count(), 3)
+        self.assertEqual(Subject.objects.get(id=self.subject.id).total_courses, 3)
+        # deferred fields are neither loaded nor written
+        course = Course.objects.only('title').get(id=self.courses[1].id)
+        course.title = 'Rhythm'
+        with CaptureQueriesContext(connection) as queries:
+            course.save()
+        self.assertEqual([query['sql'].split(' WHERE')[0] for query in queries
+                          if query['sql'].startswith('UPDATE "courses_course"')],
+                         ['UPDATE "courses_course" SET "title" = \'Rhythm\''])
+        self.assertEqual(Course.objects.get(id=course.id).slug, 'rhythm')
+
+    def test_decrement_from_zero(self):
+        module = Module.objects.create(course=self.courses[0], title='Scales')
+        Course.objects.update(total_modules=0)
+        module.delete()
+        self.assertEqual(self.totals(), (2, [0, 0]))
+
+    def test_cascade(self):
+        for number in range(3):
+            Module.objects.create(course=self.courses[0], title='Module {}'.format(number))
+        with CaptureQueriesContext(connection) as queries:
+            self.courses[0].delete()
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('UPDATE "courses_course"')]), 0)
+        self.assertEqual(self.totals(), (1, [0]))
+        with CaptureQueriesContext(connection) as queries:
+            self.subject.delete()
+        self.assertFalse([query for query in queries
+                          if query['sql'].startswith('UPDATE "courses_subject"')])
+
+    def test_fill(self):
+        Module.objects.create(course=self.courses[0], title='Scales')
+        Subject.objects.update(total_courses=0)
+        Course.objects.update(total_modules=0)
+        # every counter at 0, whether it was right or not
+        self.assertEqual(counters.fill(), 5)
+        self.assertEqual(self.totals(), (2, [1, 0]))
+        out = io.StringIO()
+        call_command('rebuild_counters', verify=True, stdout=out)
+        self.assertIn('up to date', out.getvalue())
+
+
+class SearchTests(TestCase):
+    '''courses, modules and texts are found until they, or the content holding
+        the text, are deleted
+    '''
+
+    def setUp(self):
+        self.course = create_course(subject=Subject.objects.create(title='Zoology',
+                                                                   slug='zoology'),
+                                    title='Savanna', slug='savanna',
+                                    overview='Zebras and lions')
+        self.owner = self.course.owner
+        self.module = Module.objects.create(course=self.course, title='Grazers')
+        self.text = Text.objects.create(owner=self.owner, title='Stripes',
+                                        content='Every zebra is unique')
+        self.content = Content.objects.create(module=self.module, item=self.text)
+
+    def kinds(self, query):
+        results, last = search.search(query)
+        return sorted(entry.kind for entry in results)
+
+    def test_index(self):
+        self.assertEqual(self.kinds('zebra'), ['course', 'text'])
+        self.assertEqual(self.kinds('graz'), ['module'])
+        self.text.content = 'Every horse is unique'
+        self.text.save()
+        self.assertEqual(self.kinds('zebra'), ['course'])
+
+    def test_unindex(self):
+        self.content.delete()
+        self.assertEqual(self.kinds('stripes'), [])
+        Content.objects.create(module=self.module, item=self.text)
+        self.assertEqual(self.kinds('stripes'), ['text'])
+        self.module.delete()
+        self.assertEqual(self.kinds('stripes graz'), [])
+        self.assertEqual(self.kinds('zebra'), ['course'])
+
+    def add_module(self, texts):
+        module = Module.objects.create(course=self.course, title='Herd')
+        for number in range(texts):
+            Content.objects.create(module=module, item=Text.objects.create(
+                owner=self.owner, title='Mane {}'.format(number), content='Black mane'))
+        # also held by the first module
+        Content.objects.create(module=module, item=self.text)
+        return module
+
+    def test_cascade_queries(self):
+        '''deleting a module costs the same whatever the number of contents
+        '''
+
+        counts = []
+        for texts in (1, 5):
+            module = self.add_module(texts)
+            self.assertEqual(len(self.kinds('mane')), texts)
+            updated = Course.objects.get(id=self.course.id).updated
+            with CaptureQueriesContext(connection) as queries:
+                module.delete()
+            counts.append(len(queries))
+            self.assertEqual(self.kinds('mane'), [])
+            self.assertEqual(self.kinds('stripes'), ['text'])
+            self.assertGreater(Course.objects.get(id=self.course.id).updated, updated)
+        self.assertEqual(counts[0], counts[1])
+        counts = []
+        for texts in (1, 5):
+            course = create_course(self.owner, self.course.subject,
+                                   'Plains {}'.format(texts), 'plains-{}'.format(texts),
+                                   'Grass')
+            for number in range(texts):
+                add_text(Module.objects.create(course=course, title='Herd'), 'Hoof', 'Hoof')
+            with CaptureQueriesContext(connection) as queries:
+                course.delete()
+            counts.append(len(queries))
+            self.assertEqual(self.kinds('hoof'), [])
+        self.assertEqual(counts[0], counts[1])
+
+    def test_pages(self):
+        for number in range(5):
+            Module.objects.create(course=self.course, title='Zebra herd {}'.format(number))
+        seen, after = [], None
+        while True:
+            results, after = search.search('herd', after=after, limit=2)
+            seen += [entry.id for entry in results]
+            if after is None:
+                break
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+        response = self.client.get(reverse('course_search'), {'q': 'herd'})
+        self.assertEqual(len(response.context['results']), 5)
+        cursor = encode_cursor(list(search.search('herd', limit=2)[1]))
+        response = self.client.get(reverse('course_search'), {'q': 'herd', 'cursor': cursor})
+        self.assertEqual(len(response.context['results']), 3)
+        for cursor in ('garbage', encode_cursor(['a', 'b']), encode_cursor({'score': 1})):
+            response = self.client.get(reverse('course_search'), {'q': 'herd', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_postgres_ranks(self):
+        connection = mock.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = []
+        search.PostgresBackend(connection).search(['zebra'], (-0.25, 7), 3)
+        sql, params = cursor.execute.call_args[0]
+        score = "(-ts_rank({}, query))::float8".format(search.PostgresBackend.document)
+        # compared as float8 on both sides, a tied rank equals the cursor value
+        self.assertTrue(sql.startswith('SELECT id, {} FROM'.format(score)))
+        self.assertIn('AND ({0} > %s OR ({0} = %s AND id > %s))'.format(score), sql)
+        self.assertEqual(params, ['zebra:*', -0.25, -0.25, 7, 3])
+
+    def test_other_databases(self):
+        with mock.patch.dict(search.BACKENDS, clear=True):
+            backend = search.get_backend()
+            self.assertIsInstance(backend, search.LikeBackend)
+            # saves still index, searching falls back to LIKE
+            Module.objects.create(course=self.course, title='Zebra herd')
+            results, after = search.search('zebra herd', limit=1)
+            self.assertEqual([entry.kind for entry in results], ['module'])
+            self.assertIsNone(after)
+            self.assertEqual(self.kinds('ZEBRA'), ['course', 'module', 'text'])
+
+
+class BulkCreateTests(TestCase):
+    '''bulk_create_with_ids gives every object the id of its own row
+    '''
+
+    def setUp(self):
+        self.course = create_course()
+
+    def create(self):
+        modules = bulk_create_with_ids(Module, [Module(course=self.course, order=number,
+                                                       title='Module {}'.format(number))
+                                                for number in range(3)])
+        self.assertEqual([Module.objects.get(id=module.id).title for module in modules],
+                         ['Module 0', 'Module 1', 'Module 2'])
+        # no signals, the counter is left to the caller
+        self.assertEqual(Course.objects.get(id=self.course.id).total_modules, 0)
+
+    def test_read_back(self):
+        self.create()
+
+    def test_one_by_one(self):
+        # databases that neither return the ids nor lock out other inserts
+        with mock.patch.object(connection, 'vendor', 'mysql'), \
+                CaptureQueriesContext(connection) as queries:
+            self.create()
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('INSERT')]), 3)
+
+
+class OrderTests(TestCase):
+    '''orders come from a sequence per group, reorder() keeps it ahead of the
+        orders it writes and rebalance_order renumbers the groups without gaps
+    '''
+
+    def setUp(self):
+        self.course = create_course()
+        self.owner = self.course.owner
+        self.field = Module._meta.get_field('order')
+        self.key = self.field.group_key({'course_id': self.course.id})
+
+    def next_value(self):
+        return OrderSequence.objects.get(key=self.key).next_value
+
+    def test_allocate(self):
+        # the first allocation of a group starts after the stored orders
+        Module.objects.create(course=self.course, title='Scales', order=7)
+        module = Module.objects.create(course=self.course, title='Chords')
+        self.assertEqual(module.order, 8)
+        self.assertEqual(self.field.allocate(Module(course=self.course), count=3), 9)
+        self.assertEqual(Module.objects.create(course=self.course, title='Keys').order, 12)
+        # other groups have their own sequence
+        other = create_course(self.owner, self.course.subject, 'Rhythm', 'rhythm', 'Beats')
+        self.assertEqual(Module.objects.create(course=other, title='Beats').order, 0)
+
+    def test_reorder_advances_sequence(self):
+        modules = [Module.objects.create(course=self.course, title=str(number))
+                   for number in range(2)]
+        self.assertEqual(self.next_value(), 2)
+        self.course.modules.reorder({modules[0].id: 5})
+        self.assertEqual(self.next_value(), 6)
+        module = Module.objects.create(course=self.course, title='After')
+        self.assertEqual(module.order, 6)
+        # moving down never takes the sequence back
+        self.course.modules.reorder({modules[0].id: 1})
+        self.assertEqual(self.next_value(), 7)
+
+    def test_rebalance(self):
+        for order in (3, 10, 10, 40):
+            Module.objects.create(course=self.course, title=str(order), order=order)
+        OrderSequence.objects.create(key='courses.module:course_id=0', next_value=9)
+        out = io.StringIO()
+        call_command('rebalance_order', 'courses.module', stdout=out)
+        self.assertIn('courses.Module.order: 1 groups, 4 rows renumbered', out.getvalue())
+        self.assertEqual(list(self.course.modules.values_list('title', 'order')),
+                         [('3', 0), ('10', 1), ('10', 2), ('40', 3)])
+        self.assertEqual(self.next_value(), 4)
+        self.assertFalse(OrderSequence.objects.filter(key='courses.module:course_id=0')
+                                              .exists())
+        self.assertEqual(Module.objects.create(course=self.course, title='New').order, 4)
+
+
+class DerivativeTests(TestCase):
+    '''resized variants are built once per source, evicted on a timer and an
+        evicted variant is queued again only once
+    '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.student = User.objects.create_user('student')
+        self.course = course = create_course(self.owner)
+        course.students.add(self.student)
+        module = Module.objects.create(course=course, title='Intervals')
+        self.image = Image(owner=self.owner, title='Staff')
+        self.image.file.save('staff.png', ContentFile(synthetic._png(400, 200)), save=False)
+        with mock.patch.object(derivatives.transaction, 'on_commit'):
+            self.image.save()
+        Content.objects.create(module=module, item=self.image)
+        self.directory = os.path.join(self.media_root, 'derivatives')
+
+    @skipUnless(derivatives.is_available(), 'needs Pillow')
+    def test_generate(self):
+        variants = derivatives.generate(self.image.file.path, self.media_root, 'derivatives')
+        self.assertEqual(sorted(variants), ['medium', 'medium_webp', 'thumb', 'thumb_webp'])
+        self.assertEqual(variants['thumb']['width'], 320)
+        # the medium variants never upscale the source
+        self.assertEqual(variants['medium']['width'], 400)
+        self.assertEqual(derivatives.generate(self.image.file.path, self.media_root,
+                                              'derivatives'), variants)
+        self.assertEqual(derivatives.evict(self.directory, None), 0)
+        self.assertEqual(derivatives.evict(self.directory, 1), 4)
+        self.assertEqual(derivatives.evict(os.path.join(self.media_root, 'missing'), 1), 0)
+
+    @skipUnless(derivatives.is_available(), 'needs Pillow')
+    def test_evicted_variant_queued_once(self):
+        Image.objects.filter(id=self.image.id).update(variants=json.dumps(
+            {'thumb': {'name': 'derivatives/gone-thumb.png', 'width': 320}}))
+        url = reverse('content_media_variant', args=['image', self.image.id, 'thumb'])
+        self.client.force_login(self.student)
+        with mock.patch.object(derivatives.transaction, 'on_commit') as on_commit:
+            for request in range(3):
+                response = self.client.get(url)
+                self.assertEqual(response['Content-Type'], 'image/png')
+                response.close()
+        self.assertEqual(on_commit.call_count, 1)
+        # queued again once the pending generation is stored
+        derivatives.cache.delete(derivatives.pending_key(self.image.id))
+        with mock.patch.object(derivatives.transaction, 'on_commit') as on_commit:
+            self.client.get(url).close()
+        self.assertEqual(on_commit.call_count, 1)
+
+    @skipUnless(derivatives.is_available(), 'needs Pillow')
+    def test_queued_for_new_files(self):
+        with mock.patch.object(derivatives.transaction, 'on_commit') as on_commit:
+            self.image.title = 'Treble staff'
+            self.image.save()
+            image = Image.objects.get(id=self.image.id)
+            image.title = 'Bass staff'
+            image.save()
+            self.assertFalse(on_commit.called)
+            image.file.save('bass.png', ContentFile(synthetic._png(200, 100)))
+            self.assertEqual(on_commit.call_count, 1)
+
+    @skipUnless(derivatives.is_available(), 'needs Pillow')
+    def test_command(self):
+        updated = Course.objects.get(id=self.course.id).updated
+        out = io.StringIO()
+        call_command('build_image_variants', stdout=out)
+        self.assertIn('Built the variants of 1 images', out.getvalue())
+        self.assertEqual(len(Image.objects.get(id=self.image.id).get_variants()), 4)
+        # the cached pages and api responses of the course are renewed
+        self.assertGreater(Course.objects.get(id=self.course.id).updated, updated)
+
+    def test_eviction_timer(self):
+        executor = mock.Mock()
+        with mock.patch.object(derivatives, 'get_executor', return_value=executor), \
+                mock.patch.object(derivatives, '_last_eviction', None), \
+                override_settings(COURSES_DERIVATIVES_MAX_BYTES=1,
+                                  COURSES_DERIVATIVES_EVICT_SECONDS=60):
+            self.assertIsNotNone(derivatives.schedule_eviction())
+            self.assertIsNone(derivatives.schedule_eviction())
+            with override_settings(COURSES_DERIVATIVES_EVICT_SECONDS=0):
+                self.assertIsNotNone(derivatives.schedule_eviction())
+        self.assertEqual(executor.submit.call_count, 2)
+        executor.submit.assert_called_with(derivatives.evict, self.directory, 1)
+
+    @skipUnless(derivatives.is_available(), 'needs Pillow')
+    def test_remote_storage(self):
+        with mock.patch('django.core.files.storage.FileSystemStorage.path',
+                        side_effect=NotImplementedError), \
+                mock.patch.object(derivatives.transaction, 'on_commit') as on_commit:
+            derivatives.schedule(self.image)
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command('build_image_variants', stdout=stdout, stderr=stderr)
+        self.assertFalse(on_commit.called)
+        self.assertIn('Image {}: only files on the local disk can be resized'.format(
+            self.image.id), stderr.getvalue())
+        self.assertIn('Built the variants of 0 images', stdout.getvalue())
+
+
+class MediaTests(TestCase):
+    '''media files are streamed with conditional and range requests
+    '''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.path = self.write('notes.txt', b'0123456789')
+        self.factory = RequestFactory()
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def serve(self, path=None, as_attachment=False, **headers):
+        path = path or self.path
+        response = serve_path(self.factory.get('/', **headers), path,
+                              os.path.basename(path), as_attachment)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), b'0123456789')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'private')
+
+    def test_ranges(self):
+        for header, content, content_range in (('bytes=2-4', b'234', 'bytes 2-4/10'),
+                                               ('bytes=7-', b'789', 'bytes 7-9/10'),
+                                               ('bytes=-2', b'89', 'bytes 8-9/10'),
+                                               ('bytes=8-99', b'89', 'bytes 8-9/10')):
+            response = self.serve(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(self.body(response), content)
+            self.assertEqual(response['Content-Range'], content_range)
+            self.assertEqual(response['Content-Length'], str(len(content)))
+        # several ranges or another unit, the whole file
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-1,4-5').status_code, 200)
+        self.assertEqual(self.serve(HTTP_RANGE='items=0-1').status_code, 200)
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=10-', 'bytes=5-2', 'bytes=-0'):
+            response = self.serve(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_not_modified(self):
+        response = self.serve()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        for headers in ({'HTTP_IF_NONE_MATCH': etag},
+                        {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response = self.serve(**headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response['Cache-Control'], 'private')
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_if_range(self):
+        etag = self.serve()['ETag']
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code,
+                         206)
+        # the file changed since the first part was downloaded, send all of it
+        response = self.serve(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), b'0123456789')
+        response = self.serve(HTTP_RANGE='bytes=0-1',
+                              HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_compressed_file(self):
+        response = self.serve(self.write('notes.tar.gz', b'\x1f\x8b'))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_offload(self):
+        path = self.write('r\u00e9sum\u00e9 #1?.txt', b'notes')
+        with override_settings(COURSES_MEDIA_OFFLOAD='x-accel-redirect',
+                               COURSES_MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = serve_path(self.factory.get('/'), path, 'files/r\u00e9sum\u00e9 #1?.txt')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/files/r%C3%A9sum%C3%A9%20%231%3F.txt')
+        with override_settings(COURSES_MEDIA_OFFLOAD='x-sendfile'):
+            response = serve_path(self.factory.get('/'), path, 'unused')
+        self.assertEqual(response['X-Sendfile'],
+                         os.path.join(self.root, 'r%C3%A9sum%C3%A9%20%231%3F.txt'))
+
+    def test_attachment_name(self):
+        response = self.serve(self.write('my "notes".txt', b'notes'), as_attachment=True)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="my \\"notes\\".txt"')
+        response = self.serve(self.write('r\u00e9sum\u00e9.txt', b'notes'), as_attachment=True)
+        self.assertEqual(response['Content-Disposition'],
+                         "attachment; filename*=utf-8''r%C3%A9sum%C3%A9.txt")
+
+
+class ReorderTests(TestCase):
+    '''the order views validate the ids and write the new orders in one UPDATE
+    '''
+
+    def setUp(self):
+        course = create_course()
+        self.owner = course.owner
+        self.modules = [Module.objects.create(course=course, title=str(number))
+                        for number in range(3)]
+        other = create_course(User.objects.create_user('other'), course.subject,
+                              'Rhythm', 'rhythm', 'Beats')
+        self.foreign = Module.objects.create(course=other, title='Beats')
+        self.client.force_login(self.owner)
+
+    def post(self, orders):
+        return self.client.post(reverse('module_order'), json.dumps(orders),
+                                content_type='application/json').json()
+
+    def orders(self):
+        return list(Module.objects.filter(id__in=[module.id for module in self.modules])
+                                  .order_by('id').values_list('order', flat=True))
+
+    def test_single_update(self):
+        first, second, third = self.modules
+        with CaptureQueriesContext(connection) as queries:
+            result = self.post({first.id: 2, str(second.id): '0', third.id: 2})
+        self.assertEqual(result, {'saved': 'OK', 'changed': 2, 'rejected': []})
+        self.assertEqual(self.orders(), [2, 0, 2])
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('UPDATE "courses_module"')]), 1)
+
+    def test_rejected_ids(self):
+        first, second, third = self.modules
+        result = self.post({first.id: 1.0, second.id: True, third.id: -1,
+                            self.foreign.id: 0, 'first': 0, '9999': 0, '1e3': 0})
+        self.assertEqual(result['changed'], 0)
+        self.assertEqual(sorted(map(str, result['rejected'])),
+                         sorted(map(str, [first.id, second.id, third.id, self.foreign.id,
+                                          'first', 9999, '1e3'])))
+        self.assertEqual(self.orders(), [0, 1, 2])
+        self.assertEqual(Module.objects.get(id=self.foreign.id).order, 0)
+        self.assertEqual(self.client.post(reverse('module_order'), '[1, 2]',
+                                          content_type='application/json').status_code, 400)
+
+
+class KeysetPaginationTests(TestCase):
+    '''cursors walk the pages in both directions, rows sharing the sort key
+        are told apart by their id and tampered cursors are refused
+    '''
+
+    def setUp(self):
+        self.courses = [create_course(title='Course 0', slug='course-0')]
+        owner, subject = self.courses[0].owner, self.courses[0].subject
+        self.courses += [create_course(owner, subject, 'Course {}'.format(number),
+                                       'course-{}'.format(number))
+                         for number in range(1, 5)]
+        # the same creation time for all of them, only the id breaks the tie
+        Course.objects.update(created=timezone.now())
+        self.paginator = KeysetPaginator(Course.objects.all(), 2)
+        self.ids = [course.id for course in self.courses]
+
+    def test_cursor_encoding(self):
+        cursor = encode_cursor(['next', '2020-01-01T00:00:00+00:00', 3])
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), ['next', '2020-01-01T00:00:00+00:00', 3])
+        direction, values = self.paginator.decode_cursor(cursor)
+        self.assertEqual(direction, 'next')
+        self.assertEqual(values[1], 3)
+        self.assertEqual(values[0].year, 2020)
+
+    def test_ties(self):
+        pages = [self.paginator.page()]
+        while pages[-1].has_next:
+            pages.append(self.paginator.page(pages[-1].next_cursor))
+        self.assertEqual([[course.id for course in page] for page in pages],
+                         [self.ids[0:2], self.ids[2:4], self.ids[4:]])
+        self.assertFalse(pages[0].has_previous)
+        # and back from the last page
+        page = self.paginator.page(pages[-1].previous_cursor)
+        self.assertEqual([course.id for course in page], self.ids[2:4])
+        page = self.paginator.page(page.previous_cursor)
+        self.assertEqual([course.id for course in page], self.ids[0:2])
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+
+    def test_tampered_cursor(self):
+        created = self.courses[0].created.isoformat()
+        for cursor in ('not base64!', encode_cursor({'next': 1}),
+                       encode_cursor(['sideways', created, 1]),
+                       encode_cursor(['next', created]),
+                       encode_cursor(['next', 'yesterday', 1]),
+                       encode_cursor(['next', created, 'one'])):
+            with self.assertRaises(InvalidCursor):
+                self.paginator.page(cursor)
+        self.client.force_login(self.courses[0].owner)
+        response = self.client.get(reverse('course_list'), {'cursor': 'not base64!'})
+        self.assertEqual(response.status_code, 404)
+
+
+class MetricsTests(TestCase):
+    '''the performance middleware observes each request by url name and
+        /metrics exposes the histograms in the prometheus text format
+    '''
+
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def samples(self, text, name):
+        return [line for line in text.splitlines() if line.startswith(name)]
+
+    def test_internal_ips(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'),
+                                         REMOTE_ADDR='10.0.0.1').status_code, 404)
+        with override_settings(INTERNAL_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get(reverse('metrics'),
+                                             REMOTE_ADDR='10.0.0.1').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics'),
+                                             REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('course_list'))
+        timing = response['Server-Timing']
+        for metric in ('app;dur=', 'db;dur=', 'tpl;dur=', 'cache;desc="0 hits, 0 misses"'):
+            self.assertIn(metric, timing)
+
+    def test_prometheus_format(self):
+        for request in range(2):
+            self.client.get(reverse('course_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertTrue(text.endswith('\n'))
+        self.assertIn('# HELP educa_request_duration_seconds Wall time of requests.\n'
+                      '# TYPE educa_request_duration_seconds histogram\n', text)
+        self.assertIn('# TYPE educa_render_cache_hits_total counter\n'
+                      'educa_render_cache_hits_total{view="course_list"} 0\n', text)
+        buckets = self.samples(text, 'educa_request_db_queries_bucket{view="course_list"')
+        self.assertEqual(len(buckets), len(COUNT_BUCKETS) + 1)
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        # cumulative, the last bucket holds every request
+        self.assertEqual(counts, sorted(counts))
+        self.assertTrue(buckets[-1].startswith(
+            'educa_request_db_queries_bucket{view="course_list",le="+Inf"} '))
+        self.assertEqual(counts[-1], 2)
+        self.assertIn('educa_request_db_queries_count{view="course_list"} 2\n', text)
+        self.assertEqual(len(self.samples(text, 'educa_request_db_queries_sum{view="course_list"}')),
+                         1)
+
+    def test_histogram(self):
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples()), [(1, 2), (5, 3), ('+Inf', 4)])
+        self.assertEqual((histogram.sum, histogram.count), (11.5, 4))
+        registry.observe('a "quoted"\\view', 0.1, 1, 0.01, 0.02, 3, 1)
+        self.assertIn('educa_render_cache_hits_total{view="a \\"quoted\\"\\\\view"} 3',
+                      registry.render())
+
+
+class ContentItemsTests(TestCase):
+    '''with_items() loads the items of the contents with one query per content type
+    '''
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.module = Module.objects.create(course=create_course(self.owner),
+                                            title='Intervals')
+
+    def add(self, count):
+        for number in range(count):
+            for item in (Text.objects.create(owner=self.owner, title='Text',
+                                             content='Text {}'.format(number)),
+                         Video.objects.create(owner=self.owner, title='Video',
+                                              url='https://youtu.be/dQw4w9WgXcQ'),
+                         File.objects.create(owner=self.owner, title='File',
+                                             file='files/{}.pdf'.format(number))):
+                Content.objects.create(module=self.module, item=item)
+
+    def items(self):
+        return [type(content.item).__name__ for content in self.module.contents.with_items()]
+
+    def test_query_per_content_type(self):
+        for count in (1, 4):
+            self.add(count)
+            # contents, then texts, videos and files
+            with self.assertNumQueries(4):
+                items = self.items()
+        self.assertEqual(len(items), 15)
+        self.assertEqual(items[:3], ['Text', 'Video', 'File'])
+
+    def test_missing_item(self):
+        self.add(1)
+        Text.objects.all().delete()
+        # left to the orphan collector, the content has no item and costs no
+        # query of its own
+        with self.assertNumQueries(4):
+            self.assertEqual(self.items(), ['NoneType', 'Video', 'File'])
+
+
+class RenderCacheTests(TestCase):
+    '''the html of content items is rendered once per version of the item
+    '''
+
+    def setUp(self):
+        caches['render'].clear()
+        render_cache.reset_stats()
+        self.owner = User.objects.create_user('owner')
+        self.text = Text.objects.create(owner=self.owner, title='Thirds',
+                                        content='Major and minor')
+
+    def render(self, text):
+        with mock.patch('courses.models.render_to_string',
+                        wraps=models.render_to_string) as render:
+            html = text.render()
+        return html.strip(), render.called
+
+    def test_cached(self):
+        self.assertEqual(self.render(self.text), ('<p>Major and minor</p>', True))
+        # another instance of the same row
+        self.assertEqual(self.render(Text.objects.get(id=self.text.id)),
+                         ('<p>Major and minor</p>', False))
+        self.assertEqual(render_cache.stats()['hits'], 1)
+        self.assertEqual(render_cache.stats()['misses'], 1)
+
+    def test_invalidated_on_save(self):
+        self.render(self.text)
+        key = render_cache.make_key(self.text)
+        self.text.content = 'Augmented'
+        self.text.save()
+        self.assertIsNone(caches['render'].get(key))
+        self.assertEqual(self.render(self.text), ('<p>Augmented</p>', True))
+        # stored under the new version
+        self.assertNotEqual(render_cache.make_key(self.text), key)
+
+    def test_invalidated_on_delete(self):
+        self.render(self.text)
+        key = render_cache.make_key(self.text)
+        self.text.delete()
+        self.assertIsNone(caches['render'].get(key))
+
+    def test_unsaved(self):
+        text = Text(owner=self.owner, title='Draft', content='Draft')
+        self.assertEqual(self.render(text), ('<p>Draft</p>', True))
+        self.assertEqual(self.render(text), ('<p>Draft</p>', True))
+        self.assertEqual(render_cache.stats()['misses'], 0)
+
+
+class SyntheticDataTests(TestCase):
+    '''the benchmark dataset has the requested size, up to date derived data
+        and is the same for the same seed
+    '''
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def generate(self, seed):
+        with transaction.atomic():
+            dataset = synthetic.generate(subjects=2, courses=3, modules=2, contents=4,
+                                         students=5, enrollments=2, seed=seed)
+            summary = {
+                'courses': [(course.title, course.total_modules, course.total_students)
+                            for course in Course.objects.order_by('id')],
+                'contents': Content.objects.count(),
+                'items': [Model.objects.count() for Model in (Text, Video, Image, File)],
+                'enrollments': Course.students.through.objects.count(),
+                'students': len(dataset.students),
+                'missing_items': sum(1 for content in Content.objects.with_items()
+                                     if content.item is None),
+            }
+            transaction.set_rollback(True)
+        return summary
+
+    def test_generate(self):
+        summary = self.generate(seed=0)
+        self.assertEqual(len(summary['courses']), 3)
+        self.assertTrue(all(modules == 2 for title, modules, students in summary['courses']))
+        self.assertEqual(sum(students for title, modules, students in summary['courses']),
+                         summary['enrollments'])
+        self.assertEqual(summary['enrollments'], 10)
+        self.assertEqual(summary['contents'], 3 * 2 * 4)
+        self.assertEqual(summary['items'], [6, 6, 6, 6])
+        self.assertEqual(summary['missing_items'], 0)
+        self.assertEqual(summary['students'], 5)
+        self.assertEqual(self.generate(seed=0), summary)
+        self.assertNotEqual(self.generate(seed=1)['courses'], summary['courses'])
@@ -19,6 +19,10 @@ urlpatterns = [
     path('<pk>/delete/',
          views.CourseDeleteView.as_view(),
          name = 'course_delete'),
+    # copy courses
+    path('<pk>/clone/',
+         views.CourseCloneView.as_view(),
+         name = 'course_clone'),
     # update module
     path('<pk>/module/',
         views.CourseModuleUpdateView.as_view(),
@@ -31,10 +35,26 @@ urlpatterns = [
     path('module/<int:module_id>/content/<model_name>/<id>/',
         views.ContentCreateUpdateView.as_view(),
         name = 'module_content_update'),
+    # create a content for each of many files
+    path('module/<int:module_id>/upload/',
+        views.ModuleContentUploadView.as_view(),
+        name = 'module_content_upload'),
     # delete content
     path('content/<int:id>/delete/',
         views.ContentDeleteView.as_view(),
         name = 'module_content_delete'),
+    # download the file of a file or image content
+    path('media/<model_name>/<int:id>/',
+        views.ContentMediaView.as_view(),
+        name = 'content_media'),
+    # download a resized variant of an image content
+    path('media/<model_name>/<int:id>/<variant>/',
+        views.ContentMediaView.as_view(),
+        name = 'content_media_variant'),
+    # views and downloads of the contents
+    path('<int:pk>/analytics/',
+        views.CourseAnalyticsView.as_view(),
+        name = 'course_analytics'),
     # content list
     path('module/<int:module_id>/',
         views.ModuleContentListView.as_view(),
@@ -47,6 +67,10 @@ urlpatterns = [
     path('content/order/',
         views.ContentOrderView.as_view(),
         name = 'content_order'),
+    # public search
+    path('search/',
+        views.CourseSearchView.as_view(),
+        name = 'course_search'),
     # displays all courses for a subject
     path('subject/<slug:subject>)/',
         views.CourseListView.as_view(),
@@ -1,3 +1,6 @@
+import os
+
+from django.conf import settings
 from django.urls import reverse_lazy
 from django.views.generic.list import ListView
 from django.views.generic.edit import CreateView, UpdateView, \
@@ -5,17 +8,27 @@ from django.views.generic.edit import CreateView, UpdateView, \
 from django.contrib.auth.mixins import LoginRequiredMixin, \
                                        PermissionRequiredMixin
 from django.shortcuts import redirect, get_object_or_404
+from django.http import Http404
 from django.views.generic.base import TemplateResponseMixin, View
 from django.forms.models import modelform_factory
 from django.apps import apps
-from django.db.models import Count
+from django.contrib.contenttypes.models import ContentType
 from django.views.generic.detail import DetailView
+from django.db.models import OuterRef, Subquery
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 
 from .models import Course, Module, Content, Subject
-from .forms import ModuleFormSet
+from . import analytics, cloning, derivatives, search, uploads
+from .media import serve_file, serve_path
+from .forms import ModuleFormSet, BulkUploadForm, CourseCloneForm
+from .pagination import KeysetPaginationMixin, KeysetPage, InvalidCursor, \
+                        encode_cursor, decode_cursor
 from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
 from students.forms import CourseEnrollForm
+from students.enrollment import get_enrolled_course_ids
 
 
 # ===================================================================================
@@ -89,12 +102,22 @@ class OwnerCourseEditMixin(OwnerCourseMixin, OwnerEditMixin):
     template_name = 'courses/manage/course/form.html'
 
 
-class ManageCourseListView(OwnerCourseMixin, ListView):
-    '''lists the courses created by the user
+class ManageCourseListView(OwnerCourseMixin, KeysetPaginationMixin, ListView):
+    '''lists the courses created by the user, one page at a time
     '''
 
     template_name = 'courses/manage/course/list.html'
 
+    def get_queryset(self):
+        '''adds the id of the first module of each course for the content link
+        '''
+
+        first_module = Module.objects.filter(course=OuterRef('pk')) \
+                                     .order_by('order') \
+                                     .values('id')[:1]
+        return super(ManageCourseListView, self).get_queryset() \
+                   .annotate(first_module_id=Subquery(first_module))
+
 
 class CourseCreateView(PermissionRequiredMixin, OwnerCourseEditMixin, CreateView):
     '''uses a modelform to create a new course object, uses the fields from OwnerCourseEditMixin to build a model form and subclasses CreateView
@@ -120,6 +143,31 @@ class CourseDeleteView(PermissionRequiredMixin,
     success_url = reverse_lazy('manage_course_list')
     permission_required = 'courses.delete_course'
 
+
+class CourseCloneView(PermissionRequiredMixin, OwnerCourseMixin, DetailView):
+    '''copies a course of the user with its modules and contents, e.g. to run
+        it again next term, and opens the copy for editing
+    '''
+
+    template_name = 'courses/manage/course/clone.html'
+    permission_required = 'courses.add_course'
+
+    def get_context_data(self, **kwargs):
+        context = super(CourseCloneView, self).get_context_data(**kwargs)
+        context.setdefault('form', CourseCloneForm(
+            initial={'title': 'Copy of {}'.format(self.object.title)}))
+        return context
+
+    def post(self, request, pk):
+        self.object = self.get_object()
+        form = CourseCloneForm(data=request.POST)
+        if not form.is_valid():
+            return self.render_to_response(self.get_context_data(form=form))
+        clone = cloning.clone_course(self.object, owner=request.user,
+                                     title=form.cleaned_data['title'],
+                                     share_media=form.cleaned_data['share_media'])
+        return redirect('course_edit', clone.id)
+
 # ===================================================================================
 # modules
 # ===================================================================================
@@ -255,6 +303,45 @@ class ContentCreateUpdateView(TemplateResponseMixin, View):
         return self.render_to_response({'form': form,
                                         'object': self.obj})
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ModuleContentUploadView(LoginRequiredMixin, TemplateResponseMixin, View):
+    '''view that creates a file or image content for each of many uploaded files
+    '''
+
+    template_name = 'courses/manage/module/upload.html'
+
+    def dispatch(self, request, module_id):
+        '''spools the uploads to temporary files instead of memory. the upload
+            handlers can't change once the body is read, so the csrf check
+            reading it runs afterwards
+        '''
+
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return csrf_protect(super(ModuleContentUploadView,
+                                  self).dispatch)(request, module_id)
+
+    def get_module(self, request, module_id):
+        return get_object_or_404(Module.objects.select_related('course'),
+                                 id=module_id,
+                                 course__owner=request.user)
+
+    def get(self, request, module_id):
+        return self.render_to_response({'module': self.get_module(request, module_id),
+                                        'form': BulkUploadForm()})
+
+    def post(self, request, module_id):
+        module = self.get_module(request, module_id)
+        form = BulkUploadForm(data=request.POST, files=request.FILES)
+        files = request.FILES.getlist('files')
+        limit = getattr(settings, 'COURSES_BULK_UPLOAD_MAX_FILES', 100)
+        if form.is_valid() and len(files) > limit:
+            form.add_error('files', 'Upload at most {} files at once.'.format(limit))
+        if form.is_valid():
+            uploads.create_contents(module, request.user, files)
+            return redirect('module_content_list', module.id)
+        return self.render_to_response({'module': module,
+                                        'form': form})
+
 class ContentDeleteView(View):
     '''view for deleting content
     '''
@@ -274,6 +361,63 @@ class ContentDeleteView(View):
         content.delete()
         return redirect('module_content_list', module.id)
 
+class ContentMediaView(View):
+    '''streams the file of a file or image content to its owner and to the
+        students enrolled in a course that contains it
+    '''
+
+    def get_item(self, model_name, id):
+        if model_name not in ['file', 'image']:
+            raise Http404('No media found')
+        model = apps.get_model(app_label='courses',
+                               model_name=model_name)
+        return get_object_or_404(model, id=id)
+
+    # (content id, course id) of the contents showing the item in the courses
+    # of the student, counted as downloads
+    downloaded = ()
+
+    def can_access(self, user, item):
+        if not user.is_authenticated:
+            return False
+        if item.owner_id == user.id:
+            return True
+        contents = list(Content.objects.filter(
+                            content_type=ContentType.objects.get_for_model(item),
+                            object_id=item.id).values_list('id', 'module__course_id'))
+        course_ids = get_enrolled_course_ids(user)
+        if contents and not any(course_id in course_ids for id, course_id in contents):
+            # the enrollment may be newer than the cached ids
+            course_ids = get_enrolled_course_ids(user, refresh=True)
+        self.downloaded = [(id, course_id) for id, course_id in contents
+                           if course_id in course_ids]
+        return bool(self.downloaded)
+
+    def get(self, request, model_name, id, variant=None):
+        item = self.get_item(model_name, id)
+        if not self.can_access(request.user, item):
+            raise Http404('No media found')
+        # the first request of the original, not the resized copies of the
+        # pages or the following ranges of a download
+        if variant is None and \
+                request.META.get('HTTP_RANGE', 'bytes=0-').startswith('bytes=0-'):
+            analytics.record(analytics.DOWNLOAD, request.user, self.downloaded)
+        if variant and model_name == 'image':
+            # resized copy, fall back to the original if it was evicted
+            found = item.get_variants().get(variant)
+            if found and os.path.exists(os.path.join(settings.MEDIA_ROOT,
+                                                     found['name'])):
+                response = serve_path(request,
+                                      os.path.join(settings.MEDIA_ROOT, found['name']),
+                                      found['name'])
+                # variants are stored under the hash of their content
+                response['Cache-Control'] = 'private, max-age=31536000'
+                return response
+            if found:
+                derivatives.schedule(item, once=True)
+        return serve_file(request, item.file,
+                          as_attachment=model_name == 'file')
+
 # ===================================================================================
 # Module and Content List View
 # ===================================================================================
@@ -288,11 +432,43 @@ class ModuleContentListView(TemplateResponseMixin, View):
         '''method for getting the module obj with given id that belongs to current user and renders a template with the given module
         '''
 
-        module = get_object_or_404(Module,
+        module = get_object_or_404(Module.objects.select_related('course'),
                                     id=module_id,
                                     course__owner=request.user)
-        
-        return self.render_to_response({'module': module})
+        # load the items of all contents with one query per content type
+        contents = module.contents.with_items()
+        return self.render_to_response({'module': module,
+                                        'contents': contents})
+
+
+class CourseAnalyticsView(LoginRequiredMixin, TemplateResponseMixin, View):
+    '''views and downloads of the contents of a course for its owner, read
+        from the daily rollups
+    '''
+
+    template_name = 'courses/manage/course/analytics.html'
+
+    def get(self, request, pk):
+        course = get_object_or_404(Course, id=pk, owner=request.user)
+        try:
+            days = min(max(int(request.GET.get('days', 30)), 1), 365)
+        except ValueError:
+            days = 30
+        totals = analytics.report(course, days)
+        modules = list(course.modules.all())
+        by_id = {module.id: module for module in modules}
+        for module in modules:
+            module.content_stats = []
+        for content in Content.objects.filter(module__course=course).with_items():
+            stats = totals.get(content.id, {})
+            by_id[content.module_id].content_stats.append({
+                'content': content,
+                'views': stats.get(analytics.VIEW, (0, 0)),
+                'downloads': stats.get(analytics.DOWNLOAD, (0, 0)),
+            })
+        return self.render_to_response({'course': course,
+                                        'modules': modules,
+                                        'days': days})
 
 # ===================================================================================
 # ReOrder Modules and contents
@@ -305,10 +481,13 @@ class ModuleOrderView(CsrfExemptMixin,
     '''
     
     def post(self, request):
-        for id, order in self.request_json.items():
-            Module.objects.filter(id=id,
-                    course__owner=request.user).update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+        if not isinstance(self.request_json, dict):
+            return self.render_bad_request_response()
+        changed, rejected = Module.objects.filter(
+                    course__owner=request.user).reorder(self.request_json)
+        return self.render_json_response({'saved': 'OK',
+                                          'changed': changed,
+                                          'rejected': rejected})
 
 class ContentOrderView(CsrfExemptMixin,
                     JsonRequestResponseMixin,
@@ -317,39 +496,46 @@ class ContentOrderView(CsrfExemptMixin,
     '''
     
     def post(self, request):
-        for id, order in self.request_json.items():
-            Content.objects.filter(id=id,
-                        module__course__owner=request.user) \
-                            .update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+        if not isinstance(self.request_json, dict):
+            return self.render_bad_request_response()
+        changed, rejected = Content.objects.filter(
+                    module__course__owner=request.user).reorder(self.request_json)
+        return self.render_json_response({'saved': 'OK',
+                                          'changed': changed,
+                                          'rejected': rejected})
 
 # ===================================================================================
 # Course Catalog
 # ===================================================================================
 
-class CourseListView(TemplateResponseMixin, View):
-    '''View that lists all available courses
+class CourseListView(KeysetPaginationMixin, TemplateResponseMixin, View):
+    '''View that lists all available courses, one page at a time
     '''
 
     model = Course
     template_name = 'courses/course/list.html'
+    # read only, its reads may go to a replica (educa/routers.py)
+    use_replica = True
+    # the same for every anonymous visitor (educa.middleware.PageCacheMiddleware)
+    cache_anonymous_pages = True
 
     def get(self, request, subject=None):
-        '''retrieve all subjects including the total number of courses for each
-            retrieve all courses and the total number of modules for each
+        '''retrieve all subjects and all courses, the total number of courses
+            for each subject and of modules for each course are stored on the rows
         '''
 
-        subjects = Subject.objects.annotate(
-                    total_courses=Count('courses'))
-        courses = Course.objects.annotate(
-                    total_modules=Count('modules'))
+        subjects = Subject.objects.all()
+        # the template shows the subject and instructor of every course
+        courses = Course.objects.select_related('subject', 'owner')
         if subject:
             # the slug is a URL parameter to retrieve the corresponding subject
             subject = get_object_or_404(Subject, slug=subject)
             courses = courses.filter(subject=subject)
+        page = self.paginate_keyset(courses)
         return self.render_to_response({'subjects': subjects,
                                         'subject': subject,
-                                        'courses': courses})
+                                        'courses': page.object_list,
+                                        'page': page})
 
 
 class CourseDetailView(DetailView):
@@ -357,7 +543,10 @@ class CourseDetailView(DetailView):
     '''
 
     model = Course
+    queryset = Course.objects.select_related('subject', 'owner')
     template_name = 'courses/course/detail.html'
+    use_replica = True
+    cache_anonymous_pages = True
 
     def get_context_data(self, **kwargs):
         '''method that includes enrollment form in teh context for rendering templates
@@ -369,3 +558,32 @@ class CourseDetailView(DetailView):
                                    initial={'course':self.object})
         return context
 
+
+
+class CourseSearchView(KeysetPaginationMixin, TemplateResponseMixin, View):
+    '''public full text search over courses, modules and text contents
+    '''
+
+    template_name = 'courses/course/search.html'
+    use_replica = True
+
+    def get(self, request):
+        '''results are ranked by relevance, the cursor holds the (score, id)
+            of the last result of the previous page
+        '''
+
+        query = request.GET.get('q', '').strip()
+        after = None
+        if request.GET.get(self.cursor_param):
+            try:
+                score, id = decode_cursor(request.GET[self.cursor_param])
+                after = (float(score), int(id))
+            except (InvalidCursor, TypeError, ValueError):
+                raise Http404('Invalid page cursor')
+        results, last = search.search(query, after=after,
+                                      limit=self.get_page_size())
+        page = KeysetPage(results,
+                          next_cursor=encode_cursor(list(last)) if last else None)
+        return self.render_to_response({'query': query,
+                                        'results': results,
+                                        'page': page})
@@ -0,0 +1,52 @@
+"""
+ASGI config for educa project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+e.g.
+
+    uvicorn educa.asgi:application --workers 4
+
+Django 3.0 and later serve ASGI natively. Older versions run the WSGI
+application through asgiref's adapter, asgiref is listed in requirements.txt.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'educa.settings')
+
+if django.VERSION >= (3, 0):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+else:
+    from django.core.exceptions import ImproperlyConfigured
+    from django.core.wsgi import get_wsgi_application
+
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        raise ImproperlyConfigured('Serving educa over ASGI with Django {} needs '
+                                   'asgiref, pip install asgiref'.format(django.get_version()))
+
+    def strip_header_values(wrapped):
+        '''Django before 3.0 starts the Set-Cookie values with a space, which
+            WSGI servers accept and strict ASGI servers like uvicorn's h11 don't
+        '''
+
+        async def app(scope, receive, send):
+            async def send_stripped(message):
+                if message['type'] == 'http.response.start':
+                    message = dict(message, headers=[(name, value.strip())
+                                                     for name, value in message['headers']])
+                await send(message)
+            await wrapped(scope, receive, send_stripped)
+        return app
+
+    application = strip_header_values(WsgiToAsgi(get_wsgi_application()))
+
+# compiles the templates before the first request, once the apps are loaded
+from educa.warmup import warm_templates  # noqa: E402
+
+warm_templates()
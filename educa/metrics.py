@@ -0,0 +1,119 @@
+"""
+In-process request metrics for educa.
+
+The PerformanceMiddleware (educa/middleware.py) observes every request here,
+grouped by the name of the resolved URL, and metrics_view exposes the
+aggregates in the Prometheus text format.
+"""
+
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    '''cumulative histogram with fixed buckets, as exposed by prometheus
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+class Registry(object):
+    '''histograms and counters of this process, keyed by metric and view name
+    '''
+
+    metrics = (
+        # name, help, type, buckets
+        ('educa_request_duration_seconds', 'Wall time of requests.', 'histogram', DURATION_BUCKETS),
+        ('educa_request_db_queries', 'SQL queries per request.', 'histogram', COUNT_BUCKETS),
+        ('educa_request_db_duration_seconds', 'SQL time per request.', 'histogram', DURATION_BUCKETS),
+        ('educa_request_template_duration_seconds', 'Template render time per request.', 'histogram', DURATION_BUCKETS),
+        ('educa_render_cache_hits_total', 'Content render cache hits.', 'counter', None),
+        ('educa_render_cache_misses_total', 'Content render cache misses.', 'counter', None),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.values = {name: {} for name, help, type, buckets in self.metrics}
+
+    def observe(self, view, duration, queries, db_duration, template_duration,
+                cache_hits, cache_misses):
+        observations = (
+            ('educa_request_duration_seconds', duration),
+            ('educa_request_db_queries', queries),
+            ('educa_request_db_duration_seconds', db_duration),
+            ('educa_request_template_duration_seconds', template_duration),
+        )
+        with self._lock:
+            for name, value in observations:
+                histogram = self.values[name].get(view)
+                if histogram is None:
+                    buckets = next(b for n, h, t, b in self.metrics if n == name)
+                    histogram = self.values[name][view] = Histogram(buckets)
+                histogram.observe(value)
+            for name, value in (('educa_render_cache_hits_total', cache_hits),
+                                ('educa_render_cache_misses_total', cache_misses)):
+                self.values[name][view] = self.values[name].get(view, 0) + value
+
+    def render(self):
+        '''the metrics in the prometheus text exposition format
+        '''
+
+        lines = []
+        with self._lock:
+            for name, help, type, buckets in self.metrics:
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, type))
+                for view, value in sorted(self.values[name].items()):
+                    label = 'view="{}"'.format(_escape(view))
+                    if type == 'counter':
+                        lines.append('{}{{{}}} {}'.format(name, label, value))
+                        continue
+                    for bound, count in value.samples():
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, label, bound, count))
+                    lines.append('{}_sum{{{}}} {}'.format(name, label, value.sum))
+                    lines.append('{}_count{{{}}} {}'.format(name, label, value.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    '''prometheus scrape endpoint, only answered to INTERNAL_IPS unless DEBUG is on
+    '''
+
+    if not settings.DEBUG and \
+            request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,134 @@
+"""
+Middleware of the educa project.
+"""
+
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from courses.cache import page_cache, render_cache
+from .metrics import registry
+from .routers import get_replicas, replica_reads
+
+
+class RequestTimings(object):
+    '''timings of one request, filled in by the middleware and the query wrapper
+    '''
+
+    def __init__(self):
+        self.queries = 0
+        self.db_duration = 0.0
+        self.template_duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook, runs around every SQL query
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_duration += perf_counter() - start
+            self.queries += 1
+
+
+class PerformanceMiddleware(object):
+    '''records the wall time, SQL queries and time, template render time and
+        render cache hits of each request per URL name. adds them to the
+        response as a Server-Timing header and to the in-process histograms
+        exposed at /metrics
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = request._timings = RequestTimings()
+        hits, misses = render_cache.thread_stats()
+        start = perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings))
+            response = self.get_response(request)
+        duration = perf_counter() - start
+        hits, misses = [now - before for now, before
+                        in zip(render_cache.thread_stats(), (hits, misses))]
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else '<unresolved>'
+        registry.observe(view, duration, timings.queries, timings.db_duration,
+                         timings.template_duration, hits, misses)
+        response['Server-Timing'] = ', '.join([
+            'app;dur={:.2f}'.format(duration * 1000),
+            'db;dur={:.2f};desc="{} queries"'.format(timings.db_duration * 1000,
+                                                     timings.queries),
+            'tpl;dur={:.2f}'.format(timings.template_duration * 1000),
+            'cache;desc="{} hits, {} misses"'.format(hits, misses),
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        # render here to time it, the handler won't render the response again
+        start = perf_counter()
+        response.render()
+        request._timings.template_duration += perf_counter() - start
+        return response
+
+
+class ReplicaRoutingMiddleware(object):
+    '''lets the read only views (use_replica = True on the view class) read
+        from the replicas. a request that may write pins the user's reads to
+        the primary for REPLICA_STICKY_SECONDS with a cookie, so they see
+        their own writes before the replicas catch up
+    '''
+
+    cookie_name = 'educa_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ExitStack() as stack:
+            request._replica_reads = stack
+            # the reads of the template render happen in get_response too
+            response = self.get_response(request)
+        if get_replicas() and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(self.cookie_name, '1',
+                                max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10),
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if get_replicas() and getattr(view_class, 'use_replica', False) and \
+                request.method in ('GET', 'HEAD') and \
+                self.cookie_name not in request.COOKIES:
+            request._replica_reads.enter_context(replica_reads())
+
+
+class PageCacheMiddleware(object):
+    '''serves the pages of the views with cache_anonymous_pages = True to
+        anonymous visitors from courses.cache.page_cache. follows
+        ReplicaRoutingMiddleware: a page rendered to be cached reads from the
+        primary, a lagging replica would store old rows under the new version
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ExitStack() as stack:
+            request._page_reads = stack
+            response = self.get_response(request)
+        page_cache.set(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if not getattr(view_class, 'cache_anonymous_pages', False) or \
+                request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return None
+        response = page_cache.get(request)
+        if response is None and getattr(request, '_page_cache_key', None):
+            request._page_reads.enter_context(replica_reads(False))
+        return response
@@ -0,0 +1,58 @@
+"""
+Database routing of educa.
+
+Writes always go to the primary ('default'). Reads go to the primary as well,
+except in the views marked with use_replica = True, where the
+ReplicaRoutingMiddleware (educa/middleware.py) lets them spread over the
+DATABASE_REPLICAS, unless the user wrote something a moment ago.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+PRIMARY = 'default'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    '''routes the reads made inside the block to the replicas
+    '''
+
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class PrimaryReplicaRouter(object):
+    '''sends writes to the primary and the reads of replica_reads() blocks
+        to a random replica
+    '''
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if replicas and _replica_reads.get():
+            return random.choice(replicas)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get their tables from the primary
+        return db == PRIMARY
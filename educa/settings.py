@@ -27,6 +27,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# addresses allowed to scrape /metrics when DEBUG is off
+INTERNAL_IPS = ['127.0.0.1']
+
 
 # Application definition
 
@@ -43,23 +46,36 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first so its timings cover the other middleware too
+    'educa.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'educa.middleware.ReplicaRoutingMiddleware',
+    'educa.middleware.PageCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'educa.urls'
 
+template_loaders = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # compiled templates are kept in memory outside development,
+            # educa/wsgi.py compiles them all when the process starts
+            'loaders': template_loaders if DEBUG else [
+                ('django.template.loaders.cached.Loader', template_loaders),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -80,9 +96,89 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # stand-in read replica for local testing, a copy of db.sqlite3 refreshed
+    # with manage.py sync_replicas
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['educa.routers.PrimaryReplicaRouter']
+# aliases the read only views read from, e.g. EDUCA_REPLICAS=replica. none
+# sends every query to the primary
+DATABASE_REPLICAS = [alias for alias in os.environ.get('EDUCA_REPLICAS', '').split(',')
+                     if alias]
+# seconds the reads of a user stay on the primary after a POST, longer than
+# the replication lag
+REPLICA_STICKY_SECONDS = 10
+
+
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # rendered html of content items. locmem evicts the least recently
+    # used entries once MAX_ENTRIES is reached
+    'render': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'render',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # fragments of the {% cache %} template tag, e.g. the module navigation,
+    # and their versions. use a backend shared by all the processes, such as
+    # memcached, when several serve the site
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # enrolled course ids of the students, shared by all the processes like
+    # template_fragments
+    'enrollments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'enrollments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # pages served to anonymous visitors and the catalog version, shared by
+    # all the processes like template_fragments
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+}
+
+# cache alias used to store the rendered content items
+COURSES_RENDER_CACHE = 'render'
+
+# pages of the catalog served to anonymous visitors: fresh for
+# COURSES_PAGE_CACHE_SECONDS, then served stale for up to
+# COURSES_PAGE_CACHE_STALE_SECONDS while one request renders them again
+COURSES_PAGE_CACHE = 'pages'
+COURSES_PAGE_CACHE_SECONDS = 300
+COURSES_PAGE_CACHE_STALE_SECONDS = 60
+COURSES_PAGE_CACHE_LOCK_SECONDS = 10
+
+
+# number of courses per page in the course lists
+COURSES_PAGE_SIZE = 20
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -127,3 +223,46 @@ LOGIN_REDIRECT_URL = reverse_lazy('student_course_list')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+# let the web server send the files of file and image contents once access
+# is checked: None to stream them from django, 'x-sendfile' or 'x-accel-redirect'
+COURSES_MEDIA_OFFLOAD = None
+# nginx internal location that maps to MEDIA_ROOT, used with 'x-accel-redirect'
+COURSES_MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# resized variants of image contents, stored in this folder of MEDIA_ROOT and
+# built by a pool of worker processes (needs Pillow)
+COURSES_DERIVATIVES_DIR = 'derivatives'
+COURSES_DERIVATIVES_WORKERS = 2
+# the least recently built or reused variants are removed above this size,
+# checked at most once every COURSES_DERIVATIVES_EVICT_SECONDS
+COURSES_DERIVATIVES_MAX_BYTES = 512 * 1024 * 1024
+COURSES_DERIVATIVES_EVICT_SECONDS = 300
+# an evicted variant that is requested is built again once in this many seconds
+COURSES_DERIVATIVES_PENDING_SECONDS = 300
+
+# files the bulk upload of a module accepts at once, each is spooled to disk
+COURSES_BULK_UPLOAD_MAX_FILES = 100
+
+# resolve the player and thumbnail of saved videos with the provider's api when
+# the url alone isn't enough, refresh_video_embeds fills in what is missing
+COURSES_VIDEO_EMBED_ONLINE = True
+# seconds django-embed-video waits for a provider
+EMBED_VIDEO_TIMEOUT = 3
+
+# views and downloads of contents are buffered in each process and written in
+# a batch once this many are waiting or the oldest is this many seconds old
+COURSES_ANALYTICS_BUFFER_SIZE = 1000
+COURSES_ANALYTICS_FLUSH_SECONDS = 30
+# days of raw events kept once rolled up into daily stats
+COURSES_ANALYTICS_RETENTION_DAYS = 30
+
+# cache alias and seconds the enrolled course ids of a user are kept. a course
+# missing from them is looked up again, an enrollment ending shows after the timeout
+STUDENTS_ENROLLMENT_CACHE = 'enrollments'
+STUDENTS_ENROLLMENT_CACHE_TIMEOUT = 300
+
+# the contents students view are buffered in each process and written in a
+# batch once this many are waiting or the oldest is this many seconds old
+STUDENTS_PROGRESS_BUFFER_SIZE = 500
+STUDENTS_PROGRESS_FLUSH_SECONDS = 30
@@ -20,6 +20,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 
 from courses.views import CourseListView
+from courses.api import CourseTreeView
+from .metrics import metrics_view
 
 urlpatterns = [
     path('accounts/login/', auth_views.LoginView.as_view(), name='login'),
@@ -28,6 +30,8 @@ urlpatterns = [
     path('course/', include('courses.urls')),
     path('', CourseListView.as_view(), name = 'course_list'),
     path('students/', include('students.urls')),
+    path('api/v1/courses/<int:pk>/', CourseTreeView.as_view(), name='api_course_tree'),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,48 @@
+"""
+Template warm up.
+
+The cached template loader compiles a template the first time it is used and
+keeps it for the life of the process, so the first requests served after a
+deploy pay for parsing the templates. warm_templates() compiles every template
+the cached loaders can find, educa/wsgi.py and educa/asgi.py call it once the
+application is set up. With DEBUG on templates aren't cached and nothing is
+compiled ahead.
+"""
+
+import os
+
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+
+
+def template_names(loader):
+    '''names of the files under the template folders of loader
+    '''
+
+    for folder in loader.get_dirs():
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                yield os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+
+
+def warm_templates():
+    '''compiles the templates of the cached loaders of every template engine
+
+    Returns:
+        [int] -- [number of templates compiled]
+    '''
+
+    compiled = 0
+    for backend in engines.all():
+        for loader in getattr(getattr(backend, 'engine', None), 'template_loaders', []):
+            if not isinstance(loader, CachedLoader):
+                continue
+            for name in sorted({name for inner in loader.loaders
+                                for name in template_names(inner)}):
+                try:
+                    loader.get_template(name)
+                except Exception:
+                    # not a template, or one whose tag library isn't installed
+                    continue
+                compiled += 1
+    return compiled
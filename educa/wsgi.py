@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'educa.settings')
 
 application = get_wsgi_application()
+
+# compiles the templates before the first request, once the apps are loaded
+from educa.warmup import warm_templates  # noqa: E402
+
+warm_templates()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StudentsConfig(AppConfig):
     name = 'students'
+
+    def ready(self):
+        # connect the signal handlers
+        from . import signals
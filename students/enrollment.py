@@ -0,0 +1,119 @@
+import csv
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models import Q
+
+from courses import counters
+from courses.models import Course
+
+
+
+def batched(iterable, size):
+    '''yields lists of at most size items without reading the whole iterable
+    '''
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _enrolled_key(user_id):
+    return 'enrolled_courses:{}'.format(user_id)
+
+
+def _cache():
+    return caches[getattr(settings, 'STUDENTS_ENROLLMENT_CACHE', 'default')]
+
+
+def get_enrolled_course_ids(user, refresh=False):
+    '''ids of the courses the user is enrolled in, cached until the enrollments
+        of the user change. refresh reads them from the database again
+    '''
+
+    if not user.is_authenticated:
+        return frozenset()
+    key = _enrolled_key(user.pk)
+    course_ids = None if refresh else _cache().get(key)
+    if course_ids is None:
+        course_ids = frozenset(Course.students.through.objects.filter(user_id=user.pk)
+                                                              .values_list('course_id', flat=True))
+        _cache().set(key, course_ids,
+                     getattr(settings, 'STUDENTS_ENROLLMENT_CACHE_TIMEOUT', 300))
+    return course_ids
+
+
+def is_enrolled(user, course_id):
+    '''whether user is enrolled in the course. a course missing from the cached
+        ids is looked up again, the cache of a process that didn't see the
+        enrollment may be out of date
+    '''
+
+    return course_id in get_enrolled_course_ids(user) or \
+        course_id in get_enrolled_course_ids(user, refresh=True)
+
+
+def invalidate_enrolled_course_ids(user_ids):
+    _cache().delete_many([_enrolled_key(user_id) for user_id in user_ids])
+
+
+def read_identifiers(lines):
+    '''yields the usernames or emails of a roster CSV one row at a time.
+        a header row naming a 'username' or 'email' column selects that column,
+        otherwise the first column is used
+    '''
+
+    column = 0
+    for number, row in enumerate(csv.reader(lines)):
+        cells = [cell.strip() for cell in row]
+        if number == 0:
+            header = [cell.lower() for cell in cells]
+            names = [name for name in ('username', 'email') if name in header]
+            if names:
+                column = header.index(names[0])
+                continue
+        if len(cells) > column and cells[column]:
+            yield cells[column]
+
+
+def bulk_enroll(course, identifiers, batch_size=1000):
+    '''enrolls the users matching identifiers (usernames or emails) in course.
+        users are resolved and enrolled one batch at a time, the enrollments are
+        inserted with bulk_create ignoring the ones that already exist
+
+    Returns:
+        [dict] -- [number of users 'created' (newly enrolled), 'skipped' (already enrolled or repeated) and 'unknown' identifiers]
+    '''
+
+    Enrollment = Course.students.through
+    result = {'created': 0, 'skipped': 0, 'unknown': 0}
+    for batch in batched(identifiers, batch_size):
+        names = set(batch)
+        users = User.objects.filter(Q(username__in=names) | Q(email__in=names)) \
+                            .values_list('id', 'username', 'email')
+        found = set()
+        user_ids = set()
+        for id, username, email in users:
+            found.update({username, email} & names)
+            user_ids.add(id)
+        result['unknown'] += sum(1 for name in batch if name not in found)
+        enrolled = set(Enrollment.objects.filter(course_id=course.id,
+                                                 user_id__in=user_ids)
+                                         .values_list('user_id', flat=True))
+        new_ids = user_ids - enrolled
+        Enrollment.objects.bulk_create(
+            [Enrollment(course_id=course.id, user_id=id) for id in new_ids],
+            batch_size=batch_size,
+            ignore_conflicts=True)
+        invalidate_enrolled_course_ids(new_ids)
+        result['created'] += len(new_ids)
+        result['skipped'] += sum(1 for name in batch if name in found) - len(new_ids)
+    if result['created']:
+        # bulk_create doesn't send m2m_changed, update the course counter here
+        counters.refresh(Course, 'total_students', [course.id])
+    return result
@@ -7,4 +7,11 @@ class CourseEnrollForm(forms.Form):
     '''
 
     course = forms.ModelChoiceField(queryset=Course.objects.all(),
-                                    widget=forms.HiddenInput)
\ No newline at end of file
+                                    widget=forms.HiddenInput)
+
+
+class BulkEnrollForm(forms.Form):
+    '''form used by instructors to upload a CSV roster of usernames or emails
+    '''
+
+    roster = forms.FileField()
\ No newline at end of file
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from courses.models import Course
+from students.enrollment import bulk_enroll, read_identifiers
+
+
+
+class Command(BaseCommand):
+    '''enrolls the students listed in a CSV roster of usernames or emails in a course
+    '''
+
+    help = 'Enroll the users of a CSV roster in a course'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id', type=int)
+        parser.add_argument('roster', help='path of the CSV file')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=1000,
+                            help='number of rows resolved and inserted per batch')
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.get(id=options['course_id'])
+        except Course.DoesNotExist:
+            raise CommandError('Course {} does not exist'.format(options['course_id']))
+        try:
+            with open(options['roster'], newline='', encoding='utf-8-sig') as roster, \
+                    transaction.atomic():
+                result = bulk_enroll(course, read_identifiers(roster),
+                                     batch_size=options['batch_size'])
+        except UnicodeDecodeError:
+            raise CommandError('{} is not a UTF-8 encoded CSV file'.format(options['roster']))
+        self.stdout.write(self.style.SUCCESS(
+            'Enrolled {created} students, {skipped} skipped, {unknown} unknown'.format(**result)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from students import progress
+
+
+
+class Command(BaseCommand):
+    '''recomputes the completed contents and percentages of the course progress
+        rollups, e.g. after contents were added to or removed from courses
+    '''
+
+    help = 'Recompute the course progress rollups of the students'
+
+    def handle(self, *args, **options):
+        total = progress.refresh_rollups()
+        self.stdout.write(self.style.SUCCESS('Recomputed {} course progress rows'.format(total)))
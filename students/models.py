@@ -1,3 +1,56 @@
 from django.db import models
 
 # Create your models here.
+from django.contrib.auth.models import User
+
+from courses.models import Course, Module, Content
+
+
+class ContentProgress(models.Model):
+    '''a content a student has viewed. written in batches by students/progress.py,
+        a content counts as completed once its module was opened
+    '''
+
+    user = models.ForeignKey(User,
+                             related_name='content_progress',
+                             on_delete=models.CASCADE)
+    content = models.ForeignKey(Content,
+                                related_name='progress',
+                                on_delete=models.CASCADE)
+    # copied from the content so the rollups don't join through it
+    course = models.ForeignKey(Course,
+                               related_name='content_progress',
+                               on_delete=models.CASCADE)
+    first_viewed = models.DateTimeField()
+    last_viewed = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'content')
+        index_together = [('user', 'course')]
+
+
+class CourseProgress(models.Model):
+    '''rollup of the progress of a student in a course, updated with every batch
+        of content views
+    '''
+
+    user = models.ForeignKey(User,
+                             related_name='course_progress',
+                             on_delete=models.CASCADE)
+    course = models.ForeignKey(Course,
+                               related_name='progress',
+                               on_delete=models.CASCADE)
+    completed_contents = models.PositiveIntegerField(default=0)
+    # completed_contents out of the contents of the course when last updated
+    percent = models.PositiveSmallIntegerField(default=0)
+    # where the student left off
+    last_module = models.ForeignKey(Module,
+                                    related_name='+',
+                                    null=True,
+                                    on_delete=models.SET_NULL)
+    last_viewed = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'course')
+        # the resume lookup reads the latest row of a user from this index
+        index_together = [('user', 'last_viewed')]
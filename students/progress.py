@@ -0,0 +1,222 @@
+"""
+Write-behind tracking of the contents students view.
+
+StudentCourseDetailView records the contents of the module a student opens
+with record(). The views are coalesced in a buffer of the process and written
+in batches, with a bulk insert and a bulk update per table, once the buffer
+holds STUDENTS_PROGRESS_BUFFER_SIZE views or its oldest view is
+STUDENTS_PROGRESS_FLUSH_SECONDS old. The request recording the view that makes
+the buffer due writes the batch. Views buffered when a process stops are lost,
+the progress of a student is not an audit log.
+
+Each batch also updates the CourseProgress rollups of the students and courses
+it touches: the number and percentage of the contents completed and the module
+the student left off in, which resume() reads back with one query.
+"""
+
+import threading
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from courses.models import Content, Module
+from educa.routers import replica_reads
+from .models import ContentProgress, CourseProgress
+
+
+class ProgressBuffer(object):
+    '''content views waiting to be written, one entry per student and content
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (user_id, content_id) -> [course_id, first_viewed, last_viewed]
+        self.contents = {}
+        # (user_id, course_id) -> (module_id, last_viewed)
+        self.courses = {}
+        self._started = None
+
+    def __len__(self):
+        return len(self.contents)
+
+    def add(self, user_id, course_id, module_id, content_ids, viewed):
+        '''buffers the views, returns whether the buffer should be written
+        '''
+
+        with self._lock:
+            for content_id in content_ids:
+                entry = self.contents.get((user_id, content_id))
+                if entry is None:
+                    self.contents[(user_id, content_id)] = [course_id, viewed, viewed]
+                else:
+                    entry[2] = viewed
+            self.courses[(user_id, course_id)] = (module_id, viewed)
+            if self._started is None:
+                self._started = monotonic()
+            return len(self.contents) >= getattr(settings, 'STUDENTS_PROGRESS_BUFFER_SIZE', 500) or \
+                monotonic() - self._started >= getattr(settings, 'STUDENTS_PROGRESS_FLUSH_SECONDS', 30)
+
+    def drain(self):
+        '''empties the buffer, returns what it held
+        '''
+
+        with self._lock:
+            contents, courses = self.contents, self.courses
+            self.contents, self.courses, self._started = {}, {}, None
+        return contents, courses
+
+
+buffer = ProgressBuffer()
+
+
+def record(user, module, contents, viewed=None):
+    '''buffers the views of the contents of module by user, writes the buffer when due
+    '''
+
+    if buffer.add(user.pk, module.course_id, module.id,
+                  [content.id for content in contents],
+                  viewed or timezone.now()):
+        flush()
+
+
+def flush():
+    '''writes the buffered views, returns the number of content views written
+    '''
+
+    contents, courses = buffer.drain()
+    if not courses:
+        return 0
+    # the existing rows are read back to be updated, from the primary
+    with replica_reads(False):
+        return write(contents, courses)
+
+
+def discard():
+    '''drops the buffered views, e.g. between tests
+    '''
+
+    return len(buffer.drain()[0])
+
+
+def _percent(completed, total):
+    return min(100, completed * 100 // total) if total else 0
+
+
+@transaction.atomic
+def write(contents, courses):
+    '''upserts the content views of a batch and the rollups of the courses
+        they belong to, with a fixed number of queries per batch
+    '''
+
+    # drop the views of students, contents and modules deleted since
+    user_ids = set(User.objects.filter(id__in={user_id for user_id, _ in courses})
+                               .values_list('id', flat=True))
+    content_ids = set(Content.objects.filter(id__in={id for _, id in contents})
+                                     .values_list('id', flat=True))
+    module_ids = set(Module.objects.filter(id__in={module_id for module_id, _ in courses.values()})
+                                   .values_list('id', flat=True))
+    contents = {key: entry for key, entry in contents.items()
+                if key[0] in user_ids and key[1] in content_ids}
+    courses = {key: entry for key, entry in courses.items()
+               if key[0] in user_ids and entry[0] in module_ids}
+
+    existing = ContentProgress.objects.filter(user_id__in={user_id for user_id, _ in contents},
+                                              content_id__in={id for _, id in contents}) \
+                                      .only('id', 'user_id', 'content_id', 'last_viewed')
+    changed = []
+    for progress in existing:
+        entry = contents.pop((progress.user_id, progress.content_id), None)
+        if entry is not None and entry[2] > progress.last_viewed:
+            progress.last_viewed = entry[2]
+            changed.append(progress)
+    ContentProgress.objects.bulk_update(changed, ['last_viewed'], batch_size=500)
+    # views of another process may have been written meanwhile, they win
+    ContentProgress.objects.bulk_create(
+        [ContentProgress(user_id=user_id, content_id=content_id, course_id=course_id,
+                         first_viewed=first_viewed, last_viewed=last_viewed)
+         for (user_id, content_id), (course_id, first_viewed, last_viewed) in contents.items()],
+        batch_size=500, ignore_conflicts=True)
+
+    rollups = CourseProgress.objects.filter(user_id__in={user_id for user_id, _ in courses},
+                                            course_id__in={id for _, id in courses})
+    rollups = {(progress.user_id, progress.course_id): progress for progress in rollups
+               if (progress.user_id, progress.course_id) in courses}
+    new = []
+    for (user_id, course_id), (module_id, viewed) in courses.items():
+        progress = rollups.get((user_id, course_id))
+        if progress is None:
+            progress = CourseProgress(user_id=user_id, course_id=course_id,
+                                      last_module_id=module_id, last_viewed=viewed)
+            new.append(progress)
+        elif viewed > progress.last_viewed:
+            progress.last_module_id = module_id
+            progress.last_viewed = viewed
+    _count_completed(new + list(rollups.values()))
+    CourseProgress.objects.bulk_update(list(rollups.values()),
+                                       ['completed_contents', 'percent',
+                                        'last_module', 'last_viewed'],
+                                       batch_size=500)
+    CourseProgress.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+    return len(contents) + len(changed)
+
+
+def _count_completed(rollups):
+    '''sets completed_contents and percent of the CourseProgress rows in rollups
+        with one query counting the views and one counting the contents
+    '''
+
+    if not rollups:
+        return
+    user_ids = {progress.user_id for progress in rollups}
+    course_ids = {progress.course_id for progress in rollups}
+    completed = {(row['user_id'], row['course_id']): row['total'] for row in
+                 ContentProgress.objects.filter(user_id__in=user_ids, course_id__in=course_ids)
+                                        .values('user_id', 'course_id')
+                                        .annotate(total=Count('id'))
+                                        .order_by()}
+    totals = dict(Content.objects.filter(module__course_id__in=course_ids)
+                                 .values('module__course_id')
+                                 .annotate(total=Count('id'))
+                                 .order_by()
+                                 .values_list('module__course_id', 'total'))
+    for progress in rollups:
+        progress.completed_contents = completed.get((progress.user_id, progress.course_id), 0)
+        progress.percent = _percent(progress.completed_contents,
+                                    totals.get(progress.course_id, 0))
+
+
+def refresh_rollups(batch_size=500):
+    '''recomputes every CourseProgress row, e.g. after contents were added to
+        courses. returns the number of rows
+    '''
+
+    total = 0
+    rows = CourseProgress.objects.order_by('id')
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return total
+        _count_completed(batch)
+        CourseProgress.objects.bulk_update(batch, ['completed_contents', 'percent'])
+        total += len(batch)
+        last_id = batch[-1].id
+
+
+def resume(user, course_id=None):
+    '''(course id, module id) where user left off in the course, or in the
+        course they viewed last. one query on the (user, last_viewed) index,
+        views still in the buffer aren't seen
+
+    Returns:
+        [tuple] -- [ids of the course and module, None when there is nothing to resume]
+    '''
+
+    rollups = CourseProgress.objects.filter(user_id=user.pk, last_module__isnull=False)
+    if course_id is not None:
+        rollups = rollups.filter(course_id=course_id)
+    return rollups.order_by('-last_viewed').values_list('course_id', 'last_module_id').first()
@@ -0,0 +1,25 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from courses.models import Course
+from .enrollment import invalidate_enrolled_course_ids
+
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def invalidate_enrollments(sender, instance, action, reverse, pk_set, **kwargs):
+    '''drops the cached course ids of the users whose enrollments changed.
+        when the change is made from the course side pk_set holds user ids
+    '''
+
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_enrolled_course_ids([instance.pk])
+    elif action == 'pre_clear':
+        # remember the students before they are removed
+        instance._cleared_student_ids = list(
+            instance.students.values_list('id', flat=True))
+    elif action == 'post_clear':
+        invalidate_enrolled_course_ids(getattr(instance, '_cleared_student_ids', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        invalidate_enrolled_course_ids(pk_set)
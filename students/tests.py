@@ -1,3 +1,228 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from courses.models import Course, Module
+from courses.testing import QueryBudgetTestCase, add_text, create_course
+from .enrollment import is_enrolled
+from .models import ContentProgress, CourseProgress
+from . import progress
 
 # Create your tests here.
+
+
+def student(dataset):
+    return dataset.students[0]
+
+
+def joined_course(dataset):
+    return dataset.students[0].course_joined.order_by('id').first()
+
+
+class StudentQueryBudgetTests(QueryBudgetTestCase):
+    '''the pages of enrolled students make a fixed number of queries
+    '''
+
+    def test_student_course_list(self):
+        self.assertQueryBudget(3, lambda dataset: reverse('student_course_list'),
+                               user=student)
+
+    def test_student_course_detail(self):
+        self.assertQueryBudget(9, lambda dataset:
+                               reverse('student_course_detail',
+                                       args=[joined_course(dataset).id]),
+                               user=student)
+
+    def test_student_course_detail_module(self):
+        def url(dataset):
+            course = joined_course(dataset)
+            return reverse('student_course_detail_module',
+                           args=[course.id, course.modules.last().id])
+        self.assertQueryBudget(9, url, user=student)
+
+
+class ProgressTests(TestCase):
+    '''content views are buffered, then written with a fixed number of queries
+    '''
+
+    def setUp(self):
+        progress.discard()
+        self.student = User.objects.create_user('student')
+        self.course = create_course()
+        self.course.students.add(self.student)
+        self.modules = [Module.objects.create(course=self.course, title=title)
+                        for title in ('Intervals', 'Scales')]
+        for module in self.modules:
+            for number in range(2):
+                add_text(module, 'Text', 'Text')
+        self.client.force_login(self.student)
+
+    def view(self, module):
+        return self.client.get(reverse('student_course_detail_module',
+                                       args=[self.course.id, module.id]))
+
+    def test_views_are_buffered(self):
+        self.view(self.modules[0])
+        self.assertEqual(len(progress.buffer), 2)
+        self.assertFalse(ContentProgress.objects.exists())
+        self.assertEqual(progress.flush(), 2)
+        rollup = CourseProgress.objects.get(user=self.student, course=self.course)
+        self.assertEqual((rollup.completed_contents, rollup.percent), (2, 50))
+        self.assertEqual(progress.resume(self.student),
+                         (self.course.id, self.modules[0].id))
+
+    def test_flush_when_due(self):
+        with override_settings(STUDENTS_PROGRESS_BUFFER_SIZE=3):
+            self.view(self.modules[0])
+            self.view(self.modules[1])
+        self.assertEqual(len(progress.buffer), 0)
+        self.assertEqual(ContentProgress.objects.filter(user=self.student).count(), 4)
+        self.assertEqual(CourseProgress.objects.get(user=self.student).percent, 100)
+
+    def test_batch_queries(self):
+        '''the queries of a batch don't grow with its size, and views of
+            contents deleted since are dropped
+        '''
+
+        self.view(self.modules[0])
+        progress.flush()
+        students = [User.objects.create_user('student{}'.format(number))
+                    for number in range(5)]
+        for student in students:
+            for module in self.modules:
+                progress.record(student, module, module.contents.all())
+        for module in self.modules:
+            progress.record(self.student, module, module.contents.all())
+        self.modules[1].contents.first().delete()
+        # with the savepoint of the transaction
+        with self.assertNumQueries(13):
+            progress.flush()
+        self.assertEqual(ContentProgress.objects.count(), 2 + 5 * 3 + 1)
+        self.assertEqual(CourseProgress.objects.get(user=students[0]).percent, 100)
+
+    def test_resume(self):
+        self.view(self.modules[1])
+        self.view(self.modules[0])
+        progress.flush()
+        with self.assertNumQueries(1):
+            self.assertEqual(progress.resume(self.student, self.course.id),
+                             (self.course.id, self.modules[0].id))
+        response = self.client.get(reverse('student_resume'))
+        self.assertRedirects(response, reverse('student_course_detail_module',
+                                               args=[self.course.id, self.modules[0].id]))
+        response = self.client.get(reverse('student_course_list'))
+        self.assertContains(response, '100% completed')
+
+
+class StudentCoursePageTests(TestCase):
+    '''the course page of a student checks the enrollment against the cached
+        course ids and reuses the rendered contents while the course is unchanged
+    '''
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        progress.discard()
+        self.student = User.objects.create_user('student')
+        self.course = create_course()
+        self.owner = self.course.owner
+        self.course.students.add(self.student)
+        self.module = Module.objects.create(course=self.course, title='Intervals')
+        self.text = add_text(self.module)
+        self.url = reverse('student_course_detail_module',
+                           args=[self.course.id, self.module.id])
+        self.client.force_login(self.student)
+
+    def test_cached_page(self):
+        self.client.get(self.url)
+        # session, user, modules with their course, contents
+        with self.assertNumQueries(4):
+            self.assertContains(self.client.get(self.url), 'Major and minor')
+        self.text.content = 'Augmented and diminished'
+        self.text.save()
+        self.assertContains(self.client.get(self.url), 'Augmented and diminished')
+
+    def test_enrollment_seen_by_another_process(self):
+        other = create_course(self.owner, self.course.subject, 'Rhythm', 'rhythm', 'Beats')
+        url = reverse('student_course_detail', args=[other.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        # enrolled without this process dropping its cached course ids
+        Course.students.through.objects.create(course=other, user=self.student)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(is_enrolled(self.student, other.id))
+        self.assertFalse(is_enrolled(self.student, 0))
+
+
+class BulkEnrollTests(TestCase):
+    '''rosters of usernames or emails enroll every known user once
+    '''
+
+    roster = 'username\nada\nbob@example.com\nada\nnobody\ncyd\nbob\n'
+
+    def setUp(self):
+        caches['enrollments'].clear()
+        self.owner = User.objects.create_user('owner')
+        for name in ('ada', 'bob', 'cyd'):
+            User.objects.create_user(name, email='{}@example.com'.format(name))
+        self.course = create_course(self.owner)
+        self.url = reverse('student_bulk_enroll', args=[self.course.id])
+
+    def enrolled(self):
+        return sorted(self.course.students.values_list('username', flat=True))
+
+    def enroll(self, content, batch_size=2):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'wb') as roster:
+            roster.write(content)
+        out = io.StringIO()
+        call_command('enroll_students', self.course.id, path,
+                     batch_size=batch_size, stdout=out)
+        return out.getvalue()
+
+    def test_command(self):
+        self.assertIn('Enrolled 3 students, 2 skipped, 1 unknown',
+                      self.enroll(self.roster.encode()))
+        self.assertEqual(self.enrolled(), ['ada', 'bob', 'cyd'])
+        self.assertEqual(Course.objects.get(id=self.course.id).total_students, 3)
+        # running the roster again inserts nothing
+        self.assertIn('Enrolled 0 students, 5 skipped, 1 unknown',
+                      self.enroll(self.roster.encode(), batch_size=1000))
+        self.assertEqual(self.enrolled(), ['ada', 'bob', 'cyd'])
+
+    def test_command_encoding(self):
+        with self.assertRaisesMessage(CommandError, 'is not a UTF-8 encoded CSV file'):
+            self.enroll('ada\nbob\nzo\xe9\n'.encode('latin-1'), batch_size=1)
+        self.assertEqual(self.enrolled(), [])
+
+    def post(self, content):
+        self.client.force_login(self.owner)
+        return self.client.post(self.url, {'roster': SimpleUploadedFile('roster.csv', content)})
+
+    def test_view(self):
+        response = self.post(('\ufeff' + self.roster).encode())
+        self.assertContains(response, '3 students enrolled')
+        self.assertContains(response, '2 already enrolled')
+        self.assertContains(response, '1 unknown usernames or emails')
+        self.assertEqual(self.enrolled(), ['ada', 'bob', 'cyd'])
+        self.assertTrue(is_enrolled(User.objects.get(username='ada'), self.course.id))
+        self.assertContains(self.post(self.roster.encode()), '0 students enrolled')
+
+    def test_view_encoding(self):
+        response = self.post('ada\nzo\xe9\n'.encode('latin-1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', 'roster',
+                             'The roster must be a UTF-8 encoded CSV file.')
+        self.assertEqual(self.enrolled(), [])
+
+    def test_other_owner(self):
+        self.client.force_login(User.objects.get(username='ada'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
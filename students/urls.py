@@ -12,6 +12,12 @@ urlpatterns = [
     path('courses/',
          views.StudentCourseListView.as_view(),
          name='student_course_list'),
+    path('resume/',
+         views.StudentResumeView.as_view(),
+         name='student_resume'),
+    path('course/<pk>/roster/',
+         views.StudentBulkEnrollView.as_view(),
+         name='student_bulk_enroll'),
     path('course/<pk>/',
          views.StudentCourseDetailView.as_view(),
          name='student_course_detail'),
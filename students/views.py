@@ -1,3 +1,6 @@
+import functools
+import io
+
 from django.urls import reverse_lazy
 from django.views.generic.edit import CreateView
 from django.contrib.auth.forms import UserCreationForm
@@ -6,11 +9,21 @@ from django.views.generic.edit import FormView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
+from django.shortcuts import get_object_or_404, redirect
+from django.http import Http404
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, prefetch_related_objects
+from django.views.generic.base import View
 
 
 
-from .forms import CourseEnrollForm
-from courses.models import Course
+from .enrollment import bulk_enroll, read_identifiers, is_enrolled
+from .forms import CourseEnrollForm, BulkEnrollForm
+from .models import CourseProgress
+from . import progress
+from courses import analytics
+from courses.models import Course, Module
+from courses.pagination import KeysetPaginationMixin
 
 
 
@@ -48,16 +61,105 @@ class StudentEnrollCourseView(LoginRequiredMixin, FormView):
         return reverse_lazy('student_course_detail',
                             args=[self.course.id])
 
-class StudentCourseListView(LoginRequiredMixin, ListView):
-    '''this view lists all the courses students are enrolled in.
+class StudentBulkEnrollView(LoginRequiredMixin, FormView):
+    '''this view lets instructors enroll the students of a CSV roster in one of their courses.
+        the file is parsed as a stream and the students are enrolled in batches
+    '''
+
+    course = None
+    form_class = BulkEnrollForm
+    template_name = 'students/course/bulk_enroll.html'
+
+    def dispatch(self, request, pk):
+        if request.user.is_authenticated:
+            self.course = get_object_or_404(Course,
+                                            id=pk,
+                                            owner=request.user)
+        return super(StudentBulkEnrollView,
+                     self).dispatch(request, pk)
+
+    def get_context_data(self, **kwargs):
+        context = super(StudentBulkEnrollView,
+                        self).get_context_data(**kwargs)
+        context['course'] = self.course
+        return context
+
+    def form_valid(self, form):
+        roster = io.TextIOWrapper(form.cleaned_data['roster'].file,
+                                  encoding='utf-8-sig',
+                                  newline='')
+        try:
+            # a roster that fails to decode half way enrolls nobody
+            with transaction.atomic():
+                result = bulk_enroll(self.course, read_identifiers(roster))
+        except UnicodeDecodeError:
+            form.add_error('roster', 'The roster must be a UTF-8 encoded CSV file.')
+            return self.form_invalid(form)
+        return self.render_to_response(self.get_context_data(form=form,
+                                                             result=result))
+
+class StudentCourseListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    '''this view lists all the courses students are enrolled in, one page at a time.
     '''
 
     model = Course
     template_name = 'students/course/list.html'
+    # read only, its reads may go to a replica (educa/routers.py)
+    use_replica = True
 
     def get_queryset(self):
         qs = super(StudentCourseListView, self).get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        # the progress rollup of each course, in the same query
+        rollup = CourseProgress.objects.filter(user_id=self.request.user.id,
+                                               course_id=OuterRef('pk'))
+        return qs.filter(students__in=[self.request.user]) \
+                 .annotate(progress_percent=Subquery(rollup.values('percent')[:1]),
+                           resume_module_id=Subquery(rollup.values('last_module_id')[:1]))
+
+
+class StudentResumeView(LoginRequiredMixin, View):
+    '''takes students back to the module they viewed last
+    '''
+
+    def get(self, request):
+        last = progress.resume(request.user)
+        if last is None:
+            return redirect('student_course_list')
+        return redirect('student_course_detail_module', *last)
+
+
+def select_module(modules, module_id):
+    '''the module with module_id, or the first module when module_id is 0
+    '''
+
+    if module_id:
+        # get current module
+        module = next((m for m in modules if m.id == module_id), None)
+        if module is None:
+            raise Http404('No module found')
+        return module
+    # get first module
+    return modules[0] if modules else None
+
+
+def course_modules(course_id):
+    '''the modules of a course with the few columns of the course the page
+        shows, rather than all of them repeated on every module row
+    '''
+
+    return Module.objects.filter(course_id=course_id) \
+                         .select_related('course') \
+                         .only('course', 'title', 'description', 'order',
+                               'course__title', 'course__slug', 'course__updated')
+
+
+def with_items(contents):
+    '''loads the items of contents with one query per content type, called by
+        the template when the rendered contents aren't cached
+    '''
+
+    prefetch_related_objects(contents, 'item')
+    return contents
 
 
 class StudentCourseDetailView(DetailView):
@@ -66,21 +168,39 @@ class StudentCourseDetailView(DetailView):
 
     model = Course
     template_name = 'students/course/detail.html'
-
-    def get_queryset(self):
-        qs = super(StudentCourseDetailView, self).get_queryset()
-        return qs.filter(students__in=[self.request.user])
+    use_replica = True
+
+    def get_object(self, queryset=None):
+        '''checks the enrollment against the cached course ids of the user,
+            then loads the course together with all its modules in one query.
+            the course's updated timestamp versions the cached contents
+        '''
+
+        try:
+            course_id = int(self.kwargs['pk'])
+            module_id = int(self.kwargs.get('module_id', 0))
+        except ValueError:
+            raise Http404('No course found')
+        if not is_enrolled(self.request.user, course_id):
+            raise Http404('No course found')
+        self.modules = list(course_modules(course_id))
+        if self.modules:
+            course = self.modules[0].course
+        else:
+            course = get_object_or_404(Course, id=course_id)
+        self.module = select_module(self.modules, module_id)
+        return course
 
     def get_context_data(self, **kwargs):
         context = super(StudentCourseDetailView,
                         self).get_context_data(**kwargs)
-        # get course object
-        course = self.get_object()
-        if 'module_id' in self.kwargs:
-            # get current module
-            context['module'] = course.modules.get(
-                                    id=self.kwargs['module_id'])
-        else:
-            # get first module
-            context['module'] = course.modules.all()[0]
-        return context
\ No newline at end of file
+        context['modules'] = self.modules
+        context['module'] = self.module
+        context['contents'] = list(self.module.contents.all()) if self.module else []
+        # the items are only loaded when the rendered contents aren't cached
+        context['contents_with_items'] = functools.partial(with_items, context['contents'])
+        if self.module:
+            progress.record(self.request.user, self.module, context['contents'])
+            analytics.record(analytics.VIEW, self.request.user,
+                             [(content.id, self.object.id) for content in context['contents']])
+        return context